@@ -0,0 +1,298 @@
+# Standard library imports
+import io
+import subprocess
+import wave
+from typing import List, NamedTuple, Optional, Tuple
+
+# Third party imports
+import numpy as np
+
+# Analysis frame for voice activity detection
+VAD_FRAME_MS = 30
+
+
+class TimeMap:
+    """
+    Maps times in trimmed audio back to the original recording.
+
+    Each span records where a kept stretch of speech starts in the trimmed audio,
+    where it started in the original and how long it is.
+    """
+
+    def __init__(self, spans: List[Tuple[float, float, float]]):
+        self.spans = spans
+
+    def to_original(self, t: float) -> float:
+        if not self.spans:
+            return t
+        starts = np.array([span[0] for span in self.spans])
+        i = max(0, int(np.searchsorted(starts, t, side="right")) - 1)
+        start, original_start, length = self.spans[i]
+        return original_start + min(max(t - start, 0.0), length)
+
+
+class ProcessedAudio(NamedTuple):
+    wav: bytes
+    sample_rate: int
+    channels: int
+    original_duration: float
+    duration: float
+    time_map: TimeMap  # converts times in wav to times in the original
+
+
+def read_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decode 16-bit PCM WAV bytes into a (samples, channels) int16 array
+    """
+    with wave.open(io.BytesIO(data), "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+    samples = np.frombuffer(frames, dtype=np.int16)
+    return samples.reshape(-1, channels), sample_rate
+
+
+def write_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """
+    Encode a (samples, channels) int16 array as WAV bytes
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(samples).tobytes())
+    return buffer.getvalue()
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    return samples.mean(axis=1, keepdims=True)
+
+
+def resample(samples: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Linear-interpolation resampler. When downsampling, a moving average over the
+    decimation ratio is applied first as a cheap anti-aliasing filter.
+    """
+    if sample_rate == target_rate or len(samples) == 0:
+        return samples
+    ratio = sample_rate / target_rate
+    if ratio > 1:
+        width = int(round(ratio))
+        kernel = np.ones(width) / width
+        samples = np.stack(
+            [np.convolve(channel, kernel, mode="same") for channel in samples.T],
+            axis=1,
+        )
+    positions = np.arange(int(len(samples) / ratio)) * ratio
+    source = np.arange(len(samples))
+    return np.stack(
+        [np.interp(positions, source, channel) for channel in samples.T], axis=1
+    )
+
+
+def detect_speech(
+    mono: np.ndarray,
+    sample_rate: int,
+    threshold_db: float = -45.0,
+    margin_db: float = 10.0,
+    min_silence: float = 0.6,
+    padding: float = 0.2,
+) -> List[Tuple[int, int]]:
+    """
+    Energy-based voice activity detection.
+
+    The signal is cut into VAD_FRAME_MS frames and each frame's RMS level is
+    compared with a threshold of at least threshold_db (dBFS). Above that it
+    adapts to the recording: margin_db over the noise floor, but never closer
+    than margin_db under the speech level, so a recording with no pauses (whose
+    quietest frames are speech too) is kept rather than taken for noise. Speech
+    regions are padded and pauses shorter than min_silence are kept, so words
+    are not clipped and normal pauses survive. Returns (start, end) sample ranges.
+    """
+    frame = max(1, sample_rate * VAD_FRAME_MS // 1000)
+    count = len(mono) // frame
+    if count == 0:
+        return [(0, len(mono))] if len(mono) else []
+
+    frames = mono[: count * frame].reshape(count, frame) / 32768.0
+    level = 10 * np.log10(np.mean(frames**2, axis=1) + 1e-10)
+    noise_floor = np.percentile(level, 10)
+    speech_level = np.percentile(level, 90)
+    voiced = level > max(
+        threshold_db, min(noise_floor + margin_db, speech_level - margin_db)
+    )
+
+    # Widen each voiced frame by the padding and bridge short pauses
+    pad = int(round(padding * 1000 / VAD_FRAME_MS))
+    bridge = int(round(min_silence * 1000 / VAD_FRAME_MS))
+    reach = max(pad, bridge // 2)
+    voiced = np.convolve(voiced, np.ones(2 * reach + 1), mode="same") > 0
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(int), [0]))))
+    regions = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        regions.append((int(start) * frame, min(len(mono), int(end) * frame)))
+    return regions
+
+
+def normalize_loudness(
+    samples: np.ndarray, target_dbfs: float = -20.0, peak: float = 0.99
+) -> np.ndarray:
+    """
+    Scale samples to an RMS level of target_dbfs without clipping the peaks
+    """
+    if len(samples) == 0:
+        return samples
+    rms = np.sqrt(np.mean((samples / 32768.0) ** 2))
+    if rms <= 0:
+        return samples
+    gain = 10 ** (target_dbfs / 20) / rms
+    gain = min(gain, peak * 32767 / max(np.abs(samples).max(), 1))
+    return samples * gain
+
+
+def preprocess_audio(
+    wav: bytes,
+    target_rate: Optional[int] = 16000,
+    mono: bool = True,
+    trim_silence: bool = True,
+    target_dbfs: Optional[float] = -20.0,
+) -> ProcessedAudio:
+    """
+    Prepare a recording for transcription: optionally downmix and resample it,
+    cut out the silence between speech and normalize its loudness. The returned
+    time map converts timestamps in the processed audio back to the original.
+    """
+    samples, sample_rate = read_wav(wav)
+    original_duration = len(samples) / sample_rate
+    samples = samples.astype(np.float32)
+
+    if mono and samples.shape[1] > 1:
+        samples = downmix(samples)
+    if target_rate:
+        samples = resample(samples, sample_rate, target_rate)
+        sample_rate = target_rate
+
+    if trim_silence:
+        regions = detect_speech(samples.mean(axis=1), sample_rate)
+    else:
+        regions = [(0, len(samples))]
+    spans = []
+    position = 0
+    for start, end in regions:
+        spans.append(
+            (position / sample_rate, start / sample_rate, (end - start) / sample_rate)
+        )
+        position += end - start
+    if regions:
+        samples = np.concatenate([samples[start:end] for start, end in regions])
+    else:
+        samples = samples[:0]
+
+    if target_dbfs is not None:
+        samples = normalize_loudness(samples, target_dbfs)
+
+    pcm = np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+    return ProcessedAudio(
+        write_wav(pcm, sample_rate),
+        sample_rate,
+        pcm.shape[1],
+        original_duration,
+        len(pcm) / sample_rate,
+        TimeMap(spans),
+    )
+
+
+class EncodedAudio(NamedTuple):
+    data: bytes
+    mime_type: str
+    extension: str
+
+
+# Storage formats: ffmpeg encoder and container, MIME type and file extension
+AUDIO_FORMATS = {
+    "opus": (
+        ["-c:a", "libopus", "-application", "voip", "-f", "ogg"],
+        "audio/ogg",
+        ".opus",
+    ),
+    "flac": (["-c:a", "flac", "-f", "flac"], "audio/flac", ".flac"),
+}
+
+
+def merge_wavs(wavs: List[bytes]) -> Tuple[np.ndarray, int]:
+    """
+    Join recorded segments into one signal at the first segment's sample rate
+    and channel count, converting the others to match
+    """
+    merged = []
+    sample_rate = channels = None
+    for wav in wavs:
+        samples, rate = read_wav(wav)
+        if sample_rate is None:
+            sample_rate, channels = rate, samples.shape[1]
+        elif rate != sample_rate or samples.shape[1] != channels:
+            samples = samples.astype(np.float32)
+            if samples.shape[1] != channels:
+                samples = np.repeat(downmix(samples), channels, axis=1)
+            samples = resample(samples, rate, sample_rate)
+            samples = np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+        merged.append(samples)
+    if not merged:
+        return np.zeros((0, 1), dtype=np.int16), 16000
+    return np.concatenate(merged), sample_rate
+
+
+def encode_audio(
+    samples: np.ndarray,
+    sample_rate: int,
+    audio_format: str = "opus",
+    bitrate: str = "24k",
+) -> EncodedAudio:
+    """
+    Compress int16 samples to Opus (in Ogg) or FLAC by piping them through
+    ffmpeg. Falls back to WAV when ffmpeg is not installed.
+    """
+    codec_args, mime_type, extension = AUDIO_FORMATS[audio_format]
+    if audio_format == "opus":
+        codec_args = codec_args + ["-b:a", bitrate]
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "s16le",
+        "-ar",
+        str(sample_rate),
+        "-ac",
+        str(samples.shape[1]),
+        "-i",
+        "pipe:0",
+        *codec_args,
+        "pipe:1",
+    ]
+    try:
+        result = subprocess.run(
+            command,
+            input=np.ascontiguousarray(samples).tobytes(),
+            capture_output=True,
+            check=True,
+        )
+    except FileNotFoundError:
+        print("ffmpeg is not installed; storing audio as WAV.")
+        return EncodedAudio(write_wav(samples, sample_rate), "audio/wav", ".wav")
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg failed: {e.stderr.decode(errors='replace')}")
+    return EncodedAudio(result.stdout, mime_type, extension)
+
+
+def encode_wavs(
+    wavs: List[bytes], audio_format: str = "opus", bitrate: str = "24k"
+) -> EncodedAudio:
+    """
+    Merge WAV segments at the sample level and compress them for storage
+    """
+    samples, sample_rate = merge_wavs(wavs)
+    return encode_audio(samples, sample_rate, audio_format, bitrate)
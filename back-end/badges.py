@@ -0,0 +1,104 @@
+# Standard library imports
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class BadgeIndex:
+    """
+    In-memory map from wristband id to patient MRN, so a badge scan resolves
+    without a database round-trip.
+
+    The whole map is reloaded on startup and then periodically in the background.
+    A badge that is not in the map (e.g. a patient registered since the last
+    sync) falls back to a single lookup, and the answer is added to the map.
+
+    Between syncs the map can still hold a wristband's previous patient, so it
+    only answers whether a badge is known. Anything that attaches a record to
+    the patient calls confirm(), which checks the database and corrects the map.
+    """
+
+    def __init__(
+        self,
+        load_page: Callable[[int, int], List[Dict]],
+        lookup: Callable[[str], Optional[int]],
+        page_size: int = 1000,
+    ):
+        self.load_page = load_page
+        self.lookup = lookup
+        self.page_size = page_size
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+        self.corrections = 0
+        self.synced_at: Optional[float] = None
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Rebuild the map from the patient table, one page of rows at a time
+        """
+        index = {}
+        start = 0
+        while True:
+            rows = self.load_page(start, start + self.page_size - 1)
+            for row in rows:
+                if row.get("wristband_id"):
+                    index[row["wristband_id"]] = row["mrn"]
+            if len(rows) < self.page_size:
+                break
+            start += self.page_size
+
+        # Swap the new map in whole so scans never see a half-built one
+        with self._lock:
+            self._index = index
+            self.syncs += 1
+            self.synced_at = time.time()
+
+    async def resolve(self, badge_id: str) -> Optional[int]:
+        mrn = self._index.get(badge_id)
+        if mrn is not None:
+            self.hits += 1
+            return mrn
+
+        self.misses += 1
+        mrn = await asyncio.to_thread(self.lookup, badge_id)
+        if mrn is not None:
+            with self._lock:
+                self._index[badge_id] = mrn
+        return mrn
+
+    async def confirm(self, badge_id: str) -> Optional[int]:
+        """
+        Look the badge up in the database and bring the map in line with it
+        """
+        mrn = await asyncio.to_thread(self.lookup, badge_id)
+        with self._lock:
+            cached = self._index.get(badge_id)
+            if mrn is None:
+                self._index.pop(badge_id, None)
+            else:
+                self._index[badge_id] = mrn
+            if cached is not None and cached != mrn:
+                self.corrections += 1
+        return mrn
+
+    async def sync_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.load)
+            except Exception as e:
+                print(f"Badge index sync failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "syncs": self.syncs,
+            "corrections": self.corrections,
+            "synced_at": self.synced_at,
+        }
@@ -0,0 +1,647 @@
+# Standard library imports
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Third party imports
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+# Local imports
+from extraction import EHR_FIELDS
+from fixtures import (
+    length_prefixed,
+    pcm_chunks,
+    synthetic_jpeg_frames,
+    synthetic_speech,
+)
+from metrics import percentile
+
+# Mean response time of each stand-in provider, in seconds
+DEFAULT_LATENCY = {
+    "supabase": 0.02,
+    "storage": 0.1,
+    "deepgram": 0.5,
+    "mistral": 1.5,
+    "perplexity": 0.8,
+    "gemini": 2.0,
+}
+
+ENDPOINTS = ["process-medical-text", "upload-video", "badge-scan"]
+
+SAMPLE_RATE = 16000
+FILLER_WORDS = (
+    "patient reports mild pain in the left knee since last week worse on stairs "
+    "no fever taking ibuprofen twice daily denies numbness or swelling"
+).split()
+
+
+class Delay:
+    """
+    Response time of a stand-in provider: the mean, spread uniformly by +/- jitter
+    """
+
+    def __init__(self, mean: float, jitter: float):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        return max(0.0, self.mean * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+def filler_text(chars: int, offset: int = 0) -> str:
+    words = []
+    size = 0
+    while size < chars:
+        word = FILLER_WORDS[(offset + len(words)) % len(FILLER_WORDS)]
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+class FakeProviders:
+    """
+    Answers Deepgram, Mistral and Perplexity requests locally, after a delay, with
+    responses of a configurable size. Plugged into the provider pool as its
+    httpx transport.
+    """
+
+    def __init__(
+        self,
+        delays: Dict[str, Delay],
+        transcript_words: int,
+        note_chars: int,
+        error_rate: float = 0.0,
+    ):
+        self.delays = delays
+        self.error_rate = error_rate
+        self.transcript_words = transcript_words
+        self.note_chars = note_chars
+        self.transcriptions = 0
+        self.transport = httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if "deepgram" in host:
+            await asyncio.sleep(self.delays["deepgram"].sample())
+            return httpx.Response(200, json=self.transcription())
+        if "mistral" in host or "perplexity" in host:
+            await asyncio.sleep(self.delays[host.split(".")[-2]].sample())
+            if random.random() < self.error_rate:
+                # Overloaded: what the LLM gateway's retries and rate limits handle
+                return httpx.Response(
+                    random.choice([429, 503]), headers={"Retry-After": "1"}
+                )
+            return httpx.Response(
+                200, json=self.completion(json.loads(request.content))
+            )
+        return httpx.Response(404, json={"detail": f"No stand-in for {host}"})
+
+    def transcription(self) -> Dict:
+        # Every transcript opens differently, so its note is not an LLM cache hit
+        self.transcriptions += 1
+        words = []
+        for index in range(self.transcript_words):
+            word = FILLER_WORDS[index % len(FILLER_WORDS)]
+            if index == 0:
+                word = f"visit{self.transcriptions}"
+            words.append(
+                {
+                    "word": word,
+                    "punctuated_word": word,
+                    "start": index * 0.4,
+                    "end": index * 0.4 + 0.3,
+                    # Speakers take turns every 20 words
+                    "speaker": (index // 20) % 2,
+                }
+            )
+        transcript = " ".join(word["word"] for word in words)
+        alternative = {"words": words, "paragraphs": {"transcript": transcript}}
+        return {"results": {"channels": [{"alternatives": [alternative]}]}}
+
+    def completion(self, payload: Dict) -> Dict:
+        if payload.get("response_format", {}).get("type") == "json_object":
+            per_field = max(1, self.note_chars // len(EHR_FIELDS))
+            content = json.dumps(
+                {
+                    **{
+                        field: filler_text(per_field, index)
+                        for index, field in enumerate(EHR_FIELDS)
+                    },
+                    "type": "specialist",
+                }
+            )
+        else:
+            content = filler_text(self.note_chars)
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+class FakeQuery:
+    """
+    The subset of the Supabase query builder the benchmarked endpoints use
+    """
+
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.bounds: Optional[Tuple[int, int]] = None
+        self.filters: Dict = {}
+        self.inserted: Optional[Dict] = None
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, *args, **kwargs):
+        return self
+
+    def eq(self, column: str, value):
+        self.filters[column] = value
+        return self
+
+    def range(self, start: int, end: int):
+        self.bounds = (start, end)
+        return self
+
+    def insert(self, data: Dict):
+        self.inserted = data
+        return self
+
+    def update(self, data: Dict):
+        return self
+
+    def execute(self):
+        # The real client is synchronous, so this blocks its worker thread too
+        time.sleep(self.db.delays["supabase"].sample())
+        return SimpleNamespace(data=self.db.rows(self))
+
+
+class FakeBucket:
+    def __init__(self, db: "FakeSupabase", name: str):
+        self.db = db
+        self.name = name
+
+    def upload(self, path: str, data: bytes, file_options: Optional[Dict] = None):
+        time.sleep(self.db.delays["storage"].sample())
+        self.db.stored_bytes += len(data)
+
+    def create_signed_url(self, path: str, expires_in: int) -> Dict:
+        return {"signedURL": f"https://storage.invalid/{self.name}/{path}"}
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase client with a table of patients whose
+    badges can be scanned
+    """
+
+    def __init__(self, delays: Dict[str, Delay], patients: int):
+        self.delays = delays
+        self.patients = [
+            {"wristband_id": f"{1000 + mrn:x}", "mrn": mrn} for mrn in range(patients)
+        ]
+        self.visit_ids = iter(range(1, sys.maxsize))
+        self.stored_bytes = 0
+        self.storage = SimpleNamespace(from_=lambda name: FakeBucket(self, name))
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rows(self, query: FakeQuery) -> List[Dict]:
+        if query.inserted is not None:
+            return [{"id": next(self.visit_ids), **query.inserted}]
+        if query.table != "patient":
+            return []
+        if query.bounds is not None:
+            start, end = query.bounds
+            return self.patients[start : end + 1]
+        badge = query.filters.get("wristband_id")
+        return [row for row in self.patients if row["wristband_id"] == badge][:1]
+
+
+class FakeGemini:
+    """
+    Stands in for the google.genai module: Client().aio.models.generate_content
+    returns a visual assessment of vision_chars characters after a delay
+    """
+
+    def __init__(self, delay: Delay, vision_chars: int):
+        self.delay = delay
+        self.vision_chars = vision_chars
+
+    def Client(self, **kwargs):
+        return SimpleNamespace(aio=SimpleNamespace(models=self))
+
+    async def generate_content(self, model: str, contents: List):
+        await asyncio.sleep(self.delay.sample())
+        return SimpleNamespace(text=filler_text(self.vision_chars))
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Resident memory of this process and its children (the media workers), read
+    from /proc. Returns None where that is not available.
+    """
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        pids = [os.getpid()]
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page_size
+            except OSError:
+                pass  # The child exited between listing and reading
+        return total
+    except (OSError, ValueError):
+        return None
+
+
+def max_rss_bytes() -> int:
+    """
+    Fallback high-water mark for platforms without /proc
+    """
+    scale = 1 if sys.platform == "darwin" else 1024
+    return scale * (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+
+
+class RssSampler:
+    """
+    Polls the process tree's resident memory while a scenario runs and keeps
+    the peak
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _poll(self):
+        while True:
+            self.peak = max(self.peak, rss_bytes() or max_rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = rss_bytes() or max_rss_bytes()
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.peak
+
+
+def metric_totals(text: str, name: str) -> Dict[str, List[float]]:
+    """
+    [count, sum] of each labelled series of a histogram in /metrics output
+    """
+    totals: Dict[str, List[float]] = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name not in (name + "_count", name + "_sum"):
+                continue
+            labels = sample.labels
+            series = ", ".join(f"{label}={labels[label]}" for label in sorted(labels))
+            totals.setdefault(series, [0.0, 0.0])[
+                sample.name.endswith("_sum")
+            ] = sample.value
+    return totals
+
+
+def metric_breakdown(before: str, after: str, name: str) -> Dict[str, Dict]:
+    """
+    Calls and mean milliseconds per series of a histogram between two scrapes
+    """
+    start = metric_totals(before, name)
+    breakdown = {}
+    for series, (count, total) in metric_totals(after, name).items():
+        count -= start.get(series, [0.0, 0.0])[0]
+        total -= start.get(series, [0.0, 0.0])[1]
+        if count > 0:
+            breakdown[series] = {"calls": int(count), "mean_ms": 1000 * total / count}
+    return breakdown
+
+
+class Scenarios:
+    """
+    One request against each benchmarked endpoint. Each returns how long the
+    request took, not counting the time spent preparing its input.
+    """
+
+    def __init__(self, app_module, client: httpx.AsyncClient, args, db: FakeSupabase):
+        self.main = app_module
+        self.client = client
+        self.args = args
+        self.db = db
+
+        audio = synthetic_speech(args.audio_seconds, SAMPLE_RATE)
+        self.audio_chunks = pcm_chunks(audio, 2048)
+        frames = synthetic_jpeg_frames(
+            args.video_frames, args.frame_width, args.frame_height
+        )
+        self.video_frames = frames
+        self.video_upload = length_prefixed(frames)
+
+    async def process_medical_text(self, index: int) -> float:
+        # Each request has its own transcript so none is served from the LLM cache
+        raw_text = f"Visit {index} {time.time()}: " + filler_text(
+            self.args.transcript_chars, index
+        )
+        start = time.perf_counter()
+        response = await self.client.post(
+            "/process-medical-text", params={"raw_text": raw_text}
+        )
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200 or "error" in response.json():
+            raise RuntimeError(response.text[:200])
+        return elapsed
+
+    async def upload_video(self, index: int) -> float:
+        start = time.perf_counter()
+        response = await self.client.post(
+            "/upload-video",
+            files={
+                "file": ("video.bin", self.video_upload, "application/octet-stream")
+            },
+        )
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        os.remove(response.json()["path"])
+        return elapsed
+
+    async def badge_scan(self, index: int) -> float:
+        # Stream a recorded visit into a room's session, as the /ws client would
+        session_id = f"bench-{index}-{time.time_ns()}"
+        session = self.main.ingest_sessions.open(session_id)
+        await session.write_audio(self.audio_chunks)
+        # A distinct opening frame is always a keyframe, so the vision request
+        # is not an LLM cache hit either
+        opening = synthetic_jpeg_frames(
+            1, self.args.frame_width, self.args.frame_height, seed=index + 1
+        )
+        await session.write_video(opening + self.video_frames)
+
+        patient = random.choice(self.db.patients)
+        start = time.perf_counter()
+        response = await self.client.get(
+            f"/badge-scan/{patient['wristband_id']}",
+            params={"session_id": session_id},
+        )
+        response.raise_for_status()
+        status_url = response.json()["status_url"]
+
+        # The scan returns as soon as the job is queued; wait for the note
+        while True:
+            job = (await self.client.get(status_url)).json()
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(self.args.poll_interval)
+        elapsed = time.perf_counter() - start
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+        return elapsed
+
+
+async def run_scenario(
+    name: str,
+    request: Callable[[int], Awaitable[float]],
+    requests: int,
+    concurrency: int,
+    client: httpx.AsyncClient,
+) -> Dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(index: int):
+        async with semaphore:
+            try:
+                latencies.append(await request(index))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    before = (await client.get("/metrics")).text
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    wall = time.perf_counter() - start
+    peak = await sampler.stop()
+    after = (await client.get("/metrics")).text
+
+    return {
+        "endpoint": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "throughput_rps": len(latencies) / wall if wall > 0 else 0.0,
+        "peak_rss_mb": peak / 2**20,
+        "stages": metric_breakdown(before, after, "pipeline_stage_duration_seconds"),
+        "external_calls": metric_breakdown(
+            before, after, "external_call_duration_seconds"
+        ),
+    }
+
+
+def print_report(results: List[Dict]):
+    header = (
+        f"{'endpoint':<22}{'reqs':>6}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'req/s':>9}{'peak RSS MB':>13}"
+    )
+    print()
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['endpoint']:<22}{result['requests']:>6}{result['errors']:>8}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+            f"{result['p99_ms']:>10.1f}{result['throughput_rps']:>9.2f}"
+            f"{result['peak_rss_mb']:>13.1f}"
+        )
+
+    for result in results:
+        for error in result["error_samples"]:
+            print(f"{result['endpoint']} error: {error}")
+        for title, key in (("stage", "stages"), ("external call", "external_calls")):
+            if not result[key]:
+                continue
+            print(f"\n{result['endpoint']} by {title}:")
+            for series, numbers in sorted(result[key].items()):
+                print(
+                    f"  {series:<50}{numbers['calls']:>6} calls"
+                    f"{numbers['mean_ms']:>10.1f} ms mean"
+                )
+
+
+def configure_environment(workdir: str):
+    """
+    Point the app at throwaway local state before it is imported, so a .env with
+    real credentials is never used and uploads stay on local disk
+    """
+    os.environ.update(
+        {
+            "SUPABASE_URL": "http://supabase.invalid",
+            "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark",
+            "DEEPGRAM_KEY": "benchmark",
+            "MISTRAL_API_KEY": "benchmark",
+            "PERPLEXITY_API_KEY": "benchmark",
+            "GOOGLE_API_KEY": "benchmark",
+            "TRANSCRIPTION_ENGINE": "none",
+            "UPLOAD_BACKEND": "filesystem",
+            "UPLOAD_DIR": os.path.join(workdir, "storage"),
+            "JOBS_DB": os.path.join(workdir, "jobs.db"),
+            "LLM_CACHE_DB": os.path.join(workdir, "llm_cache.db"),
+            "INGEST_DIR": os.path.join(workdir, "ingest_sessions"),
+        }
+    )
+
+
+async def benchmark(args) -> List[Dict]:
+    import main
+
+    delays = {
+        service: Delay(args.latency_scale * latency, args.jitter)
+        for service, latency in {**DEFAULT_LATENCY, **args.latency}.items()
+    }
+    db = FakeSupabase(delays, args.patients)
+    main.supabase = db
+    main.google_genai = FakeGemini(delays["gemini"], args.vision_chars)
+    main.provider_pool.transport = FakeProviders(
+        delays, args.transcript_words, args.note_chars, args.error_rate
+    ).transport
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            scenarios = Scenarios(main, client, args, db)
+            requests = {
+                "process-medical-text": scenarios.process_medical_text,
+                "upload-video": scenarios.upload_video,
+                "badge-scan": scenarios.badge_scan,
+            }
+            for name in args.endpoints:
+                print(
+                    f"Benchmarking {name}: {args.requests} requests, "
+                    f"{args.concurrency} at a time"
+                )
+                results.append(
+                    await run_scenario(
+                        name, requests[name], args.requests, args.concurrency, client
+                    )
+                )
+    return results
+
+
+def parse_latency(value: str) -> Tuple[str, float]:
+    service, _, seconds = value.partition("=")
+    if service not in DEFAULT_LATENCY or not seconds:
+        raise argparse.ArgumentTypeError(
+            f"expected SERVICE=SECONDS with SERVICE one of {', '.join(DEFAULT_LATENCY)}"
+        )
+    return service, float(seconds)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the note-generation endpoints offline. Supabase, "
+        "storage, Deepgram, Mistral, Perplexity and Gemini are replaced by local "
+        "stand-ins with configurable latency and response sizes; the app's own "
+        "settings (NOTE_WORKERS, MEDIA_WORKERS, ...) are read from the environment "
+        "as usual."
+    )
+    parser.add_argument(
+        "--endpoints",
+        type=lambda value: value.split(","),
+        default=ENDPOINTS,
+        help=f"comma-separated subset of {','.join(ENDPOINTS)}",
+    )
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--latency",
+        type=parse_latency,
+        action="append",
+        default=[],
+        metavar="SERVICE=SECONDS",
+        help="override a stand-in's mean latency; may be repeated",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiply every latency, e.g. 0 to measure local work only",
+    )
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of LLM requests answered with a 429 or 503",
+    )
+    parser.add_argument("--audio-seconds", type=float, default=60.0)
+    parser.add_argument("--video-frames", type=int, default=300)
+    parser.add_argument("--frame-width", type=int, default=320)
+    parser.add_argument("--frame-height", type=int, default=240)
+    parser.add_argument("--transcript-chars", type=int, default=4000)
+    parser.add_argument("--transcript-words", type=int, default=600)
+    parser.add_argument("--note-chars", type=int, default=3000)
+    parser.add_argument("--vision-chars", type=int, default=1500)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--poll-interval", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    args.latency = dict(args.latency)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Recordings and job state go to a scratch directory that is removed afterwards
+    workdir = tempfile.mkdtemp(prefix="wing-note-benchmark-")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    configure_environment(workdir)
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(benchmark(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,197 @@
+# Standard library imports
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    In-process LRU cache with an optional time-to-live on every entry
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LLMCache:
+    """
+    Content-addressed cache for LLM responses.
+
+    Entries are keyed by a hash of the full request payload (model, messages and
+    parameters). Lookups go to an in-process LRU first, then to a SQLite table on
+    local disk. Entries can be tagged (e.g. with the visit they were built from)
+    so edits to the source record can drop them.
+    """
+
+    def __init__(self, path: str, maxsize: int):
+        self.memory = LRUCache(maxsize)
+        self.disk_hits = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache"
+            " (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache_tags"
+            " (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(payload: Dict) -> str:
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        self.disk_hits += 1
+        value = json.loads(row[0])
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = ()):
+        self.memory.set(key, value)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at)"
+                " VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO llm_cache_tags (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in tags],
+            )
+            self._db.commit()
+
+    def invalidate_tag(self, tag: str) -> int:
+        with self._lock:
+            keys = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT key FROM llm_cache_tags WHERE tag = ?", (tag,)
+                )
+            ]
+            self._db.executemany(
+                "DELETE FROM llm_cache WHERE key = ?", [(key,) for key in keys]
+            )
+            self._db.executemany(
+                "DELETE FROM llm_cache_tags WHERE key = ?", [(key,) for key in keys]
+            )
+            self._db.commit()
+        for key in keys:
+            self.memory.delete(key)
+        return len(keys)
+
+    def stats(self) -> Dict:
+        return {**self.memory.stats(), "disk_hits": self.disk_hits}
+
+
+class RecordCache:
+    """
+    Read-through cache for database records.
+
+    Each record (e.g. "visit:42") can be cached in several views, one per query
+    shape an endpoint uses. Invalidating a record drops all of its views. Lookups
+    that find nothing are not cached, so new rows show up immediately.
+
+    Every record has a generation that invalidation bumps. A load that overlaps
+    an invalidation may have read the old row, so its result is returned but not
+    stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.entries = LRUCache(maxsize, ttl)
+        self.invalidations = 0
+        self._views: Dict[str, set] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, record: str, view: str, load: Callable[[], Any]) -> Any:
+        value = self.entries.get((record, view), _MISSING)
+        if value is _MISSING:
+            with self._lock:
+                generation = self._generations.get(record, 0)
+            value = load()
+            if value is None:
+                return None
+            with self._lock:
+                if self._generations.get(record, 0) == generation:
+                    self.entries.set((record, view), value)
+                    self._views.setdefault(record, set()).add(view)
+        # Callers may modify the rows they get back
+        return copy.deepcopy(value)
+
+    def invalidate(self, record: str):
+        with self._lock:
+            self._generations[record] = self._generations.get(record, 0) + 1
+            views = self._views.pop(record, set())
+            self.invalidations += 1
+            for view in views:
+                self.entries.delete((record, view))
+
+    def stats(self) -> Dict:
+        return {**self.entries.stats(), "invalidations": self.invalidations}
@@ -0,0 +1,115 @@
+# Standard library imports
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MediaExecutor:
+    """
+    Process pool for CPU-bound media work with a bounded number of waiting jobs.
+
+    Handlers await run(); once every worker is busy and max_queue jobs are waiting,
+    further submissions fail fast with QueueFullError instead of piling up.
+
+    Jobs that are mostly file I/O, or that read from an open file (which cannot
+    be sent to another process), use run_in_thread() instead. The thread pool has
+    as many workers as the process pool, and jobs waiting for either one count
+    against the same max_queue. Each pool's depth is tracked separately.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = {"processes": 0, "threads": 0}
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Started lazily; spawn avoids forking the server's threads into the workers
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _get_threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="media"
+            )
+        return self._threads
+
+    def _queued(self, kind: str) -> int:
+        return max(0, self.in_flight[kind] - self.max_workers)
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued(kind) for kind in self.in_flight)
+
+    async def run(self, fn: Callable, *args):
+        return await self._submit("processes", self._get_pool(), fn, *args)
+
+    async def run_in_thread(self, fn: Callable, *args):
+        return await self._submit("threads", self._get_threads(), fn, *args)
+
+    async def _submit(self, kind: str, pool: Executor, fn: Callable, *args):
+        # Reject only jobs that would have to wait behind a full queue
+        if self.in_flight[kind] >= self.max_workers and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Media queue is full ({self.queued} jobs waiting)")
+
+        self.in_flight[kind] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(pool, fn, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight[kind] -= 1
+
+    def stats(self) -> Dict:
+        pools = {
+            kind: {
+                "running": min(in_flight, self.max_workers),
+                "queued": self._queued(kind),
+            }
+            for kind, in_flight in self.in_flight.items()
+        }
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.max_queue,
+            "running": sum(pool["running"] for pool in pools.values()),
+            "queued": self.queued,
+            **pools,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+
+
+def media_executor_from_env() -> MediaExecutor:
+    return MediaExecutor(
+        max_workers=int(os.environ.get("MEDIA_WORKERS", os.cpu_count() or 1)),
+        max_queue=int(os.environ.get("MEDIA_QUEUE_SIZE", 16)),
+    )
@@ -0,0 +1,122 @@
+# Standard library imports
+import re
+from collections import Counter
+from typing import Dict, List
+
+# The EHR fields every structured visit note has
+EHR_FIELDS = [
+    "cc",
+    "hpi",
+    "pmh",
+    "meds",
+    "allergies",
+    "ros",
+    "vitals",
+    "findings",
+    "diagnosis",
+    "plan",
+    "interventions",
+    "eval",
+    "discharge",
+]
+
+VISIT_TYPES = [
+    "emergency-room",
+    "hospital-stay",
+    "surgery-procedures",
+    "maternity-newborn",
+    "specialist",
+    "intensive",
+]
+
+
+def split_transcript(text: str, window_chars: int, overlap_chars: int) -> List[str]:
+    """
+    Split a diarized transcript into windows of roughly window_chars, breaking
+    between speaker paragraphs. Each window repeats the last overlap_chars of the
+    previous one, as whole paragraphs where they fit and otherwise as the tail of
+    the last paragraph, so statements on a boundary keep context.
+    """
+    if len(text) <= window_chars:
+        return [text]
+    overlap_chars = min(overlap_chars, window_chars // 2)
+
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        # A single monologue longer than a window is split between words, into
+        # pieces that still fit in a window after the carried overlap
+        piece_chars = window_chars - overlap_chars
+        while len(paragraph) > piece_chars:
+            cut = paragraph.rfind(" ", 0, piece_chars)
+            cut = cut if cut > 0 else piece_chars
+            paragraphs.append(paragraph[:cut])
+            paragraph = paragraph[cut:].strip()
+        paragraphs.append(paragraph)
+
+    windows = []
+    current: List[str] = []
+    size = 0
+    for paragraph in paragraphs:
+        if current and size + len(paragraph) > window_chars:
+            windows.append("\n\n".join(current))
+            # Carry trailing paragraphs over into the next window
+            carried: List[str] = []
+            carried_size = 0
+            for previous in reversed(current):
+                room = overlap_chars - carried_size
+                if len(previous) > room:
+                    # Too long to repeat whole: repeat its tail from a word boundary
+                    tail = previous[len(previous) - room :]
+                    tail = tail[tail.find(" ") + 1 :].strip()
+                    if tail:
+                        carried.insert(0, tail)
+                        carried_size += len(tail)
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous)
+            current, size = carried, carried_size
+        current.append(paragraph)
+        size += len(paragraph)
+    if current:
+        windows.append("\n\n".join(current))
+    return windows
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "; ".join(_as_text(item) for item in value if item)
+    if isinstance(value, dict):
+        return "; ".join(f"{key}: {_as_text(item)}" for key, item in value.items())
+    return str(value).strip()
+
+
+def merge_extractions(parts: List[Dict]) -> Dict:
+    """
+    Combine per-window extractions into one note. Each field keeps the distinct
+    sentences from every window in transcript order, so facts repeated by the
+    overlap between windows appear once. The visit type is a majority vote.
+    """
+    merged = {}
+    for field in EHR_FIELDS:
+        seen = set()
+        sentences = []
+        for part in parts:
+            for sentence in re.split(r"(?<=[.!?;])\s+|\n+", _as_text(part.get(field))):
+                sentence = sentence.strip()
+                key = re.sub(r"\W+", " ", sentence).strip().lower()
+                if key and key not in seen:
+                    seen.add(key)
+                    sentences.append(sentence)
+        merged[field] = " ".join(sentences)
+
+    votes = Counter(
+        part.get("type") for part in parts if part.get("type") in VISIT_TYPES
+    )
+    if votes:
+        merged["type"] = votes.most_common(1)[0][0]
+    return merged
@@ -0,0 +1,95 @@
+# Standard library imports
+from typing import Iterable, List
+
+# Third party imports
+import cv2
+import numpy as np
+
+# Local imports
+from media import VIDEO_HEIGHT, VIDEO_WIDTH
+
+
+def synthetic_speech(
+    seconds: float,
+    sample_rate: int = 16000,
+    channels: int = 1,
+    speech: float = 3.0,
+    pause: float = 1.5,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Int16 (samples, channels) audio that alternates stretches of speech-like sound
+    (a few harmonics with a syllable-rate envelope) with quiet pauses, so silence
+    trimming and voice activity detection have realistic work to do
+    """
+    rng = np.random.default_rng(seed)
+    count = int(seconds * sample_rate)
+    t = np.arange(count) / sample_rate
+
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    voice *= 0.5 + 0.5 * np.abs(np.sin(2 * np.pi * 4 * t))
+
+    talking = (t % (speech + pause)) < speech
+    signal = np.where(talking, 0.3 * voice, 0.0) + rng.normal(0, 0.002, count)
+    pcm = np.clip(signal * 32767, -32768, 32767).astype(np.int16)
+    return np.repeat(pcm[:, None], channels, axis=1)
+
+
+def pcm_chunks(samples: np.ndarray, frames_per_chunk: int = 1024) -> List[bytes]:
+    """
+    Split int16 samples into raw PCM buffers the size a capture device delivers
+    """
+    return [
+        np.ascontiguousarray(samples[start : start + frames_per_chunk]).tobytes()
+        for start in range(0, len(samples), frames_per_chunk)
+    ]
+
+
+def synthetic_jpeg_frames(
+    count: int,
+    width: int = VIDEO_WIDTH,
+    height: int = VIDEO_HEIGHT,
+    quality: int = 80,
+    scene_length: int = 50,
+    seed: int = 0,
+) -> List[bytes]:
+    """
+    JPEG frames of a shape moving over a textured background. The background
+    changes every scene_length frames, like a camera cutting to a new view, so
+    keyframe selection has scene changes to find.
+    """
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    frames = []
+    for index in range(count):
+        if index % scene_length == 0:
+            tint = rng.integers(0, 256, 3)
+            texture = rng.integers(0, 40, (height, width, 1))
+            background = (
+                (xs[..., None] * tint / width + ys[..., None] * (255 - tint) / height)
+                / 2
+                + texture
+            ).astype(np.uint8)
+        frame = background.copy()
+        angle = index / 10
+        center = (
+            int(width / 2 + width / 3 * np.cos(angle)),
+            int(height / 2 + height / 3 * np.sin(angle)),
+        )
+        cv2.circle(frame, center, max(4, height // 8), (255, 255, 255), -1)
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise RuntimeError("Could not encode a synthetic frame")
+        frames.append(encoded.tobytes())
+    return frames
+
+
+def length_prefixed(frames: Iterable[bytes]) -> bytes:
+    """
+    Frames in the length-prefixed layout /upload-video accepts
+    """
+    return b"".join(
+        len(frame).to_bytes(4, byteorder="little") + frame for frame in frames
+    )
@@ -0,0 +1,385 @@
+# Standard library imports
+import asyncio
+import io
+import json
+import os
+import shutil
+import struct
+import time
+import uuid
+import wave
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Local imports
+from protocol import SequenceTracker
+from transcription import LiveTranscript, LiveTranscriber
+
+# Sessions that have not received data for this long are dropped
+SESSION_IDLE_TIMEOUT = 60 * 60
+
+# Sessions detached by a badge scan wait for their job however long it is queued.
+# Once the job succeeds the session is removed; if it fails, the recording is
+# kept this long so the job can be retried.
+DETACHED_SESSION_RETENTION = float(
+    os.environ.get("DETACHED_SESSION_RETENTION", 7 * 24 * 60 * 60)
+)
+
+
+class SessionData(NamedTuple):
+    audio: bytes  # WAV file
+    video: bytes  # length-prefixed JPEG frames
+    video_times: List[float]  # when each frame was taken, on the audio's clock
+    transcript: Optional[LiveTranscript]  # live transcript, if one was produced
+
+
+class IngestSession:
+    """
+    Audio and video received on the /ws connection(s) of a single exam room.
+
+    The recording is appended to files in the session's own directory: raw PCM
+    for the audio, length-prefixed frames for the video and each frame's client
+    timestamp. A badge-scan job requeued after a restart can still finalize the
+    session from them.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        directory: str,
+        sample_rate: int,
+        channels: int,
+        sample_width: int,
+        transcriber: Optional[LiveTranscriber] = None,
+        audio_start_ms: Optional[int] = None,
+        detached_at: Optional[float] = None,
+    ):
+        self.session_id = session_id
+        self.directory = directory
+        # Wall-clock time a badge scan parked the session for its job, if it has
+        self.detached_at = detached_at
+        # Client time at which the first audio sample was captured
+        self.audio_start_ms = audio_start_ms
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.created_at = time.monotonic()
+        self.last_packet_at = self.created_at
+        self.closed = False
+        self.sequence = SequenceTracker()
+        self.transcriber = transcriber
+
+        # Only the connection(s) of this session and its badge scan contend here
+        self.lock = asyncio.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.save_info()
+        self.audio = open(os.path.join(directory, "audio.pcm"), "ab")
+        self.video = open(os.path.join(directory, "video.frames"), "ab")
+        self.video_times = open(os.path.join(directory, "video.times"), "ab")
+        self.audio_bytes = self.audio.tell()
+        self.video_frames = count_frames(self.video.name)
+
+    def save_info(self):
+        info = {
+            "session_id": self.session_id,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "sample_width": self.sample_width,
+            "audio_start_ms": self.audio_start_ms,
+            "detached_at": self.detached_at,
+        }
+        path = os.path.join(self.directory, "session.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(path + ".tmp", path)
+
+    async def write_audio(
+        self, chunks: List[bytes], timestamp_ms: Optional[int] = None
+    ):
+        async with self.lock:
+            if self.closed:
+                return
+            if self.audio_start_ms is None:
+                # The client stamps a frame when it sends it, after its audio
+                # was captured
+                timestamp_ms = timestamp_ms or int(time.time() * 1000)
+                captured = sum(len(data) for data in chunks)
+                bytes_per_ms = (
+                    self.sample_rate * self.channels * self.sample_width / 1000
+                )
+                self.audio_start_ms = timestamp_ms - round(captured / bytes_per_ms)
+                self.save_info()
+            for data in chunks:
+                self.audio.write(data)
+                self.audio_bytes += len(data)
+            # Flushed per packet so a crash loses at most the packet in flight
+            self.audio.flush()
+            self.last_packet_at = time.monotonic()
+
+        if self.transcriber is not None:
+            await self._transcribe(chunks)
+
+    async def _transcribe(self, chunks: List[bytes]):
+        try:
+            if not self.transcriber.started:
+                await self.transcriber.start()
+            for data in chunks:
+                await self.transcriber.send(data)
+        except Exception as e:
+            # The badge scan falls back to transcribing the recording afterwards
+            print(f"Live transcription failed for session {self.session_id}: {e}")
+            transcriber, self.transcriber = self.transcriber, None
+            if transcriber is not None and transcriber.started:
+                # Close the engine's connection rather than leave it open
+                try:
+                    await transcriber.finish()
+                except Exception:
+                    pass
+
+    async def write_video(
+        self, chunks: List[bytes], timestamp_ms: Optional[int] = None
+    ):
+        # Frames are stored length-prefixed, the same layout /upload-video accepts
+        timestamp_ms = timestamp_ms or int(time.time() * 1000)
+        async with self.lock:
+            if self.closed:
+                return
+            for data in chunks:
+                self.video_times.write(struct.pack("<q", timestamp_ms))
+                self.video.write(len(data).to_bytes(4, byteorder="little"))
+                self.video.write(data)
+                self.video_frames += 1
+            self.video_times.flush()
+            self.video.flush()
+            self.last_packet_at = time.monotonic()
+
+    async def finalize(self) -> SessionData:
+        """
+        Close the session and return its WAV audio, length-prefixed video frames
+        and live transcript. The files stay on disk until the session is removed.
+        """
+        async with self.lock:
+            self.closed = True
+            self.audio.close()
+            self.video.close()
+            self.video_times.close()
+            with open(self.audio.name, "rb") as f:
+                pcm = f.read()
+            with open(self.video.name, "rb") as f:
+                video_data = f.read()
+            with open(self.video_times.name, "rb") as f:
+                stamps = [stamp for (stamp,) in struct.iter_unpack("<q", f.read())]
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(self.channels)
+            wav_file.setsampwidth(self.sample_width)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(pcm)
+
+        transcript = None
+        transcriber, self.transcriber = self.transcriber, None
+        if transcriber is not None and transcriber.started:
+            try:
+                transcript = await transcriber.finish()
+            except Exception as e:
+                print(f"Live transcription failed for session {self.session_id}: {e}")
+        return SessionData(
+            buffer.getvalue(), video_data, self.frame_times(stamps), transcript
+        )
+
+    def frame_times(self, stamps: List[int]) -> List[float]:
+        """
+        Convert frame timestamps to seconds from the start of the audio, or from
+        the first frame when the session has no audio
+        """
+        # A crash between the two writes can leave a frame without a timestamp
+        stamps = stamps[: self.video_frames]
+        if stamps and len(stamps) < self.video_frames:
+            stamps += [stamps[-1]] * (self.video_frames - len(stamps))
+        if not stamps:
+            return []
+        start = self.audio_start_ms if self.audio_start_ms is not None else stamps[0]
+        return [max(0.0, (stamp - start) / 1000) for stamp in stamps]
+
+    async def discard(self):
+        async with self.lock:
+            self.closed = True
+            self.audio.close()
+            self.video.close()
+            self.video_times.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+        if self.transcriber is not None and self.transcriber.started:
+            try:
+                await self.transcriber.finish()
+            except Exception:
+                pass
+
+
+def count_frames(path: str) -> int:
+    """
+    Number of complete frames in a length-prefixed frame file
+    """
+    count = 0
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while f.tell() + 4 <= size:
+            length = int.from_bytes(f.read(4), byteorder="little")
+            if f.tell() + length > size:
+                break
+            f.seek(length, os.SEEK_CUR)
+            count += 1
+    return count
+
+
+class IngestRegistry:
+    """
+    Open ingest sessions keyed by the session id the streaming client connects with
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: int,
+        channels: int,
+        sample_width: int,
+        transcriber_factory: Optional[Callable[[], LiveTranscriber]] = None,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.transcriber_factory = transcriber_factory
+        self._sessions: Dict[str, IngestSession] = {}
+        self._restore()
+
+    def _restore(self):
+        # Sessions left on disk by an earlier run are picked up again, without
+        # a live transcriber since their stream was cut off
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(path, "session.json")) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            self._sessions[info["session_id"]] = IngestSession(
+                info["session_id"],
+                path,
+                info["sample_rate"],
+                info["channels"],
+                info["sample_width"],
+                audio_start_ms=info.get("audio_start_ms"),
+                detached_at=info.get("detached_at"),
+            )
+        if self._sessions:
+            print(f"Restored {len(self._sessions)} ingest sessions from disk.")
+
+    def open(self, session_id: str) -> IngestSession:
+        # A client that reconnects keeps appending to its existing session
+        session = self._sessions.get(session_id)
+        if session is None or session.closed:
+            transcriber = None
+            if self.transcriber_factory is not None:
+                transcriber = self.transcriber_factory()
+            session = IngestSession(
+                session_id,
+                os.path.join(self.directory, uuid.uuid4().hex),
+                self.sample_rate,
+                self.channels,
+                self.sample_width,
+                transcriber,
+            )
+            self._sessions[session_id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[IngestSession]:
+        return self._sessions.get(session_id)
+
+    def detach(self, session_id: str) -> Optional[str]:
+        """
+        Stop recording into a session and park it under a new unique key, so the
+        room's next packets start a fresh session while this one awaits processing
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        detached_id = f"{session_id}:{uuid.uuid4().hex}"
+        session.session_id = detached_id
+        session.detached_at = time.time()
+        session.save_info()
+        self._sessions[detached_id] = session
+        return detached_id
+
+    async def finalize(self, session_id: str) -> Optional[SessionData]:
+        """
+        Return a session's recorded data, or None if it is unknown. The session
+        keeps its files until it is removed, so a job that is interrupted after
+        this point can finalize it again.
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        return await session.finalize()
+
+    async def remove(self, session_id: str):
+        """
+        Delete a processed session and its files
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            await session.discard()
+
+    async def discard(self, session_id: str) -> bool:
+        """
+        Drop a session and its recorded data without processing it
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        await session.discard()
+        return True
+
+    async def prune(
+        self,
+        max_idle: float = SESSION_IDLE_TIMEOUT,
+        retention: float = DETACHED_SESSION_RETENTION,
+    ):
+        """
+        Drop sessions whose stream was abandoned, and detached sessions whose job
+        never removed them within the retention period
+        """
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if session.detached_at is not None:
+                expired = time.time() - session.detached_at > retention
+            else:
+                expired = now - session.last_packet_at > max_idle
+            if expired:
+                self._sessions.pop(session_id, None)
+                await session.discard()
+
+    async def prune_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"Ingest session pruning failed: {e}")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict:
+        return {
+            session_id: {
+                "audio_bytes": session.audio_bytes,
+                "video_frames": session.video_frames,
+                "idle_seconds": round(time.monotonic() - session.last_packet_at, 1),
+                "detached": session.detached_at is not None,
+                **session.sequence.stats(),
+            }
+            for session_id, session in self._sessions.items()
+        }
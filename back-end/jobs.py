@@ -0,0 +1,220 @@
+# Standard library imports
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Called with (stage name, fraction complete) while a job runs
+ProgressCallback = Callable[[str, float], Awaitable]
+# Called with (job id, params, progress). The id stays the same when a job is
+# requeued, so handlers can name their outputs after it and pick up where they left off.
+JobHandler = Callable[[str, Dict, ProgressCallback], Awaitable]
+
+
+class JobStore:
+    """
+    Job table in a local SQLite file, so queued work survives a restart
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+        )
+        self._db.commit()
+
+    def create(self, kind: str, params: Dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), QUEUED, now, now),
+            )
+            self._db.commit()
+        return job_id
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Mark the oldest queued job as running and return it
+        """
+        with self._lock:
+            row = self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ("
+                " SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1"
+                ") RETURNING *",
+                (RUNNING, time.time(), QUEUED),
+            ).fetchone()
+            self._db.commit()
+        return self._to_dict(row)
+
+    def update(self, job_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            return self._to_dict(row.fetchone())
+
+    def requeue_running(self) -> int:
+        # Jobs that were running when the server stopped start over
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = 0"
+                " WHERE status = ?",
+                (QUEUED, RUNNING),
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def retry(self, job_id: str) -> bool:
+        """
+        Queue a failed job to run again with the same id and params
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = 0, error = NULL,"
+                " updated_at = ? WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, FAILED),
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _to_dict(row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+
+class JobQueue:
+    """
+    Worker tasks that drain the job table, plus push updates for subscribers
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, JobHandler], workers: int):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def start(self):
+        requeued = self.store.requeue_running()
+        if requeued:
+            print(f"Requeued {requeued} interrupted jobs.")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, kind: str, params: Dict) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.store.create(kind, params)
+        self._wakeup.set()
+        return job_id
+
+    def retry(self, job_id: str) -> bool:
+        if not self.store.retry(job_id):
+            return False
+        self._wakeup.set()
+        return True
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+    def _update(self, job_id: str, **fields):
+        self.store.update(job_id, **fields)
+        job = self.store.get(job_id)
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait(job)
+
+    async def _worker(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict):
+        job_id = job["id"]
+        self._update(job_id, status=RUNNING)
+
+        async def progress(stage: str, fraction: float):
+            self._update(job_id, stage=stage, progress=fraction)
+
+        try:
+            result = await self.handlers[job["kind"]](job_id, job["params"], progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+        else:
+            self._update(job_id, status=DONE, progress=1.0, result=result)
@@ -0,0 +1,430 @@
+# Standard library imports
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+# Third party imports
+import httpx
+
+# Local imports
+from cache import LLMCache
+from metrics import LLM_GATEWAY_EVENTS, LLM_RATE_LIMIT, percentile
+from providers import ProviderError, ProviderPool, retry_after
+
+# Statuses worth retrying: rate limiting, timeouts and server-side failures
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Recent call latencies kept per provider to pick the hedging delay
+LATENCY_WINDOW = 100
+
+
+class RateLimit(NamedTuple):
+    rate: float  # requests per second; 0 for no limit
+    burst: int
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter that adapts to the provider.
+
+    A 429 halves the allowed rate and holds every request for the Retry-After
+    period; each success afterwards wins back a tenth of the configured rate, so
+    the limiter settles just under what the provider actually accepts.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate) if rate > 0 else 0.0
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Waiters are served in arrival order
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        if self.max_rate <= 0:
+            return True
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        if self.max_rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self, retry_after: Optional[float] = None):
+        if self.max_rate <= 0:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def recover(self):
+        if self.max_rate > 0 and self.rate < self.max_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class SharedStream:
+    """
+    A completion being streamed once and read by every caller that asked for it.
+    Late joiners first replay the deltas that already arrived.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def push(self, delta: str):
+        self.parts.append(delta)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.parts):
+                yield self.parts[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamInterrupted(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, ProviderError):
+        return error.status_code in RETRY_STATUSES or error.status_code >= 500
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    # SDK errors such as google.genai's carry the HTTP status as code
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and (code in RETRY_STATUSES or code >= 500)
+
+
+class LLMGateway:
+    """
+    Single entry point for LLM calls, whichever provider serves them.
+
+    Each call is looked up in the response cache first. Identical calls already
+    in flight are coalesced, so concurrent callers share one request (or one
+    stream). Requests pass a per-provider token bucket, are retried with
+    jittered exponential backoff on 429, 5xx and network errors, and a call
+    still running past the provider's recent hedge_quantile latency gets a
+    second, hedged request; whichever answers first wins.
+    """
+
+    def __init__(
+        self,
+        pool: ProviderPool,
+        cache: LLMCache,
+        limits: Dict[str, RateLimit],
+        retries: int = 3,
+        backoff: float = 0.5,
+        hedge: bool = True,
+        hedge_quantile: float = 95.0,
+        min_hedge_delay: float = 2.0,
+        min_hedge_samples: int = 20,
+    ):
+        self.pool = pool
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.min_hedge_samples = min_hedge_samples
+        self.buckets = {
+            name: TokenBucket(limit.rate, limit.burst) for name, limit in limits.items()
+        }
+        for name, bucket in self.buckets.items():
+            LLM_RATE_LIMIT.labels(name).set_function(lambda bucket=bucket: bucket.rate)
+        self._latencies: Dict[str, deque] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, SharedStream] = {}
+
+    def _bucket(self, provider: str) -> TokenBucket:
+        if provider not in self.buckets:
+            self.buckets[provider] = TokenBucket(0, 1)
+        return self.buckets[provider]
+
+    def _event(self, provider: str, event: str):
+        LLM_GATEWAY_EVENTS.labels(provider, event).inc()
+
+    async def complete(
+        self,
+        provider: str,
+        payload: Dict,
+        tags: Iterable[str] = (),
+        cache: bool = True,
+        path: str = "/chat/completions",
+    ) -> Dict:
+        """
+        A chat completion from an OpenAI-style provider in the provider pool
+        """
+
+        async def post() -> Dict:
+            response = await self.pool.post(provider, path, json=payload)
+            if response.status_code != 200:
+                raise ProviderError(
+                    provider, response.status_code, retry_after(response)
+                )
+            return response.json()
+
+        return await self.call(provider, self.cache.key(payload), post, tags, cache)
+
+    async def call(
+        self,
+        provider: str,
+        key: str,
+        request: Callable[[], Awaitable[Any]],
+        tags: Iterable[str] = (),
+        cache: bool = True,
+    ) -> Any:
+        """
+        Run any LLM request (e.g. an SDK call) through the cache, coalescing,
+        rate limit, retries and hedging. key identifies the request's content.
+        """
+        if cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._event(provider, "cache_hit")
+                return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._event(provider, "coalesced")
+        else:
+            task = asyncio.create_task(self._fetch(provider, key, request, tags, cache))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller going away does not cancel the others' request
+        return await asyncio.shield(task)
+
+    async def _fetch(self, provider, key, request, tags, cache) -> Any:
+        result = await self._with_retries(
+            provider, lambda: self._hedged(provider, request)
+        )
+        if cache:
+            self.cache.set(key, result, tags)
+        return result
+
+    async def _with_retries(self, provider: str, attempt: Callable[[], Awaitable[Any]]):
+        for number in range(self.retries + 1):
+            try:
+                result = await attempt()
+            except Exception as e:
+                if number == self.retries or not is_retryable(e):
+                    raise
+                await self._back_off(provider, number, e)
+            else:
+                self._bucket(provider).recover()
+                return result
+
+    async def _back_off(self, provider: str, attempt: int, error: BaseException):
+        wait = random.uniform(0, self.backoff * 2**attempt)
+        requested = getattr(error, "retry_after", None)
+        if getattr(error, "status_code", getattr(error, "code", None)) == 429:
+            self._event(provider, "rate_limited")
+            self._bucket(provider).throttle(requested)
+        self._event(provider, "retry")
+        print(f"Retrying {provider} call after {error}")
+        await asyncio.sleep(max(wait, requested or 0.0))
+
+    def _hedge_delay(self, provider: str) -> Optional[float]:
+        latencies = self._latencies.get(provider)
+        if not self.hedge or latencies is None:
+            return None
+        if len(latencies) < self.min_hedge_samples:
+            return None
+        return max(
+            self.min_hedge_delay, percentile(list(latencies), self.hedge_quantile)
+        )
+
+    async def _hedged(self, provider: str, request: Callable[[], Awaitable[Any]]):
+        bucket = self._bucket(provider)
+        await bucket.acquire()
+        started: Dict[asyncio.Task, float] = {}
+
+        def launch():
+            task = asyncio.create_task(request())
+            started[task] = time.monotonic()
+            return task
+
+        pending = {launch()}
+        try:
+            delay = self._hedge_delay(provider)
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                # Hedge only with spare capacity, never by waiting on the limiter
+                if not done and bucket.try_acquire():
+                    self._event(provider, "hedged")
+                    pending.add(launch())
+
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        elapsed = time.monotonic() - started[task]
+                        self._latencies.setdefault(
+                            provider, deque(maxlen=LATENCY_WINDOW)
+                        ).append(elapsed)
+                        if len(started) > 1 and task is not next(iter(started)):
+                            self._event(provider, "hedge_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(
+        self,
+        provider: str,
+        payload: Dict,
+        tags: Iterable[str] = (),
+        cache: bool = True,
+        path: str = "/chat/completions",
+    ) -> AsyncIterator[str]:
+        """
+        Yield a chat completion's text as it is generated. A cached completion is
+        yielded whole, and callers streaming an identical request share it.
+        Streams are retried only until their first token and are not hedged.
+        """
+        key = self.cache.key(payload)
+        if cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._event(provider, "cache_hit")
+                yield cached["choices"][0]["message"]["content"]
+                return
+
+        shared = self._streams.get(key)
+        if shared is not None:
+            self._event(provider, "coalesced")
+        else:
+            shared = SharedStream()
+            self._streams[key] = shared
+            shared.task = asyncio.create_task(
+                self._produce(provider, path, payload, key, tags, cache, shared)
+            )
+        async for delta in shared.follow():
+            yield delta
+
+    async def _produce(self, provider, path, payload, key, tags, cache, shared):
+        async def attempt():
+            await self._bucket(provider).acquire()
+            try:
+                async for chunk in self.pool.stream_events(provider, path, payload):
+                    choices = chunk.get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        shared.push(delta)
+            except Exception as e:
+                if shared.parts:
+                    # Tokens already reached the callers, so it cannot be retried
+                    raise StreamInterrupted(str(e)) from e
+                raise
+
+        try:
+            await self._with_retries(provider, attempt)
+            if cache:
+                # Stored in the same shape as a non-streamed response
+                content = "".join(shared.parts)
+                self.cache.set(
+                    key,
+                    {
+                        "choices": [
+                            {"message": {"role": "assistant", "content": content}}
+                        ]
+                    },
+                    tags,
+                )
+            shared.finish()
+        except Exception as e:
+            shared.finish(e)
+        finally:
+            self._streams.pop(key, None)
+
+
+def llm_gateway_from_env(
+    pool: ProviderPool, cache: LLMCache, providers: Iterable[str]
+) -> LLMGateway:
+    """
+    Build the gateway with each provider's rate limit from <NAME>_RATE_LIMIT
+    (requests per second, 0 for none) and <NAME>_RATE_BURST
+    """
+    limits = {
+        name: RateLimit(
+            float(os.environ.get(f"{name.upper()}_RATE_LIMIT", 10)),
+            int(os.environ.get(f"{name.upper()}_RATE_BURST", 20)),
+        )
+        for name in providers
+    }
+    return LLMGateway(
+        pool,
+        cache,
+        limits,
+        retries=int(os.environ.get("LLM_RETRIES", 3)),
+        backoff=float(os.environ.get("LLM_RETRY_BACKOFF", 0.5)),
+        hedge=os.environ.get("LLM_HEDGE", "true").lower() == "true",
+        hedge_quantile=float(os.environ.get("LLM_HEDGE_QUANTILE", 95)),
+        min_hedge_delay=float(os.environ.get("LLM_HEDGE_MIN_DELAY", 2)),
+    )
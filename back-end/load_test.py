@@ -0,0 +1,474 @@
+# Standard library imports
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+# Third party imports
+import cv2
+import httpx
+import numpy as np
+import websockets
+from prometheus_client.parser import text_string_to_metric_families
+
+# Local imports
+from audio import downmix, read_wav, resample
+from fixtures import pcm_chunks, synthetic_jpeg_frames, synthetic_speech
+from media import VIDEO_FRAME_RATE, iter_jpeg_frames
+from metrics import percentile
+from protocol import AUDIO_PACKET, VIDEO_PACKET, encode_frame
+
+# The format /ws audio is stored in
+SAMPLE_RATE = 16000
+CHANNELS = 1
+
+
+class Recording(NamedTuple):
+    audio_chunks: List[bytes]  # raw 16-bit PCM buffers
+    video_frames: List[bytes]  # JPEG images
+    audio_interval: float  # seconds of audio in each /ws frame
+    video_interval: float  # seconds between video frames
+
+
+def load_audio(path: str) -> np.ndarray:
+    """
+    Read a WAV file (converted to 16 kHz mono) or raw 16 kHz mono s16le PCM
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not path.lower().endswith(".wav"):
+        return np.frombuffer(data, dtype=np.int16).reshape(-1, CHANNELS)
+
+    samples, sample_rate = read_wav(data)
+    if samples.shape[1] == CHANNELS and sample_rate == SAMPLE_RATE:
+        return samples
+    converted = resample(downmix(samples.astype(np.float32)), sample_rate, SAMPLE_RATE)
+    return np.clip(np.round(converted), -32768, 32767).astype(np.int16)
+
+
+def load_video(path: str, quality: int) -> List[bytes]:
+    """
+    Read JPEG frames from a directory of .jpg files, a length-prefixed frame
+    stream (the /upload-video layout) or any video file OpenCV can decode
+    """
+    if os.path.isdir(path):
+        frames = []
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith((".jpg", ".jpeg")):
+                with open(os.path.join(path, name), "rb") as f:
+                    frames.append(f.read())
+        return frames
+
+    with open(path, "rb") as f:
+        head = f.read(6)
+    if head[4:6] == b"\xff\xd8":  # a length prefix followed by a JPEG marker
+        with open(path, "rb") as f:
+            return [bytes(frame) for frame in iter_jpeg_frames(f.read())]
+
+    frames = []
+    video = cv2.VideoCapture(path)
+    try:
+        while True:
+            success, frame = video.read()
+            if not success:
+                break
+            _, encoded = cv2.imencode(
+                ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality]
+            )
+            frames.append(encoded.tobytes())
+    finally:
+        video.release()
+    return frames
+
+
+def load_recording(args) -> Recording:
+    if args.audio:
+        samples = load_audio(args.audio)
+    else:
+        samples = synthetic_speech(60, SAMPLE_RATE, CHANNELS)
+    if args.video:
+        frames = load_video(args.video, args.jpeg_quality)
+    else:
+        frames = synthetic_jpeg_frames(int(60 * args.fps), quality=args.jpeg_quality)
+    if len(samples) == 0 or not frames:
+        raise SystemExit("The recording has no audio or no video frames")
+
+    return Recording(
+        pcm_chunks(samples, args.frames_per_buffer),
+        frames,
+        args.frames_per_buffer * args.buffers_per_frame / SAMPLE_RATE,
+        1 / args.fps,
+    )
+
+
+class SessionReport:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.audio_frames = 0
+        self.video_frames = 0
+        self.bytes_sent = 0
+        self.late = 0
+        self.send_seconds: List[float] = []
+        self.connect_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def frames_sent(self) -> int:
+        return self.audio_frames + self.video_frames
+
+
+async def stream_session(
+    url: str, session_id: str, recording: Recording, args, delay: float
+) -> SessionReport:
+    """
+    Replay the recording on one /ws connection for args.duration seconds of media
+    time, interleaving audio and video frames on their own schedules the way a
+    capture client does. With args.speed 2 the same media is sent in half the
+    time; with 0 it is sent as fast as the connection takes it.
+    """
+    report = SessionReport(session_id)
+    await asyncio.sleep(delay)
+    try:
+        start = time.perf_counter()
+        async with websockets.connect(
+            f"{url}/ws?session_id={session_id}", max_size=None
+        ) as websocket:
+            report.connect_seconds = time.perf_counter() - start
+
+            sequence = 0
+            audio_index = video_index = 0
+            next_audio = next_video = 0.0  # media time of the next frame
+            start = time.perf_counter()
+            while min(next_audio, next_video) < args.duration:
+                is_audio = next_audio <= next_video
+                media_time = next_audio if is_audio else next_video
+                interval = (
+                    recording.audio_interval if is_audio else recording.video_interval
+                )
+
+                if args.speed > 0:
+                    due = start + media_time / args.speed
+                    wait = due - time.perf_counter()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    elif -wait > interval / args.speed:
+                        # More than a frame behind: a real client would drop data
+                        report.late += 1
+
+                if is_audio:
+                    chunks = []
+                    for _ in range(args.buffers_per_frame):
+                        chunks.append(
+                            recording.audio_chunks[
+                                audio_index % len(recording.audio_chunks)
+                            ]
+                        )
+                        audio_index += 1
+                    frame = encode_frame(AUDIO_PACKET, sequence, chunks)
+                    next_audio += interval
+                    report.audio_frames += 1
+                else:
+                    image = recording.video_frames[
+                        video_index % len(recording.video_frames)
+                    ]
+                    video_index += 1
+                    frame = encode_frame(VIDEO_PACKET, sequence, [image])
+                    next_video += interval
+                    report.video_frames += 1
+
+                # send() waits for the socket to drain, so this shows backpressure
+                sent_at = time.perf_counter()
+                await websocket.send(frame)
+                report.send_seconds.append(time.perf_counter() - sent_at)
+                report.bytes_sent += len(frame)
+                sequence += 1
+    except Exception as e:
+        report.error = f"{type(e).__name__}: {e}"
+    return report
+
+
+class MetricsWatcher:
+    """
+    Scrapes the server's /metrics while the test runs, keeping the first and
+    last scrape and the peak resident memory seen
+    """
+
+    def __init__(self, client: httpx.AsyncClient, interval: float):
+        self.client = client
+        self.interval = interval
+        self.first: Optional[str] = None
+        self.last: Optional[str] = None
+        self.memory: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def scrape(self):
+        try:
+            text = (await self.client.get("/metrics")).text
+        except httpx.HTTPError as e:
+            print(f"Could not scrape /metrics: {e}")
+            return
+        self.first = self.first or text
+        self.last = text
+        for sample in scraped_samples(text):
+            if sample.name == "process_resident_memory_bytes":
+                self.memory.append(sample.value)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.scrape()
+
+    async def start(self):
+        await self.scrape()
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self.scrape()
+
+
+def scraped_samples(text: str):
+    """
+    Every sample in a scrape of /metrics
+    """
+    for family in text_string_to_metric_families(text):
+        yield from family.samples
+
+
+def counter_delta(before: str, after: str, name: str) -> Dict[str, float]:
+    """
+    Increase of each series of a counter between two scrapes, keyed by packet type
+    """
+    start = {
+        sample.labels.get("packet", ""): sample.value
+        for sample in scraped_samples(before)
+        if sample.name == name + "_total"
+    }
+    return {
+        sample.labels.get("packet", ""): sample.value
+        - start.get(sample.labels.get("packet", ""), 0.0)
+        for sample in scraped_samples(after)
+        if sample.name == name + "_total"
+    }
+
+
+def lag_quantiles(before: str, after: str) -> Dict[str, Dict[str, float]]:
+    """
+    p50/p95/p99 of the server's per-frame ingest lag over the test, by packet type,
+    each rounded up to the histogram bucket bound it falls under
+    """
+    buckets: Dict[str, Dict[float, float]] = {}
+    for sign, text in ((-1, before), (1, after)):
+        for sample in scraped_samples(text):
+            if sample.name != "ingest_frame_lag_seconds_bucket":
+                continue
+            series = buckets.setdefault(sample.labels["packet"], {})
+            bound = float(sample.labels["le"])
+            series[bound] = series.get(bound, 0.0) + sign * sample.value
+
+    quantiles = {}
+    for packet, series in buckets.items():
+        cumulative = sorted(series.items())
+        frames = cumulative[-1][1]
+        if frames <= 0:
+            continue
+        quantiles[packet] = {
+            f"p{q}_ms": 1000
+            * next(bound for bound, count in cumulative if count >= frames * q / 100)
+            for q in (50, 95, 99)
+        }
+    return quantiles
+
+
+def http_url(url: str) -> str:
+    parts = urlsplit(url)
+    scheme = {"ws": "http", "wss": "https"}.get(parts.scheme, parts.scheme)
+    return urlunsplit((scheme, parts.netloc, parts.path, "", ""))
+
+
+async def load_test(args) -> Dict:
+    recording = load_recording(args)
+    print(
+        f"Replaying {len(recording.audio_chunks)} audio buffers and "
+        f"{len(recording.video_frames)} video frames on {args.sessions} sessions "
+        f"for {args.duration:g}s of media at "
+        f"{'full' if args.speed <= 0 else f'{args.speed:g}x'} speed"
+    )
+
+    async with httpx.AsyncClient(base_url=http_url(args.url), timeout=30) as client:
+        watcher = MetricsWatcher(client, args.scrape_interval)
+        await watcher.start()
+
+        prefix = f"{args.session_prefix}-{int(time.time())}"
+        start = time.perf_counter()
+        reports = await asyncio.gather(
+            *(
+                stream_session(
+                    args.url,
+                    f"{prefix}-{index}",
+                    recording,
+                    args,
+                    args.ramp * index / max(1, args.sessions),
+                )
+                for index in range(args.sessions)
+            )
+        )
+        wall = time.perf_counter() - start
+
+        # Give the server a moment to store frames still in flight
+        await asyncio.sleep(args.settle)
+        await watcher.stop()
+        server_sessions = (await client.get("/ingest-sessions")).json()
+
+        if not args.keep_sessions:
+            for report in reports:
+                if report.session_id in server_sessions:
+                    await client.delete(f"/ingest-sessions/{report.session_id}")
+
+    sessions = []
+    for report in reports:
+        received = server_sessions.get(report.session_id, {})
+        sessions.append(
+            {
+                "session_id": report.session_id,
+                "frames_sent": report.frames_sent,
+                "frames_received": received.get("received", 0),
+                "missing": received.get("missing", 0),
+                "late": report.late,
+                "error": report.error,
+            }
+        )
+
+    send_seconds = [s for report in reports for s in report.send_seconds]
+    connect_seconds = [
+        report.connect_seconds
+        for report in reports
+        if report.connect_seconds is not None
+    ]
+    frames_sent = sum(report.frames_sent for report in reports)
+    frames_received = sum(session["frames_received"] for session in sessions)
+    server_bytes = counter_delta(watcher.first, watcher.last, "ingest_bytes")
+    memory = watcher.memory or [float("nan")]
+
+    return {
+        "sessions": args.sessions,
+        "failed_sessions": sum(1 for report in reports if report.error),
+        "seconds": wall,
+        "frames_sent": frames_sent,
+        "frames_received": frames_received,
+        "dropped_frames": frames_sent - frames_received,
+        "late_frames": sum(report.late for report in reports),
+        "sequence_gaps": sum(session["missing"] for session in sessions),
+        "client_frames_per_second": frames_sent / wall,
+        "client_mb_per_second": sum(r.bytes_sent for r in reports) / wall / 2**20,
+        "server_mb_per_second": sum(server_bytes.values()) / wall / 2**20,
+        "connect_ms": {
+            f"p{q}": 1000 * percentile(connect_seconds, q) for q in (50, 95, 99)
+        },
+        "send_ms": {f"p{q}": 1000 * percentile(send_seconds, q) for q in (50, 95, 99)},
+        "ingest_lag": lag_quantiles(watcher.first, watcher.last),
+        "server_memory_mb": {
+            "start": memory[0] / 2**20,
+            "peak": max(memory) / 2**20,
+            "end": memory[-1] / 2**20,
+            "growth": (memory[-1] - memory[0]) / 2**20,
+        },
+        "per_session": sessions,
+    }
+
+
+def print_report(result: Dict):
+    print()
+    print(
+        f"Sessions: {result['sessions']} ({result['failed_sessions']} failed) "
+        f"in {result['seconds']:.1f}s"
+    )
+    print(
+        f"Frames: {result['frames_sent']} sent, {result['frames_received']} stored, "
+        f"{result['dropped_frames']} dropped, {result['late_frames']} sent late, "
+        f"{result['sequence_gaps']} sequence gaps"
+    )
+    print(
+        f"Throughput: {result['client_frames_per_second']:.1f} frames/s, "
+        f"{result['client_mb_per_second']:.2f} MB/s sent, "
+        f"{result['server_mb_per_second']:.2f} MB/s stored"
+    )
+    for title, key in (("Connect", "connect_ms"), ("Send", "send_ms")):
+        numbers = result[key]
+        print(
+            f"{title} ms: p50 {numbers['p50']:.2f}  p95 {numbers['p95']:.2f}  "
+            f"p99 {numbers['p99']:.2f}"
+        )
+    for packet, numbers in sorted(result["ingest_lag"].items()):
+        print(
+            f"Ingest lag ({packet}) ms: p50 {numbers['p50_ms']:.2f}  "
+            f"p95 {numbers['p95_ms']:.2f}  p99 {numbers['p99_ms']:.2f}"
+        )
+    memory = result["server_memory_mb"]
+    print(
+        f"Server memory MB: {memory['start']:.1f} at start, {memory['peak']:.1f} "
+        f"peak, {memory['end']:.1f} at end ({memory['growth']:+.1f})"
+    )
+    for session in result["per_session"]:
+        if session["error"]:
+            print(f"{session['session_id']} failed: {session['error']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Open concurrent /ws ingest sessions against a running server "
+        "and replay a recorded or synthetic visit on each. Reports ingest "
+        "throughput, per-frame latency, dropped frames and server memory growth."
+    )
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="seconds of media per session"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="playback rate; 1 is real time, 0 sends as fast as possible",
+    )
+    parser.add_argument(
+        "--ramp",
+        type=float,
+        default=1.0,
+        help="seconds over which the sessions are started",
+    )
+    parser.add_argument("--audio", help="WAV file or raw 16 kHz mono s16le PCM")
+    parser.add_argument(
+        "--video",
+        help="directory of JPEGs, length-prefixed JPEG stream or video file",
+    )
+    parser.add_argument("--fps", type=float, default=VIDEO_FRAME_RATE)
+    parser.add_argument("--jpeg-quality", type=int, default=80)
+    parser.add_argument("--frames-per-buffer", type=int, default=1024)
+    parser.add_argument("--buffers-per-frame", type=int, default=2)
+    parser.add_argument("--scrape-interval", type=float, default=1.0)
+    parser.add_argument("--settle", type=float, default=1.0)
+    parser.add_argument("--session-prefix", default="load-test")
+    parser.add_argument(
+        "--keep-sessions",
+        action="store_true",
+        help="leave the sessions open on the server instead of discarding them",
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = asyncio.run(load_test(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
@@ -1,25 +1,20 @@
 # Standard library imports
 import asyncio
 import base64
+import hashlib
 import json
 import os
-import struct
+import shutil
 import subprocess
-import wave
+import tempfile
+import time
+import uuid
 from datetime import datetime
-from io import BytesIO
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
 # Third party imports
-import cv2
 import google.generativeai as genai
-import numpy as np
-import requests
-from deepgram import (
-    DeepgramClient,
-    PrerecordedOptions,
-)
 from dotenv import load_dotenv
 from fastapi import (
     FastAPI,
@@ -31,12 +26,71 @@ from fastapi import (
     Depends,
     WebSocket,
     Path,
+    Request,
+    Response,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from google.generativeai import GenerativeModel
-from PIL import Image
 from supabase import create_client, Client
+from google import genai as google_genai
 from google.genai.types import HttpOptions, Part
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# Local imports
+from audio import encode_wavs, preprocess_audio
+from badges import BadgeIndex
+from cache import LLMCache, RecordCache
+from executor import QueueFullError, media_executor_from_env
+from extraction import EHR_FIELDS, merge_extractions, split_transcript
+from ingest import IngestRegistry
+from jobs import DONE, FAILED, QUEUED, JobQueue, JobStore
+from llm import llm_gateway_from_env
+from media import (
+    EncodedFrame,
+    UPLOAD_CHUNK_SIZE,
+    assemble_video,
+    assemble_video_file,
+    sample_keyframes,
+    write_wav_stream,
+)
+from metrics import (
+    HTTP_REQUEST_ERRORS,
+    HTTP_REQUEST_SECONDS,
+    INGEST_BYTES,
+    INGEST_FRAME_LAG_SECONDS,
+    INGEST_FRAMES,
+    INGEST_SESSIONS,
+    record_payload,
+    timed,
+)
+from pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    CursorError,
+    decode_cursor,
+    paginate,
+)
+from pipeline import Pipeline
+from prompts import (
+    NOTE_PROMPT,
+    NOTE_SYSTEM,
+    QUESTIONS_PROMPT,
+    QUESTIONS_SYSTEM,
+    SUMMARY_PROMPT,
+    SUMMARY_SYSTEM,
+    VISION_PROMPT,
+    chat_messages,
+)
+from protocol import AUDIO_PACKET, ProtocolError, decode_frame
+from providers import Provider, ProviderError, ProviderPool
+from transcription import (
+    LiveTranscript,
+    transcriber_factory_from_env,
+    transcript_from_words,
+)
+from uploads import uploader_from_env
 
 load_dotenv()
 
@@ -47,7 +101,6 @@ key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
 deepgram_key = os.environ.get("DEEPGRAM_KEY")
-deepgram_client = DeepgramClient(deepgram_key)
 
 google_api_key = os.environ.get("GOOGLE_API_KEY")
 genai.configure(api_key=google_api_key)
@@ -56,8 +109,60 @@ mistral_api_key = os.getenv("MISTRAL_API_KEY")
 
 doctor_id = 1
 
+# Transcripts longer than this are extracted in overlapping windows
+NOTE_WINDOW_CHARS = int(os.environ.get("NOTE_WINDOW_CHARS", 12000))
+NOTE_WINDOW_OVERLAP = int(os.environ.get("NOTE_WINDOW_OVERLAP", 1500))
+
+# Visual assessment sends Gemini either sampled keyframes or the whole video
+VISION_INPUT = os.environ.get("VISION_INPUT", "keyframes")  # keyframes or video
+VISION_MAX_FRAMES = int(os.environ.get("VISION_MAX_FRAMES", 20))
+VISION_FRAME_WIDTH = int(os.environ.get("VISION_FRAME_WIDTH", 512))
+VISION_FRAME_FORMAT = os.environ.get("VISION_FRAME_FORMAT", "jpeg")  # jpeg or webp
+VISION_FRAME_QUALITY = int(os.environ.get("VISION_FRAME_QUALITY", 80))
+
 perplexity_api_key = os.environ.get("PERPLEXITY_API_KEY")
 
+# Responses for identical LLM requests are served from here
+llm_cache = LLMCache(
+    os.environ.get("LLM_CACHE_DB", "llm_cache.db"),
+    maxsize=int(os.environ.get("LLM_CACHE_SIZE", 512)),
+)
+
+# Patient and visit rows read by the portals, dropped when a visit changes
+record_cache = RecordCache(
+    maxsize=int(os.environ.get("RECORD_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("RECORD_CACHE_TTL", 60)),
+)
+
+# Shared keep-alive client for every LLM and transcription call
+provider_pool = ProviderPool(
+    {
+        "mistral": Provider(
+            "https://api.mistral.ai/v1",
+            f"Bearer {mistral_api_key}",
+            max_concurrency=int(os.environ.get("MISTRAL_MAX_CONCURRENCY", 16)),
+            timeout=float(os.environ.get("MISTRAL_TIMEOUT", 120)),
+        ),
+        "perplexity": Provider(
+            "https://api.perplexity.ai",
+            f"Bearer {perplexity_api_key}",
+            max_concurrency=int(os.environ.get("PERPLEXITY_MAX_CONCURRENCY", 16)),
+            timeout=float(os.environ.get("PERPLEXITY_TIMEOUT", 60)),
+        ),
+        "deepgram": Provider(
+            "https://api.deepgram.com/v1",
+            f"Token {deepgram_key}",
+            max_concurrency=int(os.environ.get("DEEPGRAM_MAX_CONCURRENCY", 8)),
+            timeout=float(os.environ.get("DEEPGRAM_TIMEOUT", 300)),
+        ),
+    }
+)
+
+# Cache, coalescing, rate limits, retries and hedging for every LLM call
+llm_gateway = llm_gateway_from_env(
+    provider_pool, llm_cache, ["mistral", "perplexity", "gemini"]
+)
+
 app = FastAPI()
 
 app.add_middleware(
@@ -66,8 +171,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/visits/{id}), not the raw path, to keep the
+        # number of series bounded. Streaming responses are timed to their headers.
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(request.method, path, status).observe(
+            time.perf_counter() - start
+        )
+        if status >= 500:
+            HTTP_REQUEST_ERRORS.labels(request.method, path).inc()
+
+
 audio_file_paths = []
 video_file_paths = []
 
@@ -77,72 +204,182 @@ SAMPLE_RATE = 16000
 CHANNELS = 1
 SAMPLE_WIDTH = 2  # 16-bit audio
 
-"""audio_buffer = BytesIO()  # will hold a valid WAV-file stream
-video_buffer = BytesIO()  # will hold raw video packets (e.g. h264)"""
-"""wav_file = wave.open(audio_buffer, "wb")
-wav_file.setnchannels(CHANNELS)
-wav_file.setsampwidth(SAMPLE_WIDTH)
-wav_file.setframerate(SAMPLE_RATE)"""
+# Recordings sent for prerecorded transcription have their silence cut out
+TRIM_SILENCE = os.environ.get("TRIM_SILENCE", "true").lower() == "true"
+
+# Recordings are stored compressed, as Opus in Ogg or as FLAC
+AUDIO_STORAGE_FORMAT = os.environ.get("AUDIO_STORAGE_FORMAT", "opus")
+AUDIO_OPUS_BITRATE = os.environ.get("AUDIO_OPUS_BITRATE", "24k")
+
+# Audio streamed on /ws is transcribed live, so the transcript is ready at badge scan.
+# Recordings are kept on disk until their note is saved.
+ingest_sessions = IngestRegistry(
+    os.environ.get("INGEST_DIR", "ingest_sessions"),
+    SAMPLE_RATE,
+    CHANNELS,
+    SAMPLE_WIDTH,
+    transcriber_factory=transcriber_factory_from_env(SAMPLE_RATE, CHANNELS),
+)
+INGEST_SESSIONS.set_function(lambda: len(ingest_sessions))
+
+# Large recordings go to object storage as resumable multipart uploads
+uploader = uploader_from_env()
+
+# JPEG decode, MP4 encode and WAV writes run in worker processes
+media_executor = media_executor_from_env()
+
+
+async def run_media_job(fn, *args):
+    try:
+        return await media_executor.run(fn, *args)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "5"}
+        )
+
+
+async def run_media_job_in_thread(fn, *args):
+    try:
+        return await media_executor.run_in_thread(fn, *args)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "5"}
+        )
 
-buffer_lock = asyncio.Lock()
 
-HEADER_FORMAT = "!B"  # 1 byte for type,
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+@app.on_event("shutdown")
+async def shutdown_workers():
+    if badge_sync_task is not None:
+        badge_sync_task.cancel()
+    if ingest_prune_task is not None:
+        ingest_prune_task.cancel()
+    await job_queue.stop()
+    media_executor.shutdown()
+    await provider_pool.aclose()
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    global wav_file, audio_buffer, video_buffer
+async def websocket_endpoint(websocket: WebSocket, session_id: str = Query(...)):
+    # Each exam room streams into its own session, keyed by the client's session id.
+    # There is no default, so two rooms can never share one recording.
     await websocket.accept()
-    print("WebSocket connection established.")
+    print(f"WebSocket connection established for session {session_id}.")
+    attached = None
     try:
         while True:
-            header = await websocket.receive_bytes()
-
-            # Read the header to see if it's 0x01 (audio) or 0x02 (video)
-            packet_type = struct.unpack(HEADER_FORMAT, header)
-
-            data = await websocket.receive_bytes()
-            async with buffer_lock:
-                if packet_type[0] == 0x01:
-                    wav_file.writeframes(data)
-                else:
-                    video_buffer.write(data)
+            # One message per frame: header, sequence number and batched payloads
+            try:
+                frame = decode_frame(await websocket.receive_bytes())
+            except ProtocolError as e:
+                print(f"Dropping malformed frame on session {session_id}: {e}")
+                continue
+
+            # Looked up per frame so a badge scan can hand the room a fresh session
+            session = ingest_sessions.open(session_id)
+            if session is not attached:
+                # A reconnecting client numbers its frames from 0 again
+                session.sequence.reset()
+                attached = session
+            session.sequence.observe(frame.sequence)
+            if frame.packet_type == AUDIO_PACKET:
+                packet = "audio"
+                await session.write_audio(frame.chunks, frame.timestamp_ms)
+            else:
+                packet = "video"
+                await session.write_video(frame.chunks, frame.timestamp_ms)
+
+            # Measured against the client's clock, so skew between hosts shows as lag
+            lag = time.time() - frame.timestamp_ms / 1000
+            INGEST_FRAME_LAG_SECONDS.labels(packet).observe(max(0.0, lag))
+            INGEST_FRAMES.labels(packet).inc()
+            INGEST_BYTES.labels(packet).inc(sum(len(chunk) for chunk in frame.chunks))
 
     except Exception as e:
         print(f"WebSocket connection error: {e}")
     finally:
-        # On disconnect, close the open WAV file resource.
-        async with buffer_lock:
-            try:
-                wav_file.close()
-            except Exception:
-                pass
-        print("WebSocket connection closed.")
+        # The session stays open so the badge scan can still finalize it
+        print(f"WebSocket connection closed for session {session_id}.")
+
+
+ingest_prune_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_ingest_pruning():
+    # Runs on a timer so abandoned sessions are cleaned up on an idle server too
+    global ingest_prune_task
+    ingest_prune_task = asyncio.create_task(
+        ingest_sessions.prune_forever(
+            float(os.environ.get("INGEST_PRUNE_INTERVAL", 60))
+        )
+    )
+
+
+@app.get("/ingest-sessions")
+def get_ingest_sessions():
+    return ingest_sessions.stats()
+
+
+@app.delete("/ingest-sessions/{session_id}")
+async def discard_ingest_session(session_id: str):
+    # Drops a session's recording without generating a note, e.g. after a load test
+    if not await ingest_sessions.discard(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"discarded": session_id}
+
+
+@app.get("/cache-stats")
+def get_cache_stats():
+    return {
+        "llm": llm_cache.stats(),
+        "records": record_cache.stats(),
+        "badges": badge_index.stats(),
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Latency histograms, payload sizes and error counts in Prometheus text format
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/media-queue")
+def get_media_queue():
+    return media_executor.stats()
+
+
+def file_stamp() -> str:
+    """
+    Timestamp for recording file names, with a random suffix so uploads and scans
+    in the same second do not overwrite each other's files
+    """
+    return f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
 
 
 @app.post("/upload-audio")
-async def upload_audio(file: UploadFile = File(...)):
-    # Read in the audio file and save it to a file and add the file path to the list
-    file_bytes = await file.read()
-    if file_bytes is None:
-        raise HTTPException(status_code=400, detail="Invalid audio file")
-
-    # Convert bytes to int16 samples
-    file_data = np.frombuffer(file_bytes, dtype=np.int16)
-
-    # get the timestamp
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    audio_file_path = "audio" + ts + ".m4a"
-
-    # Create WAV file with proper audio settings
-    with wave.open(audio_file_path, "w") as wav_file:
-        wav_file.setnchannels(CHANNELS)  # Using the global CHANNELS value (1 for mono)
-        wav_file.setsampwidth(
-            SAMPLE_WIDTH
-        )  # Using the global SAMPLE_WIDTH (2 bytes per sample)
-        wav_file.setframerate(SAMPLE_RATE)  # Using the global SAMPLE_RATE (16000)
-        wav_file.writeframes(file_data.tobytes())
+async def upload_audio(
+    file: UploadFile = File(...),
+    sample_rate: int = Form(SAMPLE_RATE),
+    channels: int = Form(CHANNELS),
+):
+    # Stream the audio file into a WAV file and add the file path to the list
+    # get a unique timestamp
+    ts = file_stamp()
+    audio_file_path = "audio" + ts + ".wav"
+
+    # Create WAV file with proper audio settings, chunk by chunk off the event loop.
+    # This is a plain copy with no decoding, so it runs on a thread rather than
+    # paying to ship the upload to a worker process.
+    await run_media_job_in_thread(
+        write_wav_stream,
+        file.file,
+        audio_file_path,
+        sample_rate,
+        channels,
+        SAMPLE_WIDTH,
+    )
 
     audio_file_paths.append(audio_file_path)
     return {"message": "Audio processed successfully", "path": audio_file_path}
@@ -150,214 +387,433 @@ async def upload_audio(file: UploadFile = File(...)):
 
 @app.post("/upload-video")
 async def upload_video(file: UploadFile = File(...)):
-    # Read in the video file and save it to a file and add the file path to the list
-    file_bytes = await file.read()
-    if file_bytes is None:
-        raise HTTPException(status_code=400, detail="Invalid video file")
-
-    # get the timestamp
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Stream the video file into an MP4 file and add the file path to the list
+    # get a unique timestamp
+    ts = file_stamp()
+    video_file_path = f"video_{ts}.mp4"
+
+    # The upload is copied to disk in chunks, then a worker process decodes and
+    # encodes it, reading back one frame at a time, so neither step holds it all
+    with tempfile.NamedTemporaryFile(suffix=".frames") as spool:
+        await run_media_job_in_thread(
+            shutil.copyfileobj, file.file, spool, UPLOAD_CHUNK_SIZE
+        )
+        spool.flush()
+        await run_media_job(assemble_video_file, spool.name, video_file_path)
 
-    # Video settings
-    width, height = 320, 240
-    frame_rate = 10  # FPS
-    output_folder = f"frames_{ts}"
-    video_file_path = f"video_{ts}.raw"
+    video_file_paths.append(video_file_path)
+    return {"message": "Video processed successfully", "path": video_file_path}
 
-    # Ensure output folder exists
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
 
-    # Process raw video data
-    index = 0
-    offset = 0
-    frames = []
+EMPTY_STRUCTURED_DATA = {field: "" for field in EHR_FIELDS}
 
-    while offset < len(file_bytes):
-        # Read frame size (4 bytes)
-        frame_size = int.from_bytes(file_bytes[offset : offset + 4], byteorder="little")
-        offset += 4  # Move past frame size metadata
+# Recording in storage that badge scans without a streamed session are noted from
+DEMO_AUDIO_PATH = "tree_hacks_script.m4a"
 
-        # Extract frame data
-        frame_data = file_bytes[offset : offset + frame_size]
-        offset += frame_size
 
-        # Save extracted frame as JPEG
-        frame_path = os.path.join(output_folder, f"frame_{index:03d}.jpg")
-        with open(frame_path, "wb") as img_file:
-            img_file.write(frame_data)
+def build_note_pipeline(
+    badge_id: str,
+    session_id: Optional[str],
+    mrn: Optional[int] = None,
+    job_id: Optional[str] = None,
+) -> Pipeline:
+    """
+    Stages that turn a finished visit recording into a draft visit note.
+    Transcription and visual assessment only share the session input, so the
+    audio and video branches run side by side.
+    """
+    pipeline = Pipeline(f"badge-scan {badge_id}", kind="badge-scan")
+    # Files are named after the job, so a requeued job finds the video file and
+    # multipart upload its first run left behind
+    ts = job_id if job_id is not None else file_stamp()
+
+    @pipeline.stage("patient")
+    async def lookup_patient(results):
+        # The index can lag a wristband being reassigned, so the visit goes to
+        # whoever the database says wears the badge. This runs alongside the
+        # media stages, so the lookup adds no latency.
+        patient_mrn = await badge_index.confirm(badge_id)
+        if patient_mrn is None:
+            raise ValueError(f"No patient has badge {badge_id}")
+        if mrn is not None and patient_mrn != mrn:
+            print(f"Badge {badge_id} now belongs to MRN {patient_mrn}, not {mrn}")
+        return patient_mrn
+
+    @pipeline.stage("session")
+    async def finalize_session(results):
+        # session_id is the detached session parked at scan time, if any
+        if session_id is None:
+            return None
+        session_data = await ingest_sessions.finalize(session_id)
+        if session_data is None:
+            # Never fall back to the demo file for a real visit
+            raise ValueError(
+                f"Recording for session {session_id} is no longer available"
+            )
+        return session_data
+
+    @pipeline.stage("audio", deps=["session"])
+    async def store_audio(results):
+        session_data = results["session"]
+        # Read and merge all the audio files together
+        dat_files = False
+
+        if session_data is not None or dat_files is True:
+            if session_data is not None:
+                segments = [session_data.audio]
+            else:
+                segments = []
+                for audio_file_path in audio_file_paths:
+                    with open(audio_file_path, "rb") as f:
+                        segments.append(f.read())
+
+            # Merge the segments' samples and compress them for storage
+            encoded = await run_media_job(
+                encode_wavs, segments, AUDIO_STORAGE_FORMAT, AUDIO_OPUS_BITRATE
+            )
 
-        frames.append(frame_path)
-        index += 1
+            # Save the audio to Supabase
+            audio_file_path = "audio" + ts + encoded.extension
+            record_payload("storage", "upload", len(encoded.data))
+            with timed("storage", "audio.upload"):
+                await asyncio.to_thread(
+                    supabase.storage.from_("audio").upload,
+                    audio_file_path,
+                    encoded.data,
+                    # A rerun of the same job writes the same key
+                    file_options={"content-type": encoded.mime_type, "upsert": "true"},
+                )
+        else:
+            audio_file_path = DEMO_AUDIO_PATH  # audio_file_paths[0]
+
+        return audio_file_path
+
+    @pipeline.stage("transcript", deps=["session"])
+    async def transcribe(results):
+        session_data = results["session"]
+        live = session_data.transcript if session_data is not None else None
+        if live is not None and live.segments:
+            # Already transcribed live while the visit was streaming
+            return live
+
+        if session_data is not None:
+            # Send Deepgram only the speech, then map word times back onto the
+            # stored recording so they line up with the video
+            processed = await run_media_job(
+                preprocess_audio, session_data.audio, SAMPLE_RATE, True, TRIM_SILENCE
+            )
+            print(
+                f"Trimmed audio from {processed.original_duration:.1f}s"
+                f" to {processed.duration:.1f}s"
+            )
+            if processed.duration == 0:
+                return LiveTranscript()
+            transcription = await provider_pool.post(
+                "deepgram",
+                "/listen",
+                content=processed.wav,
+                params={"model": "nova-3", "smart_format": "true", "diarize": "true"},
+                headers={"Content-Type": "audio/wav"},
+            )
+            transcription.raise_for_status()
 
-    print(f"Extracted {index} frames.")
+            alternative = transcription.json()["results"]["channels"][0][
+                "alternatives"
+            ][0]
+            return transcript_from_words(
+                alternative["words"], processed.time_map.to_original
+            )
 
-    # Convert frames to video
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")  # Changed to MP4 format
-    video_writer = cv2.VideoWriter(video_file_path, fourcc, frame_rate, (width, height))
+        # Without a session the audio stage stores nothing and uses the demo file
+        with timed("storage", "audio.sign"):
+            signed = await asyncio.to_thread(
+                supabase.storage.from_("audio").create_signed_url, DEMO_AUDIO_PATH, 300
+            )
+        audio_url = signed["signedURL"]
+
+        # Transcribe the recording with Deepgram's prerecorded API
+        transcription = await provider_pool.post(
+            "deepgram",
+            "/listen",
+            json={"url": audio_url},
+            params={"model": "nova-3", "smart_format": "true", "diarize": "true"},
+        )
+        transcription.raise_for_status()
+
+        alternative = transcription.json()["results"]["channels"][0]["alternatives"][0]
+        return transcript_from_words(alternative["words"])
+
+    @pipeline.stage("video_file", deps=["session"])
+    async def write_video_file(results):
+        session_data = results["session"]
+        local_video_path = f"video_{ts}.mp4"
+        if os.path.exists(uploader.manifest_path(local_video_path)):
+            # An earlier run of this job was uploading this file; resume it as is
+            return local_video_path
+        if session_data is not None:
+            # Encode the session's streamed frames the same way /upload-video does
+            written = await run_media_job(
+                assemble_video, session_data.video, local_video_path
+            )
+            if not written:
+                os.remove(local_video_path)
+                return None
+        else:
+            # Merge all the video files together, copying them a chunk at a time
+            with open(local_video_path, "wb") as dst:
+                for video_file_path in video_file_paths:
+                    with open(video_file_path, "rb") as src:
+                        await asyncio.to_thread(shutil.copyfileobj, src, dst)
+        return local_video_path
+
+    @pipeline.stage("video", deps=["video_file"])
+    async def store_video(results):
+        if results["video_file"] is None:
+            return None
+        # Upload the file in parallel parts without loading it into memory
+        record_payload("storage", "upload", os.path.getsize(results["video_file"]))
+        with timed("storage", "video.multipart_upload"):
+            return await uploader.upload_file(
+                results["video_file"], "video", "video" + ts, "video/mp4"
+            )
 
-    try:
-        for frame_path in frames:
-            frame = cv2.imread(frame_path)
-            if frame is not None:  # Check if frame was read successfully
-                video_writer.write(frame)
-    finally:
-        video_writer.release()
+    @pipeline.stage("keyframes", deps=["session", "video_file"])
+    async def select_keyframes(results):
+        if results["video_file"] is None or VISION_INPUT != "keyframes":
+            return None
+        # Streamed frames are timed by the client's timestamps, on the audio's clock
+        session_data = results["session"]
+        frame_times = session_data.video_times if session_data is not None else None
+        return await run_media_job(
+            sample_keyframes,
+            results["video_file"],
+            VISION_MAX_FRAMES,
+            VISION_FRAME_WIDTH,
+            VISION_FRAME_FORMAT,
+            VISION_FRAME_QUALITY,
+            frame_times,
+        )
 
-    # Clean up frame files
-    for frame_path in frames:
+    @pipeline.stage("video_cleanup", deps=["video", "keyframes"])
+    async def remove_video_file(results):
+        # The upload and keyframe sampling were the local file's last readers
+        if results["video_file"] is not None:
+            os.remove(results["video_file"])
+
+    # Keyframes are assessed without waiting for the upload, next to the transcript
+    # of what was said when each was taken
+    @pipeline.stage(
+        "vision",
+        deps=["video"] if VISION_INPUT == "video" else ["keyframes", "transcript"],
+    )
+    async def assess_video(results):
+        if VISION_INPUT != "video":
+            if results["keyframes"] is None:
+                return ""
+            visual_result = await process_keyframes(
+                results["keyframes"], results["transcript"]
+            )
+        else:
+            if results["video"] is None:
+                return ""
+            with timed("storage", "video.sign"):
+                signed = await asyncio.to_thread(
+                    supabase.storage.from_("video").create_signed_url,
+                    results["video"],
+                    300,
+                )
+            visual_result = await process_video(signed["signedURL"])
+        return visual_result.get("visual_assessment", "")
+
+    @pipeline.stage("note", deps=["transcript", "vision"])
+    async def structure_note(results):
+        # Process combined information
         try:
-            os.remove(frame_path)
-        except OSError:
-            pass
-    try:
-        os.rmdir(output_folder)
-    except OSError:
-        pass
+            return await parse_medical_text(
+                results["transcript"].text(), results["vision"]
+            )
+        except Exception as e:
+            print(f"LLM processing error: {e}")
+            return dict(EMPTY_STRUCTURED_DATA)
+
+    @pipeline.stage("save", deps=["patient", "audio", "note"])
+    async def save_visit(results):
+        visit_data = {
+            "patient": results["patient"],
+            "doctor": doctor_id,
+            "audio_path": results["audio"],
+            # "video_path": results["video"],
+            "raw_text": results["transcript"].text(),
+            "visual_assessment": results["vision"],
+            **results["note"],
+            "approved": False,
+        }
+        # Save to database
+        inserted = await asyncio.to_thread(
+            execute, supabase.table("visit").insert(visit_data), "visit.insert"
+        )
+        for row in inserted.data:
+            record_cache.invalidate(f"visit:{row['id']}")
+        return inserted
 
-    video_file_paths.append(video_file_path)
-    return {"message": "Video processed successfully", "path": video_file_path}
+    return pipeline
 
 
-@app.get("/badge-scan/{badge_id}")
-async def upload(badge_id: str = Path(..., regex="^[0-9a-fA-F]+$")):
-    global doctor_id  # , audio_buffer, video_buffer, wav_file, expecting_audio
+async def run_badge_scan_job(job_id: str, params: Dict, progress) -> Dict:
+    pipeline = build_note_pipeline(
+        params["badge_id"], params.get("session_id"), params.get("mrn"), job_id
+    )
+    finished = 0
 
-    patient_id = (
+    async def on_stage_done(stage: str, duration: float):
+        nonlocal finished
+        finished += 1
+        await progress(stage, finished / len(pipeline.stages))
+
+    results = await pipeline.run(on_stage_done)
+    if params.get("session_id") is not None:
+        # Kept until the job succeeds, so a rerun or retry still has the recording
+        await ingest_sessions.remove(params["session_id"])
+    return results["save"].data
+
+
+job_queue = JobQueue(
+    JobStore(os.environ.get("JOBS_DB", "jobs.db")),
+    {"badge-scan": run_badge_scan_job},
+    workers=int(os.environ.get("NOTE_WORKERS", 4)),
+)
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.start()
+
+
+def load_badge_page(start: int, end: int) -> List[Dict]:
+    return execute(
         supabase.table("patient")
-        .select("mrn")
-        .eq("wristband_id", badge_id)
-        .execute()
-        .data[0]["mrn"]
+        .select("wristband_id, mrn")
+        .order("mrn")
+        .range(start, end),
+        "patient.select",
+    ).data
+
+
+def lookup_badge(badge_id: str) -> Optional[int]:
+    patient = fetch_one(
+        supabase.table("patient").select("mrn").eq("wristband_id", badge_id),
+        "patient.select",
     )
-    # Get a timestamp – used for filenames
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return patient["mrn"] if patient else None
 
-    # First, atomically capture and reset our buffers.
-    """async with buffer_lock:
-        # Finalize the currently open WAV file (which finalizes the header)
-        try:
-            wav_file.close()
-        except Exception:
-            pass
-        # Capture the bytes recorded up to this point
-        old_audio_bytes = audio_buffer.getvalue()
-        old_video_bytes = video_buffer.getvalue()
-
-        # Reset buffers for future data
-        audio_buffer = BytesIO()
-        video_buffer = BytesIO()
-        expecting_audio = False  # restart packet alternation
-
-        # Reinitialize the WAV writer for the new audio buffer.
-        wav_file = wave.open(audio_buffer, "wb")
-        wav_file.setnchannels(CHANNELS)
-        wav_file.setsampwidth(SAMPLE_WIDTH)
-        wav_file.setframerate(SAMPLE_RATE)"""
-
-    # Read and merge all the audio files together
-    dat_files = False
-    audio_file_path = ""
-
-    if dat_files is True:
-        audio_data = []
-        for audio_file_path in audio_file_paths:
-            with open(audio_file_path, "rb") as f:
-                audio_data.append(f.read())
-
-        audio_data = b"".join(audio_data)
-
-        # Save the audio to Supabase
-        audio_file_path = "audio" + ts + ".m4a"
-        supabase.storage.from_("audio").upload(
-            audio_file_path, audio_data, file_options={"content-type": "audio/m4a"}
-        )
-    else:
-        audio_file_path = "tree_hacks_script.m4a"  # audio_file_paths[0]
 
-    # Get the file from supabase
-    audio_url = supabase.storage.from_("audio").create_signed_url(audio_file_path, 300)[
-        "signedURL"
-    ]
+badge_index = BadgeIndex(load_badge_page, lookup_badge)
+badge_sync_task: Optional[asyncio.Task] = None
 
-    print("Signed URL", url)
-    AUDIO_URL = {
-        "url": audio_url,
-    }
 
-    ## STEP 2 Call the transcribe_url method on the prerecorded class
-    options: PrerecordedOptions = PrerecordedOptions(
-        model="nova-3",
-        smart_format=True,
-        diarize=True,
+@app.on_event("startup")
+async def warm_badge_index():
+    global badge_sync_task
+    try:
+        await asyncio.to_thread(badge_index.load)
+        print(f"Loaded {badge_index.stats()['size']} patient badges")
+    except Exception as e:
+        # Scans still resolve one at a time until a sync succeeds
+        print(f"Could not load the badge index: {e}")
+    badge_sync_task = asyncio.create_task(
+        badge_index.sync_forever(float(os.environ.get("BADGE_SYNC_INTERVAL", 300)))
     )
 
-    transcription = deepgram_client.listen.rest.v("1").transcribe_url(
-        AUDIO_URL, options
-    )
 
-    raw_audio_text = (
-        transcription.results.channels[0].alternatives[0].paragraphs.transcript
+@app.get("/badge-scan/{badge_id}")
+async def upload(
+    badge_id: str = Path(..., regex="^[0-9a-fA-F]+$"),
+    session_id: Optional[str] = Query(None),
+):
+    mrn = await badge_index.resolve(badge_id)
+    if mrn is None:
+        raise HTTPException(status_code=404, detail="Unknown badge")
+
+    # Stop recording into the room's session now; the note is generated in the background
+    detached_session_id = None
+    if session_id is not None:
+        detached_session_id = ingest_sessions.detach(session_id)
+        if detached_session_id is None:
+            # Unknown, or already taken by an earlier scan of this room
+            raise HTTPException(status_code=404, detail="Session not found")
+
+    job_id = job_queue.enqueue(
+        "badge-scan",
+        {"badge_id": badge_id, "session_id": detached_session_id, "mrn": mrn},
     )
+    return {"job_id": job_id, "status": QUEUED, "status_url": f"/jobs/{job_id}"}
 
-    # Read and merge all the video files together
-    video_data = []
-    for video_file_path in video_file_paths:
-        with open(video_file_path, "rb") as f:
-            video_data.append(f.read())
 
-    video_data = b"".join(video_data)
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-    # Save the video to Supabase
-    video_file_path = "video" + ts
-    supabase.storage.from_("video").upload(
-        video_file_path, video_data, file_options={"content-type": "video/mp4"}
-    )
 
-    video_url = supabase.storage.from_("video").create_signed_url(audio_file_path, 300)[
-        "signedURL"
-    ]
+@app.post("/jobs/{job_id}/retry")
+def retry_job(job_id: str):
+    # A failed badge-scan job still has its detached session until the retention
+    # period runs out, so it can run again from the same recording
+    if job_queue.store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job_queue.retry(job_id):
+        raise HTTPException(status_code=409, detail="Only failed jobs can be retried")
+    return {"job_id": job_id, "status": QUEUED, "status_url": f"/jobs/{job_id}"}
 
-    # Get visual assessment
-    visual_result = await process_video(video_url)
-    visual_assessment = visual_result["visual_assessment"]
 
-    # Process combined information
+@app.websocket("/ws/jobs/{job_id}")
+async def job_updates(websocket: WebSocket, job_id: str):
+    # Pushes the job row on every progress update until it finishes
+    await websocket.accept()
+    updates = job_queue.subscribe(job_id)
     try:
-        structured_data = parse_medical_text(raw_audio_text, visual_assessment)
+        job = job_queue.store.get(job_id)
+        if job is None:
+            await websocket.close(code=4404)
+            return
+        while True:
+            await websocket.send_json(job)
+            if job["status"] in (DONE, FAILED):
+                break
+            job = await updates.get()
+        await websocket.close()
     except Exception as e:
-        print(f"LLM processing error: {e}")
-        structured_data = {
-            "cc": "",
-            "hpi": "",
-            "pmh": "",
-            "meds": "",
-            "allergies": "",
-            "ros": "",
-            "vitals": "",
-            "findings": "",
-            "diagnosis": "",
-            "plan": "",
-            "interventions": "",
-            "eval": "",
-            "discharge": "",
-        }
+        print(f"Job WebSocket error: {e}")
+    finally:
+        job_queue.unsubscribe(job_id, updates)
 
-    # Save to database
-    visit_data = {
-        "patient": patient_id,
-        "doctor": doctor_id,
-        "audio_path": audio_file_path,
-        # "video_path": video_file_path,
-        "raw_text": raw_audio_text,
-        "visual_assessment": visual_assessment,
-        **structured_data,
-        "approved": False,
-    }
-    # Save to database
-    visit = supabase.table("visit").insert(visit_data).execute()
 
-    return visit
+def execute(query, operation: str):
+    """
+    Run a Supabase query, recording its latency under the given operation name
+    """
+    with timed("supabase", operation):
+        return query.execute()
+
+
+def fetch_one(query, operation: str) -> Optional[Dict]:
+    rows = execute(query, operation).data
+    return rows[0] if rows else None
+
+
+def fetch_visit(visit_id: int) -> Optional[Dict]:
+    """
+    Full visit row by id, served from the record cache
+    """
+    return record_cache.get(
+        f"visit:{visit_id}",
+        "row",
+        lambda: fetch_one(
+            supabase.table("visit").select("*").eq("id", visit_id), "visit.select"
+        ),
+    )
 
 
 # Approve visit record by id
@@ -383,10 +839,11 @@ def approve_visit(
     eval: str = Form(...),
     discharge: str = Form(...),
 ):
-    visit = supabase.table("visit").select("*").eq("id", visit_id).execute()
-    print("visit", visit)
+    visit = execute(
+        supabase.table("visit").select("*").eq("id", visit_id), "visit.select"
+    )
     if visit.data[0]["approved"] is False:
-        updated_visit = (
+        updated_visit = execute(
             supabase.table("visit")
             .update(
                 {
@@ -406,9 +863,12 @@ def approve_visit(
                     "discharge": discharge,
                 }
             )
-            .eq("id", visit_id)
-            .execute()
+            .eq("id", visit_id),
+            "visit.update",
         )
+        # Questions and summaries built from the old fields are stale now
+        record_cache.invalidate(f"visit:{visit_id}")
+        llm_cache.invalidate_tag(f"visit:{visit_id}")
         return updated_visit
     else:
         return {"message": "Visit is already approved"}
@@ -418,12 +878,12 @@ def approve_visit(
 @app.get("/visits/{visit_id}/questions")
 async def get_visit_questions(visit_id: int):
     # Get visit data from database
-    visit = supabase.table("visit").select("*").eq("id", visit_id).execute()
+    visit_data = await asyncio.to_thread(fetch_visit, visit_id)
 
-    if not visit.data:
+    if visit_data is None:
         raise HTTPException(status_code=404, detail="Visit not found")
 
-    questions = await generate_visit_questions(visit.data[0])
+    questions = await generate_visit_questions(visit_id)
     return {"questions": questions}
 
 
@@ -461,7 +921,7 @@ async def process_medical_text(raw_text: str):
     Endpoint to test LLM processing without updating the database
     """
     try:
-        structured_data = parse_medical_text(raw_text)
+        structured_data = await parse_medical_text(raw_text)
         return structured_data
     except Exception as e:
         return {"error": f"Error processing text: {str(e)}"}
@@ -469,134 +929,175 @@ async def process_medical_text(raw_text: str):
 
 ## Patient Portal
 @app.get("/patient-visits/{patient_id}")
-def get_patient_visits(patient_id: int):
-    visits = (
-        supabase.table("visit")
-        .select("id, doctor(first_name, last_name, location), created_at, type")
-        .eq("patient", patient_id)
-        .eq("approved", True)
-        .order("created_at", desc=True)
-        .execute()
+def get_patient_visits(
+    patient_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    doctor: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: str = "portal",
+):
+    # Patients only ever see approved visits
+    return list_visits(
+        response, fields, limit, cursor, True, doctor, since, until, patient_id
     )
-    return visits.data
 
 
 @app.get("/patient/{patient_mrn}")
 def get_patient(patient_mrn: int):
-    patient = (
-        supabase.table("patient")
-        .select("mrn, first_name, last_name, age, gender")
-        .eq("mrn", patient_mrn)
-        .execute()
+    patient = record_cache.get(
+        f"patient:{patient_mrn}",
+        "profile",
+        lambda: fetch_one(
+            supabase.table("patient")
+            .select("mrn, first_name, last_name, age, gender")
+            .eq("mrn", patient_mrn),
+            "patient.select",
+        ),
     )
-    return patient.data[0]
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return patient
 
 
 @app.post("/chat")
 async def chat(messages: List[Dict]):
-    headers = {
-        "Authorization": f"Bearer {perplexity_api_key}",
-        "Content-Type": "application/json",
-    }
-    print("messages", messages)
-
     try:
-        response = requests.post(
-            "https://api.perplexity.ai/chat/completions",
-            headers=headers,
-            json={
+        # Conversations are not cached, but identical ones in flight share a call
+        return await llm_gateway.complete(
+            "perplexity",
+            {
                 "model": "sonar",
                 "messages": messages,
             },
+            cache=False,
         )
 
-        print("response", response.json())
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(
-                status_code=response.status_code, detail="Failed to get AI response"
-            )
-
+    except ProviderError as e:
+        raise HTTPException(
+            status_code=e.status_code, detail="Failed to get AI response"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream")
+async def stream_chat(messages: List[Dict]):
+    """
+    Server-Sent Events version of /chat that forwards tokens as they arrive
+    """
+    return event_stream(
+        stream_completion(
+            "perplexity", {"model": "sonar", "messages": messages}, cache=False
+        )
+    )
+
+
 @app.get("/chat-context/{visit_id}")
 async def chat_context(visit_id: int):
-    visit = supabase.table("visit").select("*").eq("id", visit_id).execute()
-    return visit.data[0]
+    visit_data = await asyncio.to_thread(fetch_visit, visit_id)
+    if visit_data is None:
+        raise HTTPException(status_code=404, detail="Visit not found")
+    return visit_data
 
 
-def parse_medical_text(raw_text: str, visual_assessment: str) -> Dict:
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def event_stream(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_completion(
+    provider: str,
+    payload: Dict,
+    tags: Iterable[str] = (),
+    cache: bool = True,
+):
     """
-    Use Mistral AI to parse combined audio and video information into structured fields
+    Yield a chat completion as SSE events: one "delta" event per token chunk, then
+    "done" with the full text. A cached completion is replayed as a single delta.
     """
+    parts = []
+    try:
+        async for delta in llm_gateway.stream(provider, payload, tags, cache):
+            parts.append(delta)
+            yield sse_event({"delta": delta})
+    except Exception as e:
+        print(f"Error streaming {provider} completion: {e}")
+        yield sse_event({"detail": str(e)}, event="error")
+        return
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {mistral_api_key}",
-    }
+    yield sse_event({"content": "".join(parts)}, event="done")
 
-    prompt = f"""You are an expert medical doctor with extensive experience in clinical documentation and EHR systems. 
-    Your task is to analyze both the transcribed consultation and visual assessment data to create a comprehensive medical record.
-    
-    Please combine and parse both sources of information with high attention to medical accuracy and detail. For each field:
-    - Extract and combine relevant information from both the audio transcription and visual assessment
-    - Use standard medical terminology
-    - Maintain clinical relevance
-    - If information for a field is not present in either source, return an empty string
-    - When information appears in both sources, combine them coherently
-    - Prioritize objective visual findings when they complement verbal descriptions
-
-    Audio Transcription:
-    {raw_text}
-
-    Visual Assessment:
-    {visual_assessment}
-
-    Parse the combined information into these specific fields and return ONLY a JSON object:
-    
-    - cc (Chief Complaint): Combine verbal complaint with visible signs of distress or symptoms
-    - hpi (History of Present Illness): Integrate verbal history with observed physical manifestations
-    - pmh (Past Medical History): Include visible evidence of past procedures/conditions with reported history
-    - meds (Current Medications): List medications mentioned and any visible medication use observed
-    - allergies: Combine reported allergies with any visible allergic reactions
-    - ros (Review of Systems): Merge verbal review with visible signs/symptoms
-    - vitals: Combine verbally reported and visually observed/measured vital signs
-    - findings: Integrate verbal and visual physical examination findings, organized by body system
-    - diagnosis: Synthesize diagnoses based on both verbal and visual clinical evidence
-    - plan: Treatment plan incorporating both discussed and demonstrated interventions
-    - interventions: Document both verbal and physically demonstrated procedures
-    - eval (Evaluation): Comprehensive assessment using both verbal and visual clinical data
-    - discharge: Combine verbal instructions with any demonstrated procedures/exercises
-    - type: This represents the type of medical visit. The only options are 'emergency-room', 'hospital-stay', 'surgery-procedures', 'maternity-newborn', 'specialist', 'intensive'. Choose the one that best fits the visit.
-
-    Return the response as a valid JSON object with these exact field names.
+
+async def parse_medical_text(raw_text: str, visual_assessment: str = "") -> Dict:
+    """
+    Use Mistral AI to parse combined audio and video information into structured fields.
+    Long transcripts are split into overlapping windows that are extracted concurrently
+    and merged, so prompt size stays bounded however long the visit was.
     """
+    windows = split_transcript(raw_text, NOTE_WINDOW_CHARS, NOTE_WINDOW_OVERLAP)
+    if len(windows) == 1:
+        return await extract_medical_fields(raw_text, visual_assessment)
+
+    print(f"Extracting note from {len(windows)} transcript windows")
+    parts = await asyncio.gather(
+        *(
+            # The visual assessment covers the whole visit, so it is sent only once
+            extract_medical_fields(
+                window, visual_assessment if index == 0 else "", (index, len(windows))
+            )
+            for index, window in enumerate(windows)
+        ),
+        return_exceptions=True,
+    )
+    # A failed window only loses its own part of the note
+    extracted = []
+    for index, part in enumerate(parts):
+        if isinstance(part, Exception):
+            print(f"Extraction failed for window {index + 1}/{len(windows)}: {part}")
+        else:
+            extracted.append(part)
+    if not extracted:
+        raise parts[0]
+    return merge_extractions(extracted)
+
+
+async def extract_medical_fields(
+    raw_text: str, visual_assessment: str, part: Optional[Tuple[int, int]] = None
+) -> Dict:
+    part_note = ""
+    if part is not None:
+        part_note = (
+            f"The transcription below is part {part[0] + 1} of {part[1]} of a longer "
+            "consultation; consecutive parts overlap slightly. Only extract what this "
+            "part contains."
+        )
+
+    prompt = NOTE_PROMPT.render(
+        part_note=part_note, raw_text=raw_text, visual_assessment=visual_assessment
+    )
 
     try:
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers=headers,
-            json={
+        result = await llm_gateway.complete(
+            "mistral",
+            {
                 "model": "mistral-large-latest",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert medical documentation specialist skilled in integrating verbal and visual clinical information.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+                "messages": chat_messages(NOTE_SYSTEM, prompt),
                 "temperature": 0.1,
                 "response_format": {"type": "json_object"},
             },
         )
 
-        if response.status_code != 200:
-            raise Exception(f"API call failed with status code: {response.status_code}")
-
-        result = response.json()
         parsed_content = json.loads(result["choices"][0]["message"]["content"])
         return parsed_content
 
@@ -609,117 +1110,109 @@ def validate_structured_data(data: Dict) -> bool:
     """
     Validates that all required fields are present in the structured data
     """
-    required_fields = [
-        "cc",
-        "hpi",
-        "pmh",
-        "meds",
-        "allergies",
-        "ros",
-        "vitals",
-        "findings",
-        "diagnosis",
-        "plan",
-        "interventions",
-        "eval",
-        "discharge",
-    ]
+    return all(field in data for field in EHR_FIELDS)
 
-    return all(field in data for field in required_fields)
 
+VISION_MODEL = "gemini-2.0-flash-001"
 
-def extract_frames(video_path: str, max_frames: int = 20):
-    """Extract frames from video at regular intervals"""
-    frames = []
-    video = cv2.VideoCapture(video_path)
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-    interval = max(1, total_frames // max_frames)
 
-    current_frame = 0
-    while current_frame < total_frames:
-        video.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-        success, frame = video.read()
-        if success:
-            # Convert BGR to RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            # Convert to PIL Image
-            pil_image = Image.fromarray(frame_rgb)
-            frames.append(pil_image)
-        current_frame += interval
+async def process_video(video_link: str) -> Dict:
+    try:
+        print(f"Processing video: {video_link}")
 
-    video.release()
-    return frames
+        async def generate() -> Dict:
+            client = google_genai.Client(http_options=HttpOptions(api_version="v1"))
+            with timed("gemini", "generate_content (video)"):
+                response = await client.aio.models.generate_content(
+                    model=VISION_MODEL,
+                    contents=[
+                        VISION_PROMPT,
+                        Part.from_uri(
+                            file_uri=video_link,
+                            mime_type="video/mp4",
+                        ),
+                    ],
+                )
+
+            return {
+                "status": "success",
+                "visual_assessment": response.text,
+            }
+
+        # Signed links are never reused, so there is nothing to cache
+        key = llm_cache.key({"model": VISION_MODEL, "video": video_link})
+        return await llm_gateway.call("gemini", key, generate, cache=False)
 
+    except Exception as e:
+        print(f"Error processing video: {str(e)}")
+        return {"status": "error", "error": str(e)}
 
-async def process_video(video_link: str) -> Dict:
+
+def keyframe_timeline(
+    frames: List[EncodedFrame], transcript: Optional[LiveTranscript] = None
+) -> str:
+    """
+    List when each frame was taken, as offsets from the start of the recording,
+    with what was being said at the time. Frames and transcript share the audio's
+    clock, so each frame lines up with its part of the conversation.
+    """
+    lines = [
+        "The frames below were taken at these points in the visit recording,"
+        " shown with what was being said at the time:"
+    ]
+    for number, frame in enumerate(frames, start=1):
+        minutes, seconds = divmod(int(frame.timestamp), 60)
+        line = f"Frame {number}: {minutes:02d}:{seconds:02d}"
+        said = transcript.around(frame.timestamp) if transcript is not None else ""
+        lines.append(f"{line} - {said}" if said else line)
+    return "\n".join(lines)
+
+
+async def process_keyframes(
+    frames: List[EncodedFrame], transcript: Optional[LiveTranscript] = None
+) -> Dict:
+    """
+    Assess a visit from its sampled keyframes instead of the full video. The
+    response is cached under the hashes of the frames, so re-running a visit's
+    note does not send the same images again.
+    """
+    if not frames:
+        return {"status": "success", "visual_assessment": ""}
     try:
-        print(f"Processing video: {video_link}")
-        # frames = extract_frames(video_path)
-
-        # Get the video link
-
-        prompt = """You are an expert medical professional specialized in visual clinical assessment. 
-        Analyze these frames from a medical consultation and focus ONLY on visual medical information 
-        that would complement an audio transcription.
-
-        Specifically identify and describe:
-
-        1. Physical Examination Findings:
-           - Visible skin conditions, lesions, or rashes
-           - Patient's mobility and gait patterns
-           - Visible swelling or deformities
-           - Facial expressions indicating pain or discomfort
-           - Any medical devices or supports being used
-
-        2. Visual Clinical Signs:
-           - Patient's general appearance and apparent distress level
-           - Visible breathing patterns or respiratory effort
-           - Apparent neurological signs (tremors, asymmetry, etc.)
-           - Color changes (pallor, cyanosis, jaundice)
-           - Visible wounds, bandages, or surgical sites
-
-        3. Demonstrated Physical Assessments:
-           - Range of motion tests performed
-           - Physical manipulation of joints or limbs
-           - Neurological examination maneuvers
-           - Any medical instruments used and their readings
-           - Demonstration of exercises or techniques
-
-        4. Non-verbal Communication:
-           - Patient's body language indicating comfort/discomfort
-           - Physical demonstrations of symptoms by patient
-           - Doctor's demonstrative instructions or examinations
-
-        5. Environmental/Contextual Information:
-           - Medical equipment visible in the room
-           - Use of assistive devices
-           - Any visible medical imaging or test results
-           - Demonstrated use of medical devices
-
-        Format the response as a structured medical observation report, focusing ONLY on 
-        visually observable information that would NOT be captured in audio transcription.
-        If certain categories have no observable information, mark them as 'No visible findings'.
-        """
-
-        client = genai.Client(http_options=HttpOptions(api_version="v1"))
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-001",
-            contents=[
-                prompt,
-                Part.from_uri(
-                    file_uri=video_link,
-                    mime_type="video/mp4",
-                ),
-            ],
+        print(f"Processing {len(frames)} keyframes")
+        timeline = keyframe_timeline(frames, transcript)
+        cache_key = llm_cache.key(
+            {
+                "model": VISION_MODEL,
+                "prompt": VISION_PROMPT,
+                "timeline": timeline,
+                "frames": [hashlib.sha256(frame.data).hexdigest() for frame in frames],
+            }
         )
+        contents = [VISION_PROMPT, timeline]
+        for number, frame in enumerate(frames, start=1):
+            contents.append(f"Frame {number}:")
+            contents.append(Part.from_bytes(data=frame.data, mime_type=frame.mime_type))
+
+        async def generate() -> Dict:
+            client = google_genai.Client(http_options=HttpOptions(api_version="v1"))
+            record_payload(
+                "gemini", "request", sum(len(frame.data) for frame in frames)
+            )
+            with timed("gemini", "generate_content (keyframes)"):
+                response = await client.aio.models.generate_content(
+                    model=VISION_MODEL, contents=contents
+                )
 
-        return {
-            "status": "success",
-            "visual_assessment": response.text,
-        }
+            return {
+                "status": "success",
+                "visual_assessment": response.text,
+            }
+
+        return await llm_gateway.call("gemini", cache_key, generate)
 
     except Exception as e:
-        print(f"Error processing video: {str(e)}")
+        print(f"Error processing keyframes: {str(e)}")
         return {"status": "error", "error": str(e)}
 
 
@@ -728,71 +1221,28 @@ async def generate_visit_questions(visit_id: int) -> List[str]:
     """
     Generate relevant questions based on visit data using Mistral API
     """
-    visit = supabase.table("visit").select("*").eq("id", visit_id).execute()
-    visit_data = visit.data[0]
-    print("visit_data", visit_data)
-
-    mistral_api_key = os.getenv("MISTRAL_API_KEY")
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {mistral_api_key}",
-    }
+    visit_data = await asyncio.to_thread(fetch_visit, visit_id)
+    if visit_data is None:
+        raise HTTPException(status_code=404, detail="Visit not found")
 
-    prompt = f"""As a medical AI assistant, generate 4 brief but relevant and specific questions based on this visit:
-    
-    Chief Complaint: {visit_data.get("cc", "")}
-    Diagnosis: {visit_data.get("diagnosis", "")}
-    Treatment Plan: {visit_data.get("plan", "")}
-    Medications: {visit_data.get("meds", "")}
-    
-    Generate 4 brief questions that:
-    1. Focus on understanding the diagnosis in simple terms
-    2. Address treatment plans and medications clearly
-    3. Cover potential side effects or complications to watch for
-    4. Include follow-up care instructions
-
-    Rules for questions:
-    1. Keep each question under 8 words
-    2. Focus on the specific diagnosis and treatment
-    3. Use everyday language, no medical jargon
-    4. Make them actionable and practical
-    
-    Return ONLY a JSON object in this exact format:
-    {{
-        "questions": [
-            "question1",
-            "question2",
-            "question3",
-            "question4"
-        ]
-    }}"""
+    prompt = QUESTIONS_PROMPT.render(
+        **{field: visit_data.get(field, "") for field in QUESTIONS_PROMPT.fields}
+    )
 
     try:
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers=headers,
-            json={
+        result = await llm_gateway.complete(
+            "mistral",
+            {
                 "model": "mistral-large-latest",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an empathetic medical assistant helping patients understand their care.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+                "messages": chat_messages(QUESTIONS_SYSTEM, prompt),
                 "temperature": 0.3,
                 "response_format": {"type": "json_object"},
             },
+            tags=[f"visit:{visit_id}"],
         )
 
-        if response.status_code == 200:
-            result = response.json()
-            questions = json.loads(result["choices"][0]["message"]["content"])[
-                "questions"
-            ]
-            return questions[:4]  # Ensure we return exactly 4 questions
-        else:
-            raise Exception(f"API call failed with status {response.status_code}")
+        questions = json.loads(result["choices"][0]["message"]["content"])["questions"]
+        return questions[:4]  # Ensure we return exactly 4 questions
 
     except Exception as e:
         print(f"Error generating questions: {e}")
@@ -807,32 +1257,95 @@ async def generate_visit_questions(visit_id: int) -> List[str]:
 ### Doctor Portal Endpoints
 
 
+# Projections the visit list endpoints can return, picked with ?fields=. Each one
+# includes created_at and id, which the pagination cursor is built from.
+VISIT_FIELD_SETS = {
+    "ids": "id, created_at",
+    "list": "id, patient(first_name, last_name, language), created_at, approved",
+    "portal": "id, doctor(first_name, last_name, location), created_at, type",
+    "full": "id, patient(mrn, first_name, last_name, age, gender, language), "
+    "doctor(first_name, last_name, location), created_at, type, approved, "
+    + ", ".join(EHR_FIELDS),
+}
+
+
+def list_visits(
+    response: Response,
+    fields: str,
+    limit: int,
+    cursor: Optional[str],
+    approved: Optional[bool],
+    doctor: Optional[int],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    patient: Optional[int] = None,
+) -> List[Dict]:
+    """
+    One page of visits, newest first. The cursor for the next page is returned in
+    the X-Next-Cursor header so the body stays a plain list.
+    """
+    if fields not in VISIT_FIELD_SETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"fields must be one of {', '.join(VISIT_FIELD_SETS)}",
+        )
+
+    query = supabase.table("visit").select(VISIT_FIELD_SETS[fields])
+    if patient is not None:
+        query = query.eq("patient", patient)
+    if approved is not None:
+        query = query.eq("approved", approved)
+    if doctor is not None:
+        query = query.eq("doctor", doctor)
+    if since is not None:
+        query = query.gte("created_at", since.isoformat())
+    if until is not None:
+        query = query.lt("created_at", until.isoformat())
+
+    try:
+        after = decode_cursor(cursor) if cursor is not None else None
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with timed("supabase", "visit.page"):
+        visits, next_cursor = paginate(query, limit, after)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return visits
+
+
 # Get all visits
 @app.get("/visits")
-def get_visits():
-    visits = (
-        supabase.table("visit")
-        .select("id, patient(first_name, last_name, language), created_at, approved")
-        .order("created_at", desc=True)
-        .execute()
-    )
-    print("visits", visits)
-    return visits.data
+def get_visits(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    approved: Optional[bool] = None,
+    doctor: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: str = "list",
+):
+    return list_visits(response, fields, limit, cursor, approved, doctor, since, until)
 
 
 # Get visit for patient by id
 @app.get("/visits/{id}")
 def get_visit_by_id(id: int):
-    visits = (
-        supabase.table("visit")
-        .select(
-            "id, patient(mrn, first_name, last_name, age, gender), doctor(first_name, last_name), created_at, hpi, pmh, cc, meds, allergies, ros, vitals, findings, diagnosis, plan, interventions, eval, discharge, approved"
-        )
-        .eq("id", id)
-        .execute()
+    visit_data = record_cache.get(
+        f"visit:{id}",
+        "detail",
+        lambda: fetch_one(
+            supabase.table("visit")
+            .select(
+                "id, patient(mrn, first_name, last_name, age, gender), doctor(first_name, last_name), created_at, hpi, pmh, cc, meds, allergies, ros, vitals, findings, diagnosis, plan, interventions, eval, discharge, approved"
+            )
+            .eq("id", id),
+            "visit.select",
+        ),
     )
-
-    visit_data = visits.data[0]
+    if visit_data is None:
+        raise HTTPException(status_code=404, detail="Visit not found")
 
     # Flatten the patient and doctor info into the visit data
     visit_data["patient_first_name"] = visit_data["patient"]["first_name"]
@@ -846,99 +1359,49 @@ def get_visit_by_id(id: int):
     return visit_data
 
 
-@app.get("/visit-summary/{id}")
-def get_visit_summary(id: int):
-    visits = (
-        supabase.table("visit")
-        .select(
-            "id, patient(mrn, first_name, last_name, age, gender, language), doctor(first_name, last_name), created_at, hpi, pmh, cc, meds, allergies, ros, vitals, findings, diagnosis, plan, interventions, eval, discharge, approved"
-        )
-        .eq("id", id)
-        .execute()
+def visit_summary_payload(id: int) -> Dict:
+    """
+    Build the Mistral request for a visit's patient-friendly summary
+    """
+    visit_data = record_cache.get(
+        f"visit:{id}",
+        "summary",
+        lambda: fetch_one(
+            supabase.table("visit")
+            .select(
+                "id, patient(mrn, first_name, last_name, age, gender, language), doctor(first_name, last_name), created_at, hpi, pmh, cc, meds, allergies, ros, vitals, findings, diagnosis, plan, interventions, eval, discharge, approved"
+            )
+            .eq("id", id),
+            "visit.select",
+        ),
     )
-
-    if not visits.data:
+    if visit_data is None:
         raise HTTPException(status_code=404, detail="Visit not found")
+    patient, doctor = visit_data["patient"], visit_data["doctor"]
+    prompt = SUMMARY_PROMPT.render(
+        first_name=patient["first_name"],
+        last_name=patient["last_name"],
+        mrn=patient["mrn"],
+        doctor_first_name=doctor["first_name"],
+        doctor_last_name=doctor["last_name"],
+        created_at=visit_data["created_at"],
+        language=patient["language"],
+        **{field: visit_data.get(field, "") for field in SUMMARY_PROMPT.budgets},
+    )
 
-    visit_data = visits.data[0]
-    prompt = f"""You are a medical professional translating a visit record into patient-friendly language. 
-    Write the entire response in {visit_data["patient"]["language"]} language.
-    Create a clear, reassuring summary that speaks directly to the patient using simple terms and helpful explanations.
-    Format the response in markdown for better readability.
-
-    Using this visit information:
-    Patient: {visit_data["patient"]["first_name"]} {visit_data["patient"]["last_name"]} (MRN: {visit_data["patient"]["mrn"]})
-    Doctor: {visit_data["doctor"]["first_name"]} {visit_data["doctor"]["last_name"]}
-    Date: {visit_data["created_at"]}
-    
-    Create a summary following this structure:
-
-    # Summary of Visit with Dr. {visit_data["doctor"]["last_name"]}
-
-    ### When you visited
-    {visit_data["created_at"]}
-
-    ### Your main concern
-    [Explain {visit_data.get("cc", "")} in simple terms]
-
-    ### What you told Dr. {visit_data["doctor"]["last_name"]}
-    [Summarize {visit_data.get("hpi", "")} in everyday language]
-
-    ### What We Found
-    **Key findings:** [Explain {visit_data.get("findings", "")} and vital signs in simple terms]
-
-    **Our understanding:** [Translate {visit_data.get("diagnosis", "")} into patient-friendly language]
-
-    ### Your Treatment Plan
-    **To manage your symptoms:**
-    [Break down {visit_data.get("plan", "")} into clear steps]
-
-    **How to do it:**
-    [Explain any procedures {visit_data.get("interventions", "")} as simple steps]
-
-    **When to use it:**
-    [Provide clear guidance on timing and frequency]
+    return {
+        "model": "mistral-large-latest",
+        "messages": chat_messages(SUMMARY_SYSTEM, prompt),
+    }
 
-    ### Next Steps
-    **Follow-up care:**
-    - [Convert {visit_data.get("discharge", "")} into clear bullet points]
-    - [Add any lifestyle recommendations]
-    - [Include warning signs to watch for]
 
-    Important notes:
-    - Add extra line breaks between sections for better readability
-    - Use bold text for important points
-    - Keep paragraphs short (2-3 lines maximum)
-    - Explain medical terms in parentheses
-    - Use bullet points for lists
-    - Maintain a warm, reassuring tone
-    """
+@app.get("/visit-summary/{id}")
+async def get_visit_summary(id: int):
+    payload = await asyncio.to_thread(visit_summary_payload, id)
 
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {mistral_api_key}",
-        }
-
-        response = requests.post(
-            "https://api.mistral.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "model": "mistral-large-latest",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a medical professional summarizing a patient visit record.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            },
-        )
+        result = await llm_gateway.complete("mistral", payload, tags=[f"visit:{id}"])
 
-        if response.status_code != 200:
-            raise Exception(f"API call failed with status code: {response.status_code}")
-
-        result = response.json()
         summary = result["choices"][0]["message"]["content"]
         return summary
 
@@ -947,25 +1410,45 @@ def get_visit_summary(id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/visit-summary/{id}/stream")
+async def stream_visit_summary(id: int):
+    """
+    Server-Sent Events version of /visit-summary that forwards tokens as they arrive
+    """
+    payload = await asyncio.to_thread(visit_summary_payload, id)
+    return event_stream(stream_completion("mistral", payload, tags=[f"visit:{id}"]))
+
+
 ### Patient Portal Endpoints
 @app.get("/patient-visits")
-def get_patient_visits(patient_id: int):
-    visits = (
-        supabase.table("visit")
-        .select("id, doctor(first_name, last_name), created_at")
-        .eq("patient", patient_id)
-        .order("created_at", desc=True)
-        .execute()
+def get_patient_visits(
+    patient_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    approved: Optional[bool] = None,
+    doctor: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: str = "portal",
+):
+    return list_visits(
+        response, fields, limit, cursor, approved, doctor, since, until, patient_id
     )
-    return visits.data
 
 
 @app.get("/patient/{patient_mrn}")
 def get_patient(patient_mrn: int):
-    patient = (
-        supabase.table("patient")
-        .select("mrn, first_name, last_name, age, gender")
-        .eq("mrn", patient_mrn)
-        .execute()
+    patient = record_cache.get(
+        f"patient:{patient_mrn}",
+        "profile",
+        lambda: fetch_one(
+            supabase.table("patient")
+            .select("mrn, first_name, last_name, age, gender")
+            .eq("mrn", patient_mrn),
+            "patient.select",
+        ),
     )
-    return patient.data[0]
+    if patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return patient
@@ -0,0 +1,292 @@
+# Standard library imports
+import wave
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional
+
+# Third party imports
+import cv2
+import numpy as np
+
+# Video settings
+VIDEO_WIDTH, VIDEO_HEIGHT = 320, 240
+VIDEO_FRAME_RATE = 10  # FPS
+
+# Uploads are consumed in pieces of this size so memory use stays flat
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def iter_jpeg_frames(file_bytes: bytes):
+    """
+    Yield zero-copy views of each frame in a stream of length-prefixed JPEG frames
+    """
+    view = memoryview(file_bytes)
+    offset = 0
+    while offset + 4 <= len(view):
+        # Read frame size (4 bytes)
+        frame_size = int.from_bytes(view[offset : offset + 4], byteorder="little")
+        offset += 4  # Move past frame size metadata
+
+        yield view[offset : offset + frame_size]
+        offset += frame_size
+
+
+def read_jpeg_frames(src: BinaryIO):
+    """
+    Yield each frame of a length-prefixed JPEG stream read incrementally from a file
+    """
+    while True:
+        header = src.read(4)
+        if len(header) < 4:
+            return
+        frame_size = int.from_bytes(header, byteorder="little")
+        frame_data = src.read(frame_size)
+        if len(frame_data) < frame_size:
+            print("Video upload ended mid-frame.")
+            return
+        yield frame_data
+
+
+def decode_jpeg(frame_data) -> Optional[np.ndarray]:
+    """
+    Decode a JPEG straight from memory into a BGR frame of the output video size
+    """
+    frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    if frame.shape[1] != VIDEO_WIDTH or frame.shape[0] != VIDEO_HEIGHT:
+        # VideoWriter silently drops frames that do not match its size
+        frame = cv2.resize(
+            frame, (VIDEO_WIDTH, VIDEO_HEIGHT), interpolation=cv2.INTER_AREA
+        )
+    return frame
+
+
+def encode_jpeg_frames(frames: Iterable, video_file_path: str) -> int:
+    """
+    Decode JPEG frames one at a time and encode them into an MP4 file. A frame
+    that fails to decode is replaced by its neighbour, so frame n of the video is
+    always frame n of the stream.
+    """
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    video_writer = cv2.VideoWriter(
+        video_file_path, fourcc, VIDEO_FRAME_RATE, (VIDEO_WIDTH, VIDEO_HEIGHT)
+    )
+    if not video_writer.isOpened():
+        raise RuntimeError(f"Could not open video writer for {video_file_path}")
+
+    written = 0
+    pending = 0  # undecodable frames before the first good one
+    last = None
+    try:
+        for frame_data in frames:
+            frame = decode_jpeg(frame_data)
+            if frame is None:
+                if last is None:
+                    pending += 1
+                    continue
+                frame = last
+            for _ in range(pending + 1):
+                video_writer.write(frame)
+                written += 1
+            pending = 0
+            last = frame
+    finally:
+        video_writer.release()
+
+    print(f"Encoded {written} frames.")
+    return written
+
+
+def assemble_video(file_bytes: bytes, video_file_path: str) -> int:
+    """
+    Encode a stream of length-prefixed JPEG frames into an MP4 file, without
+    writing the individual frames to disk
+    """
+    return encode_jpeg_frames(iter_jpeg_frames(file_bytes), video_file_path)
+
+
+def assemble_video_stream(src: BinaryIO, video_file_path: str) -> int:
+    """
+    Like assemble_video, but parses frames from a file as it is read so only one
+    frame is held in memory at a time
+    """
+    return encode_jpeg_frames(read_jpeg_frames(src), video_file_path)
+
+
+def assemble_video_file(frames_path: str, video_file_path: str) -> int:
+    """
+    assemble_video_stream for a stream saved to disk. It takes a path rather than
+    an open file, so it can run in a worker process.
+    """
+    with open(frames_path, "rb") as src:
+        return assemble_video_stream(src, video_file_path)
+
+
+def write_wav_stream(
+    src: BinaryIO,
+    audio_file_path: str,
+    sample_rate: int,
+    channels: int,
+    sample_width: int,
+) -> int:
+    """
+    Copy raw PCM from a file into a WAV file in fixed-size chunks and return the
+    number of samples written
+    """
+    frame_size = channels * sample_width
+    carry = b""
+    written = 0
+
+    with wave.open(audio_file_path, "w") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            # Hold back a partial sample until the rest of it arrives
+            data = carry + chunk
+            usable = len(data) - len(data) % frame_size
+            wav_file.writeframes(data[:usable])
+            carry = data[usable:]
+            written += usable // sample_width
+
+    return written
+
+
+class Keyframe(NamedTuple):
+    index: int  # frame number in the source video
+    timestamp: float  # seconds from the start of the recording
+    score: float  # mean absolute difference from the previous kept frame, 0-255
+    image: np.ndarray  # RGB uint8, at most max_width wide
+
+
+def extract_frames(
+    video_path: str,
+    max_frames: int = 20,
+    sample_fps: float = 2.0,
+    max_width: int = 512,
+    min_score: float = 8.0,
+    frame_times: Optional[List[float]] = None,
+) -> List[Keyframe]:
+    """
+    Pick the most informative frames of a video in one sequential pass.
+
+    Frames are sampled at sample_fps without seeking. Each sample is downscaled
+    first, then scored by how much it differs from the last kept frame, using a
+    small grayscale thumbnail. Samples that differ by at least min_score (a scene
+    change or clear motion) become candidates, and the max_frames highest-scoring
+    ones are returned in time order. The first frame is always kept.
+
+    frame_times gives the time of each frame in the recording. Without it, times
+    are derived from the video's frame rate.
+    """
+    video = cv2.VideoCapture(video_path)
+    fps = video.get(cv2.CAP_PROP_FPS) or VIDEO_FRAME_RATE
+    stride = max(1, round(fps / sample_fps))
+
+    candidates: List[Keyframe] = []
+    last_thumb = None
+    index = -1
+    try:
+        while True:
+            # grab() advances without decoding to an image; only samples are retrieved
+            if not video.grab():
+                break
+            index += 1
+            if index % stride:
+                continue
+            success, frame = video.retrieve()
+            if not success:
+                continue
+
+            height, width = frame.shape[:2]
+            if width > max_width:
+                frame = cv2.resize(
+                    frame,
+                    (max_width, round(height * max_width / width)),
+                    interpolation=cv2.INTER_AREA,
+                )
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumb = cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA)
+            thumb = thumb.astype(np.int16)
+
+            if last_thumb is None:
+                score = 255.0
+            else:
+                score = float(np.abs(thumb - last_thumb).mean())
+            if score < min_score:
+                continue
+
+            last_thumb = thumb
+            if frame_times is not None and index < len(frame_times):
+                timestamp = frame_times[index]
+            else:
+                timestamp = index / fps
+            candidates.append(Keyframe(index, timestamp, score, frame))
+            if len(candidates) > 2 * max_frames:
+                candidates = _top_keyframes(candidates, max_frames)
+    finally:
+        video.release()
+
+    # Only the frames that are kept are converted from BGR to RGB
+    return [
+        keyframe._replace(image=cv2.cvtColor(keyframe.image, cv2.COLOR_BGR2RGB))
+        for keyframe in _top_keyframes(candidates, max_frames)
+    ]
+
+
+def _top_keyframes(candidates: List[Keyframe], max_frames: int) -> List[Keyframe]:
+    # Highest scores win; the result stays in time order
+    scores = np.array([keyframe.score for keyframe in candidates])
+    keep = np.sort(np.argsort(-scores, kind="stable")[:max_frames])
+    return [candidates[i] for i in keep]
+
+
+class EncodedFrame(NamedTuple):
+    timestamp: float  # seconds from the start of the recording
+    mime_type: str
+    data: bytes
+
+
+FRAME_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def encode_keyframes(
+    keyframes: Iterable[Keyframe], image_format: str = "jpeg", quality: int = 80
+) -> List[EncodedFrame]:
+    """
+    Compress keyframes into JPEG or WebP images for a vision model
+    """
+    extension, mime_type, quality_flag = FRAME_FORMATS[image_format]
+    encoded = []
+    for keyframe in keyframes:
+        image = cv2.cvtColor(keyframe.image, cv2.COLOR_RGB2BGR)
+        success, buffer = cv2.imencode(extension, image, [quality_flag, quality])
+        if success:
+            encoded.append(
+                EncodedFrame(keyframe.timestamp, mime_type, buffer.tobytes())
+            )
+    return encoded
+
+
+def sample_keyframes(
+    video_path: str,
+    max_frames: int = 20,
+    max_width: int = 512,
+    image_format: str = "jpeg",
+    quality: int = 80,
+    frame_times: Optional[List[float]] = None,
+) -> List[EncodedFrame]:
+    """
+    Select and compress a video's keyframes in one call, so the whole job can run
+    in a worker process and only the small encoded images come back
+    """
+    keyframes = extract_frames(
+        video_path, max_frames=max_frames, max_width=max_width, frame_times=frame_times
+    )
+    return encode_keyframes(keyframes, image_format, quality)
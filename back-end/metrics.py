@@ -0,0 +1,166 @@
+# Standard library imports
+import time
+from contextlib import contextmanager
+from typing import List
+
+# Third party imports
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency buckets in seconds, from fast cache hits up to long transcriptions
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+# Payload buckets in bytes, from 1 KB to 256 MB
+SIZE_BUCKETS = tuple(1024 * 4**i for i in range(10))
+
+# Lag buckets in seconds for /ws frames, which are stored within a millisecond
+# when the server keeps up
+INGEST_LAG_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+# Prompt size buckets in tokens, from a short question prompt to a full window
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Every metric goes to prometheus_client's default registry, which also exports
+# process_resident_memory_bytes and the other process_* metrics on Linux
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle each request, by route template and status",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUEST_ERRORS = Counter(
+    "http_request_errors",
+    "Requests that ended in a 5xx response or an exception",
+    ["method", "route"],
+)
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each pipeline stage",
+    ["pipeline", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "pipeline_stage_errors",
+    "Pipeline stages that raised",
+    ["pipeline", "stage"],
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "external_call_duration_seconds",
+    "Time spent in calls to Deepgram, Gemini, Mistral, Supabase and storage",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "external_call_errors",
+    "External calls that raised",
+    ["service", "operation"],
+)
+LLM_GATEWAY_EVENTS = Counter(
+    "llm_gateway_events",
+    "LLM calls served from cache, coalesced, retried, throttled or hedged",
+    ["provider", "event"],
+)
+LLM_RATE_LIMIT = Gauge(
+    "llm_rate_limit",
+    "Requests per second currently allowed to each LLM provider",
+    ["provider"],
+)
+INGEST_FRAME_LAG_SECONDS = Histogram(
+    "ingest_frame_lag_seconds",
+    "Time from a /ws frame's client timestamp until it was stored",
+    ["packet"],
+    buckets=INGEST_LAG_BUCKETS,
+)
+INGEST_FRAMES = Counter("ingest_frames", "Frames received on /ws", ["packet"])
+INGEST_BYTES = Counter("ingest_bytes", "Payload bytes received on /ws", ["packet"])
+INGEST_SESSIONS = Gauge(
+    "ingest_sessions", "Open /ws ingest sessions, including detached ones"
+)
+PROMPT_TOKENS = Histogram(
+    "prompt_tokens",
+    "Approximate input tokens of each rendered LLM prompt, by tiktoken cl100k_base "
+    "or a regex estimate, not the provider's own tokenizer",
+    ["template"],
+    buckets=TOKEN_BUCKETS,
+)
+PROMPT_FIELDS_TRIMMED = Counter(
+    "prompt_fields_trimmed",
+    "Prompt field values cut down to fit their token budget",
+    ["template", "field"],
+)
+PAYLOAD_BYTES = Histogram(
+    "payload_size_bytes",
+    "Size of payloads sent to and received from external services",
+    ["service", "direction"],
+    buckets=SIZE_BUCKETS,
+)
+
+
+@contextmanager
+def timed(service: str, operation: str):
+    """
+    Record the duration of an external call, and count it as an error if it raises
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(service, operation)
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, operation).observe(
+            time.perf_counter() - start
+        )
+
+
+def record_error(service: str, operation: str):
+    """
+    Count a failed external call that did not raise, e.g. an HTTP error status
+    """
+    EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+
+
+def record_payload(service: str, direction: str, size: int):
+    PAYLOAD_BYTES.labels(service, direction).observe(size)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Percentile of raw samples, interpolating linearly between the closest ranks
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
@@ -0,0 +1,65 @@
+# Standard library imports
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Clients read the cursor for the following page from this response header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(row: Dict) -> str:
+    position = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Read a cursor back into its (created_at, id) position. The timestamp is
+    parsed and re-serialized, so a forged cursor cannot inject PostgREST filter
+    syntax into the query.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at).isoformat(), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Invalid cursor: {cursor}") from e
+
+
+def paginate(
+    query, limit: int, after: Optional[Tuple[str, int]] = None
+) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Run a newest-first keyset-paginated query on (created_at, id).
+
+    Rather than an offset, the page starts after a decoded cursor's position, so
+    each page is an index range scan however deep the client pages. Every row the
+    query selects must include created_at and id. Returns the rows and the cursor
+    for the next page, or None on the last page.
+    """
+    if after is not None:
+        created_at, row_id = after
+        query = query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{row_id})'
+        )
+    rows = (
+        query.order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+        .execute()
+        .data
+    )
+    # The extra row only tells us whether another page exists
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
@@ -0,0 +1,95 @@
+# Standard library imports
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+# Local imports
+from metrics import STAGE_ERRORS, STAGE_SECONDS
+
+
+class Stage(NamedTuple):
+    name: str
+    fn: Callable[[Dict], Awaitable]
+    deps: Tuple[str, ...]
+
+
+class Pipeline:
+    """
+    Dependency graph of async stages. Each stage starts as soon as the stages it
+    depends on have finished, so independent branches run concurrently.
+
+    A stage function receives a dict of the results of every finished stage and
+    returns its own result.
+    """
+
+    def __init__(self, name: str, kind: Optional[str] = None):
+        self.name = name
+        # Stage metrics are labeled by kind, so runs of the same pipeline add up
+        self.kind = kind or name
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def stage(self, name: str, deps: Iterable[str] = ()):
+        def decorator(fn):
+            self.add(name, fn, deps)
+            return fn
+
+        return decorator
+
+    def add(self, name: str, fn: Callable[[Dict], Awaitable], deps: Iterable[str] = ()):
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = Stage(name, fn, deps)
+
+    async def run(
+        self, on_stage_done: Optional[Callable[[str, float], Awaitable]] = None
+    ) -> Dict:
+        results: Dict = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+
+        async def run_stage(stage: Stage):
+            if stage.deps:
+                await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+            stage_start = time.perf_counter()
+            try:
+                results[stage.name] = await stage.fn(results)
+            except Exception:
+                STAGE_ERRORS.labels(self.kind, stage.name).inc()
+                raise
+            stage_end = time.perf_counter()
+            STAGE_SECONDS.labels(self.kind, stage.name).observe(stage_end - stage_start)
+            self.timings[stage.name] = {
+                "start": stage_start - started,
+                "duration": stage_end - stage_start,
+            }
+            if on_stage_done is not None:
+                await on_stage_done(stage.name, stage_end - stage_start)
+
+        # Stages are registered in dependency order, so deps always have a task
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.timings["total"] = {
+                "start": 0.0,
+                "duration": time.perf_counter() - started,
+            }
+            print(f"{self.name} timings: {self.format_timings()}")
+
+        return results
+
+    def format_timings(self) -> str:
+        return ", ".join(
+            f"{name}={timing['duration'] * 1000:.0f}ms"
+            for name, timing in self.timings.items()
+        )
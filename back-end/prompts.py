@@ -0,0 +1,341 @@
+# Standard library imports
+import re
+import string
+import textwrap
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from metrics import PROMPT_FIELDS_TRIMMED, PROMPT_TOKENS
+
+# tiktoken is optional and not a declared dependency. It also fetches its
+# encoding over the network on first use, so a failed load falls back the same
+# way a missing package does.
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    print(f"tiktoken unavailable ({e}), prompt token counts are estimates")
+    _ENCODING = None
+
+# Without tiktoken, text is split into whitespace-led pieces of up to four word
+# characters or one symbol, which tracks BPE token counts closely for English
+_PIECE = re.compile(r"\s*(?:\w{1,4}|[^\w\s])|\s+")
+
+# Spoken fillers that carry nothing for a clinical note
+_FILLERS = re.compile(r"\b(?:um+|uh+|erm+|hmm+)\b[,.]?\s*", re.IGNORECASE)
+
+TRIM_MARKER = " [...] "
+
+
+def tokenize(text: str) -> List:
+    """
+    Split text into tokens for budgeting. Counts are approximate either way:
+    cl100k_base is not the Gemini or Mistral tokenizer, and the regex fallback
+    used without tiktoken is only an estimate. Budgets need some headroom below
+    a model's hard limit.
+    """
+    if _ENCODING is not None:
+        return _ENCODING.encode(text)
+    return _PIECE.findall(text)
+
+
+def detokenize(tokens: List) -> str:
+    if _ENCODING is not None:
+        return _ENCODING.decode(tokens)
+    return "".join(tokens)
+
+
+def count_tokens(text: str) -> int:
+    return len(tokenize(text))
+
+
+def compact(text: str) -> str:
+    """
+    Drop spoken fillers and redundant whitespace, which cost tokens but no content
+    """
+    text = _FILLERS.sub("", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def fit(text: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    Compact a field value and, if it is still over max_tokens, cut the middle
+    out. The start and end of a transcript or record (the complaint, and the
+    plan and instructions) are kept. Returns the text and whether it was cut.
+    """
+    text = compact(text)
+    tokens = tokenize(text)
+    if len(tokens) <= max_tokens:
+        return text, False
+    keep = max(0, max_tokens - count_tokens(TRIM_MARKER))
+    head = detokenize(tokens[: keep - keep // 2])
+    tail = detokenize(tokens[len(tokens) - keep // 2 :]) if keep // 2 else ""
+    return head.rstrip() + TRIM_MARKER + tail.lstrip(), True
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once at import time.
+
+    The text is dedented and its {placeholders} parsed up front, so rendering is
+    a join of fixed pieces and field values. Each budgeted field is compacted
+    and trimmed to its token budget before it is inserted.
+
+    Templates put their instructions first and the per-call fields last. The
+    longer the fixed prefix shared by every call, the more of each request a
+    provider's prompt cache can reuse.
+    """
+
+    def __init__(self, name: str, text: str, budgets: Optional[Dict[str, int]] = None):
+        self.name = name
+        self.budgets = budgets or {}
+        self._pieces: List[Tuple[str, Optional[str]]] = [
+            (literal, field)
+            for literal, field, _, _ in string.Formatter().parse(
+                textwrap.dedent(text).strip()
+            )
+        ]
+        self.fields = [field for _, field in self._pieces if field is not None]
+        unknown = set(self.budgets) - set(self.fields)
+        if unknown:
+            raise ValueError(f"{name} has budgets for unknown fields {unknown}")
+
+    @property
+    def prefix(self) -> str:
+        """
+        The fixed text before the first field, identical on every call
+        """
+        return self._pieces[0][0]
+
+    def render(self, **values) -> str:
+        parts = []
+        for literal, field in self._pieces:
+            parts.append(literal)
+            if field is None:
+                continue
+            value = "" if values[field] is None else str(values[field])
+            if field in self.budgets:
+                value, trimmed = fit(value, self.budgets[field])
+                if trimmed:
+                    PROMPT_FIELDS_TRIMMED.labels(self.name, field).inc()
+            parts.append(value)
+        prompt = "".join(parts)
+        PROMPT_TOKENS.labels(self.name).observe(count_tokens(prompt))
+        return prompt
+
+
+NOTE_SYSTEM = (
+    "You are an expert medical documentation specialist skilled in integrating "
+    "verbal and visual clinical information."
+)
+
+NOTE_PROMPT = PromptTemplate(
+    "note",
+    """
+    You are an expert medical doctor with extensive experience in clinical documentation and EHR systems.
+    Your task is to analyze both the transcribed consultation and visual assessment data to create a comprehensive medical record.
+
+    Please combine and parse both sources of information with high attention to medical accuracy and detail. For each field:
+    - Extract and combine relevant information from both the audio transcription and visual assessment
+    - Use standard medical terminology
+    - Maintain clinical relevance
+    - If information for a field is not present in either source, return an empty string
+    - When information appears in both sources, combine them coherently
+    - Prioritize objective visual findings when they complement verbal descriptions
+
+    Parse the combined information into these specific fields and return ONLY a JSON object:
+
+    - cc (Chief Complaint): Combine verbal complaint with visible signs of distress or symptoms
+    - hpi (History of Present Illness): Integrate verbal history with observed physical manifestations
+    - pmh (Past Medical History): Include visible evidence of past procedures/conditions with reported history
+    - meds (Current Medications): List medications mentioned and any visible medication use observed
+    - allergies: Combine reported allergies with any visible allergic reactions
+    - ros (Review of Systems): Merge verbal review with visible signs/symptoms
+    - vitals: Combine verbally reported and visually observed/measured vital signs
+    - findings: Integrate verbal and visual physical examination findings, organized by body system
+    - diagnosis: Synthesize diagnoses based on both verbal and visual clinical evidence
+    - plan: Treatment plan incorporating both discussed and demonstrated interventions
+    - interventions: Document both verbal and physically demonstrated procedures
+    - eval (Evaluation): Comprehensive assessment using both verbal and visual clinical data
+    - discharge: Combine verbal instructions with any demonstrated procedures/exercises
+    - type: This represents the type of medical visit. The only options are 'emergency-room', 'hospital-stay', 'surgery-procedures', 'maternity-newborn', 'specialist', 'intensive'. Choose the one that best fits the visit.
+
+    Return the response as a valid JSON object with these exact field names.
+
+    {part_note}
+
+    Audio Transcription:
+    {raw_text}
+
+    Visual Assessment:
+    {visual_assessment}
+    """,
+    # Transcripts are already windowed to about 3k tokens; this only catches
+    # outliers such as one very long monologue
+    budgets={"raw_text": 6000, "visual_assessment": 1200},
+)
+
+QUESTIONS_SYSTEM = (
+    "You are an empathetic medical assistant helping patients understand their care."
+)
+
+QUESTIONS_PROMPT = PromptTemplate(
+    "questions",
+    """
+    As a medical AI assistant, generate 4 brief but relevant and specific questions based on the visit below.
+
+    Generate 4 brief questions that:
+    1. Focus on understanding the diagnosis in simple terms
+    2. Address treatment plans and medications clearly
+    3. Cover potential side effects or complications to watch for
+    4. Include follow-up care instructions
+
+    Rules for questions:
+    1. Keep each question under 8 words
+    2. Focus on the specific diagnosis and treatment
+    3. Use everyday language, no medical jargon
+    4. Make them actionable and practical
+
+    Return ONLY a JSON object in this exact format:
+    {{"questions": ["question1", "question2", "question3", "question4"]}}
+
+    Visit:
+    Chief Complaint: {cc}
+    Diagnosis: {diagnosis}
+    Treatment Plan: {plan}
+    Medications: {meds}
+    """,
+    budgets={"cc": 200, "diagnosis": 300, "plan": 500, "meds": 300},
+)
+
+SUMMARY_SYSTEM = "You are a medical professional summarizing a patient visit record."
+
+SUMMARY_PROMPT = PromptTemplate(
+    "summary",
+    """
+    You are a medical professional translating a visit record into patient-friendly language.
+    Create a clear, reassuring summary that speaks directly to the patient using simple terms and helpful explanations.
+    Format the response in markdown for better readability.
+
+    Create a summary of the visit record below following this structure:
+
+    # Summary of Visit with Dr. [doctor's last name]
+
+    ### When you visited
+    [visit date]
+
+    ### Your main concern
+    [Explain the chief complaint in simple terms]
+
+    ### What you told Dr. [doctor's last name]
+    [Summarize the history of present illness in everyday language]
+
+    ### What We Found
+    **Key findings:** [Explain the findings and vital signs in simple terms]
+
+    **Our understanding:** [Translate the diagnosis into patient-friendly language]
+
+    ### Your Treatment Plan
+    **To manage your symptoms:**
+    [Break down the plan into clear steps]
+
+    **How to do it:**
+    [Explain any interventions as simple steps]
+
+    **When to use it:**
+    [Provide clear guidance on timing and frequency]
+
+    ### Next Steps
+    **Follow-up care:**
+    - [Convert the discharge instructions into clear bullet points]
+    - [Add any lifestyle recommendations]
+    - [Include warning signs to watch for]
+
+    Important notes:
+    - Add extra line breaks between sections for better readability
+    - Use bold text for important points
+    - Keep paragraphs short (2-3 lines maximum)
+    - Explain medical terms in parentheses
+    - Use bullet points for lists
+    - Maintain a warm, reassuring tone
+
+    Visit record:
+    Patient: {first_name} {last_name} (MRN: {mrn})
+    Doctor: Dr. {doctor_first_name} {doctor_last_name}
+    Date: {created_at}
+    Chief complaint: {cc}
+    History of present illness: {hpi}
+    Findings: {findings}
+    Vital signs: {vitals}
+    Diagnosis: {diagnosis}
+    Plan: {plan}
+    Interventions: {interventions}
+    Discharge instructions: {discharge}
+
+    Write the entire response in {language} language.
+    """,
+    budgets={
+        "cc": 200,
+        "hpi": 800,
+        "findings": 600,
+        "vitals": 200,
+        "diagnosis": 300,
+        "plan": 600,
+        "interventions": 400,
+        "discharge": 600,
+    },
+)
+
+# Sent first, ahead of the timeline and frames, so it is a fixed prefix
+VISION_PROMPT = compact(textwrap.dedent("""
+        You are an expert medical professional specialized in visual clinical assessment.
+        Analyze these frames from a medical consultation and focus ONLY on visual medical information that would complement an audio transcription.
+
+        Specifically identify and describe:
+
+        1. Physical Examination Findings:
+        - Visible skin conditions, lesions, or rashes
+        - Patient's mobility and gait patterns
+        - Visible swelling or deformities
+        - Facial expressions indicating pain or discomfort
+        - Any medical devices or supports being used
+
+        2. Visual Clinical Signs:
+        - Patient's general appearance and apparent distress level
+        - Visible breathing patterns or respiratory effort
+        - Apparent neurological signs (tremors, asymmetry, etc.)
+        - Color changes (pallor, cyanosis, jaundice)
+        - Visible wounds, bandages, or surgical sites
+
+        3. Demonstrated Physical Assessments:
+        - Range of motion tests performed
+        - Physical manipulation of joints or limbs
+        - Neurological examination maneuvers
+        - Any medical instruments used and their readings
+        - Demonstration of exercises or techniques
+
+        4. Non-verbal Communication:
+        - Patient's body language indicating comfort/discomfort
+        - Physical demonstrations of symptoms by patient
+        - Doctor's demonstrative instructions or examinations
+
+        5. Environmental/Contextual Information:
+        - Medical equipment visible in the room
+        - Use of assistive devices
+        - Any visible medical imaging or test results
+        - Demonstrated use of medical devices
+
+        Format the response as a structured medical observation report, focusing ONLY on visually observable information that would NOT be captured in audio transcription.
+        If certain categories have no observable information, mark them as 'No visible findings'.
+        """))
+
+
+def chat_messages(system: str, prompt: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt},
+    ]
@@ -0,0 +1,157 @@
+# Standard library imports
+import struct
+import time
+from typing import List, NamedTuple, Optional
+
+# Binary framing for the /ws streaming protocol. Every WebSocket message is one frame:
+#
+#   type (1 byte) | sequence (4 bytes) | timestamp ms (8 bytes) | chunk count (2 bytes)
+#   followed by chunk count x [ length (4 bytes) | payload ]
+#
+# All integers are big-endian. A frame carries one or more payloads of the same type,
+# so a client can batch several audio buffers into a single message.
+
+AUDIO_PACKET = 0x01
+VIDEO_PACKET = 0x02
+
+FRAME_HEADER_FORMAT = "!BIQH"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+CHUNK_HEADER_FORMAT = "!I"
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FORMAT)
+
+MAX_SEQUENCE = 2**32
+
+# How many recent sequence numbers a SequenceTracker remembers
+SEQUENCE_WINDOW = 1024
+SEQUENCE_WINDOW_MASK = (1 << SEQUENCE_WINDOW) - 1
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Frame(NamedTuple):
+    packet_type: int
+    sequence: int
+    timestamp_ms: int
+    chunks: List[memoryview]
+
+
+def encode_frame(
+    packet_type: int,
+    sequence: int,
+    chunks: List[bytes],
+    timestamp_ms: Optional[int] = None,
+) -> bytes:
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    parts = [
+        struct.pack(
+            FRAME_HEADER_FORMAT,
+            packet_type,
+            sequence % MAX_SEQUENCE,
+            timestamp_ms,
+            len(chunks),
+        )
+    ]
+    for chunk in chunks:
+        parts.append(struct.pack(CHUNK_HEADER_FORMAT, len(chunk)))
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def decode_frame(data: bytes) -> Frame:
+    """
+    Split a frame into its header fields and zero-copy views of its payloads
+    """
+    if len(data) < FRAME_HEADER_SIZE:
+        raise ProtocolError(f"Frame too short: {len(data)} bytes")
+
+    packet_type, sequence, timestamp_ms, chunk_count = struct.unpack_from(
+        FRAME_HEADER_FORMAT, data
+    )
+    if packet_type not in (AUDIO_PACKET, VIDEO_PACKET):
+        raise ProtocolError(f"Unknown packet type: {packet_type:#04x}")
+
+    view = memoryview(data)
+    offset = FRAME_HEADER_SIZE
+    chunks = []
+    for _ in range(chunk_count):
+        if offset + CHUNK_HEADER_SIZE > len(data):
+            raise ProtocolError("Truncated chunk header")
+        (length,) = struct.unpack_from(CHUNK_HEADER_FORMAT, data, offset)
+        offset += CHUNK_HEADER_SIZE
+        if offset + length > len(data):
+            raise ProtocolError("Truncated chunk payload")
+        chunks.append(view[offset : offset + length])
+        offset += length
+
+    if offset != len(data):
+        raise ProtocolError(f"{len(data) - offset} trailing bytes after last chunk")
+
+    return Frame(packet_type, sequence, timestamp_ms, chunks)
+
+
+class SequenceTracker:
+    """
+    Counts gaps, late (reordered) and duplicate frames from a stream's sequence numbers.
+
+    The last SEQUENCE_WINDOW sequence numbers are remembered as a bitmask, so a
+    frame that arrives behind the newest one is a duplicate if it was already
+    seen, or a late frame that fills a gap otherwise. Frames older than the
+    window cannot be told apart and are counted as stale.
+    """
+
+    def __init__(self):
+        self.expected: Optional[int] = None
+        # Bit i is set if sequence (expected - 1 - i) has been received
+        self._seen = 0
+        self.received = 0
+        self.missing = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.stale = 0
+
+    def reset(self):
+        """
+        Forget the position in the stream but keep the counts, for a client that
+        reconnects and starts its sequence numbers over
+        """
+        self.expected = None
+        self._seen = 0
+
+    def observe(self, sequence: int):
+        self.received += 1
+        if self.expected is None:
+            self.expected = (sequence + 1) % MAX_SEQUENCE
+            self._seen = 1
+            return
+
+        # Distance ahead of the expected sequence, accounting for wrap-around
+        delta = (sequence - self.expected) % MAX_SEQUENCE
+        if delta < MAX_SEQUENCE // 2:
+            # The newest frame so far; any skipped are missing for now
+            self.missing += delta
+            self.expected = (sequence + 1) % MAX_SEQUENCE
+            self._seen = ((self._seen << (delta + 1)) | 1) & SEQUENCE_WINDOW_MASK
+            return
+
+        age = MAX_SEQUENCE - delta - 1  # 0 for the newest frame received
+        if age >= SEQUENCE_WINDOW:
+            self.stale += 1
+        elif self._seen >> age & 1:
+            self.duplicates += 1
+        else:
+            # A late frame fills one of the gaps counted earlier
+            self._seen |= 1 << age
+            self.reordered += 1
+            self.missing -= 1
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "missing": self.missing,
+            "reordered": self.reordered,
+            "duplicates": self.duplicates,
+            "stale": self.stale,
+        }
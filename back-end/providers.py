@@ -0,0 +1,166 @@
+# Standard library imports
+import asyncio
+import json
+from typing import AsyncIterator, Dict, NamedTuple, Optional
+
+# Third party imports
+import httpx
+
+# Local imports
+from metrics import record_error, record_payload, timed
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ProviderError(Exception):
+    """
+    A provider answered with an error status
+    """
+
+    def __init__(
+        self, name: str, status_code: int, retry_after: Optional[float] = None
+    ):
+        super().__init__(f"{name} API call failed with status code: {status_code}")
+        self.name = name
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """
+    Seconds a provider asked us to wait in its Retry-After header, if it sent one
+    """
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+class Provider(NamedTuple):
+    base_url: str
+    authorization: str
+    max_concurrency: int = 8
+    timeout: float = 60.0
+
+
+class ProviderPool:
+    """
+    One shared async HTTP client for every outbound provider call.
+
+    Connections are kept alive and reused across requests (over HTTP/2 when the
+    h2 package is installed), and each provider gets its own concurrency limit and
+    timeout so a slow provider cannot exhaust the pool for the others.
+    """
+
+    def __init__(
+        self,
+        providers: Dict[str, Provider],
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        connect_timeout: float = 10.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.providers = providers
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.connect_timeout = connect_timeout
+        # Replaces the network, e.g. with stand-in providers for benchmarks
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores = {
+            name: asyncio.Semaphore(provider.max_concurrency)
+            for name, provider in providers.items()
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    def _request_args(self, name: str, path: str, headers: Optional[Dict]):
+        provider = self.providers[name]
+        request_headers = {
+            "Authorization": provider.authorization,
+            "Content-Type": "application/json",
+            **(headers or {}),
+        }
+        timeout = httpx.Timeout(provider.timeout, connect=self.connect_timeout)
+        return provider.base_url + path, request_headers, timeout
+
+    async def post(
+        self,
+        name: str,
+        path: str,
+        json: Optional[Dict] = None,
+        params: Optional[Dict] = None,
+        headers: Optional[Dict] = None,
+        content: Optional[bytes] = None,
+    ) -> httpx.Response:
+        """
+        POST a JSON body, or raw bytes as content with their own Content-Type header
+        """
+        url, request_headers, timeout = self._request_args(name, path, headers)
+        async with self._semaphores[name]:
+            with timed(name, path):
+                response = await self.client.post(
+                    url,
+                    json=json,
+                    content=content,
+                    params=params,
+                    headers=request_headers,
+                    timeout=timeout,
+                )
+                # Callers raise on the status after this returns, outside the timer
+                if response.is_error:
+                    record_error(name, path)
+        record_payload(name, "request", len(response.request.content))
+        record_payload(name, "response", len(response.content))
+        return response
+
+    async def stream_events(
+        self, name: str, path: str, payload: Dict
+    ) -> AsyncIterator[Dict]:
+        """
+        POST a streaming request and yield each server-sent event's JSON data
+        """
+        url, request_headers, timeout = self._request_args(name, path, None)
+        async with self._semaphores[name]:
+            # Timed until the stream ends, so this includes generation time
+            with timed(name, path + " (stream)"):
+                async with self.client.stream(
+                    "POST",
+                    url,
+                    json={**payload, "stream": True},
+                    headers=request_headers,
+                    timeout=timeout,
+                ) as response:
+                    if response.status_code != 200:
+                        raise ProviderError(
+                            name, response.status_code, retry_after(response)
+                        )
+                    record_payload(name, "request", len(response.request.content))
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:") :].strip()
+                        if data == "[DONE]":
+                            break
+                        yield json.loads(data)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
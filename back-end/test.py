@@ -1,11 +1,15 @@
 import asyncio
+import sys
+import uuid
 import websockets
 import cv2
 import pyaudio
 
+from protocol import AUDIO_PACKET, VIDEO_PACKET, encode_frame
 
-async def stream_data():
-    uri = "ws://127.0.0.1:8000/ws"
+
+async def stream_data(session_id: str):
+    uri = f"ws://127.0.0.1:8000/ws?session_id={session_id}"
 
     # --- Initialize audio capture using PyAudio ---
     audio = pyaudio.PyAudio()
@@ -13,6 +17,7 @@ async def stream_data():
     channels = 1
     rate = 16000
     frames_per_buffer = 1024  # adjust as needed
+    buffers_per_frame = 2  # audio buffers batched into one WebSocket message
 
     audio_stream = audio.open(
         format=audio_format,
@@ -27,16 +32,23 @@ async def stream_data():
 
     async with websockets.connect(uri) as websocket:
         try:
+            # Every frame gets the next sequence number so the server can spot gaps
+            sequence = 0
             # Toggle to alternate packet types: True for audio, False for video.
             expecting_audio = True
             while True:
                 if expecting_audio:
-                    # Capture an audio chunk (raw PCM data)
-                    audio_data = audio_stream.read(
-                        frames_per_buffer, exception_on_overflow=False
+                    # Capture a batch of audio chunks (raw PCM data)
+                    audio_chunks = [
+                        audio_stream.read(
+                            frames_per_buffer, exception_on_overflow=False
+                        )
+                        for _ in range(buffers_per_frame)
+                    ]
+                    await websocket.send(
+                        encode_frame(AUDIO_PACKET, sequence, audio_chunks)
                     )
-                    await websocket.send(audio_data)
-                    print("Sent audio packet")
+                    print(f"Sent audio frame {sequence}")
                 else:
                     # Capture a video frame from the webcam
                     ret, frame = video_cap.read()
@@ -47,8 +59,11 @@ async def stream_data():
                     ret, buffer = cv2.imencode(".jpg", frame)
                     if ret:
                         video_data = buffer.tobytes()
-                        await websocket.send(video_data)
-                        print("Sent video packet")
+                        await websocket.send(
+                            encode_frame(VIDEO_PACKET, sequence, [video_data])
+                        )
+                        print(f"Sent video frame {sequence}")
+                sequence += 1
                 # Toggle the packet type for the next iteration.
                 expecting_audio = not expecting_audio
                 await asyncio.sleep(0.1)  # Adjust timing for your data rate
@@ -63,4 +78,7 @@ async def stream_data():
             video_cap.release()
 
 
-asyncio.run(stream_data())
+# Pass the room's session id, or use a fresh one and scan the badge with it
+session_id = sys.argv[1] if len(sys.argv) > 1 else uuid.uuid4().hex
+print(f"Streaming to session {session_id}")
+asyncio.run(stream_data(session_id))
@@ -0,0 +1,72 @@
+# Standard library imports
+import io
+import wave
+
+# Third party imports
+import numpy as np
+
+# Local imports
+from audio import detect_speech, preprocess_audio, write_wav
+from fixtures import synthetic_speech
+from transcription import transcript_from_words
+
+
+def wav_frames(data: bytes) -> int:
+    with wave.open(io.BytesIO(data), "rb") as wav_file:
+        return wav_file.getnframes()
+
+
+def test_trims_pauses_between_speech():
+    samples = synthetic_speech(20, speech=3.0, pause=1.5)
+    processed = preprocess_audio(write_wav(samples, 16000))
+    assert processed.original_duration == 20
+    assert 12 < processed.duration < 18
+
+
+def test_continuous_speech_is_kept():
+    # With no pauses the quietest frames are speech too, not noise
+    samples = synthetic_speech(20, speech=100, pause=0)
+    kept = sum(end - start for start, end in detect_speech(samples[:, 0], 16000))
+    assert kept > 0.95 * len(samples)
+
+    processed = preprocess_audio(write_wav(samples, 16000))
+    assert processed.duration > 19
+
+
+def test_silence_is_dropped():
+    samples = synthetic_speech(10, speech=0, pause=1.0)
+    assert detect_speech(samples[:, 0], 16000) == []
+    assert preprocess_audio(write_wav(samples, 16000)).duration == 0
+
+
+def test_time_map_points_back_into_the_original():
+    # Speech at 0-3s, 4.5-7.5s, 9-12s, ...; trimming closes the 1.5s pauses
+    samples = synthetic_speech(20, speech=3.0, pause=1.5)
+    processed = preprocess_audio(write_wav(samples, 16000))
+    spans = processed.time_map.spans
+    assert len(spans) == 5
+
+    # One second into the second kept stretch is one second into the second
+    # stretch of speech in the original, give or take the VAD padding
+    start, original_start, _ = spans[1]
+    assert abs(original_start - 4.5) < 0.3
+    assert processed.time_map.to_original(start + 1.0) == original_start + 1.0
+    assert processed.time_map.to_original(start + 1.0) > start + 1.0
+
+
+def test_word_times_are_mapped_to_the_original():
+    samples = synthetic_speech(20, speech=3.0, pause=1.5)
+    time_map = preprocess_audio(write_wav(samples, 16000)).time_map
+    start, original_start, _ = time_map.spans[1]
+    words = [
+        {"word": "hello", "start": 0.5, "end": 0.9, "speaker": 0},
+        {"word": "doctor", "start": start + 0.5, "end": start + 0.9, "speaker": 1},
+    ]
+    segments = transcript_from_words(words, time_map.to_original).segments
+    assert [segment.speaker for segment in segments] == [0, 1]
+    assert abs(segments[1].start - (original_start + 0.5)) < 1e-9
+
+
+def test_empty_recording_stays_empty():
+    processed = preprocess_audio(write_wav(np.zeros((0, 1), dtype=np.int16), 16000))
+    assert processed.duration == 0
@@ -0,0 +1,37 @@
+# Local imports
+from extraction import split_transcript
+
+WORDS = ["patient", "reports", "knee", "pain", "since", "Tuesday", "and", "ibuprofen"]
+
+
+def monologue(words: int) -> str:
+    return "Speaker 0: " + " ".join(
+        WORDS[i % len(WORDS)] + str(i) for i in range(words)
+    )
+
+
+def test_short_transcript_is_one_window():
+    text = "Speaker 0: Hello.\n\nSpeaker 1: Hi doctor."
+    assert split_transcript(text, 12000, 1500) == [text]
+
+
+def test_windows_overlap_between_paragraphs():
+    text = "\n\n".join(f"Speaker {i % 2}: " + "word " * 150 + str(i) for i in range(40))
+    windows = split_transcript(text, 3000, 1000)
+    assert len(windows) > 1
+    for previous, window in zip(windows, windows[1:]):
+        last_paragraph = previous.split("\n\n")[-1]
+        assert window.startswith(last_paragraph) or last_paragraph in window
+
+
+def test_long_monologue_windows_overlap():
+    text = monologue(5000)
+    windows = split_transcript(text, 12000, 1500)
+    assert len(windows) > 2
+    for previous, window in zip(windows, windows[1:]):
+        assert len(window) <= 12000
+        # The next window opens with the end of the previous one
+        assert previous[-1000:] in window[:1500]
+    # Every word is in some window
+    words = set(" ".join(windows).split())
+    assert all(word in words for word in text.split())
@@ -0,0 +1,284 @@
+# Standard library imports
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Third party imports
+import numpy as np
+from deepgram import DeepgramClient, LiveOptions, LiveTranscriptionEvents
+
+# How long a finished session waits for Deepgram to return its flushed results
+FINALIZE_TIMEOUT = float(os.environ.get("DEEPGRAM_FINALIZE_TIMEOUT", 5))
+
+
+class TranscriptSegment(NamedTuple):
+    speaker: int
+    start: float  # seconds from the start of the session's audio
+    end: float
+    text: str
+
+
+class LiveTranscript:
+    """
+    Rolling diarized transcript that builds up while a session is streaming
+    """
+
+    def __init__(self):
+        self.segments: List[TranscriptSegment] = []
+
+    def add(self, segment: TranscriptSegment):
+        self.segments.append(segment)
+
+    def text(self) -> str:
+        """
+        Format as speaker paragraphs, like Deepgram's prerecorded paragraph transcript
+        """
+        paragraphs = []
+        speaker = None
+        for segment in sorted(self.segments, key=lambda s: s.start):
+            if segment.speaker == speaker:
+                paragraphs[-1] += " " + segment.text
+            else:
+                speaker = segment.speaker
+                paragraphs.append(f"Speaker {speaker}: {segment.text}")
+        return "\n\n".join(paragraphs)
+
+    def around(self, t: float, max_chars: int = 160, max_gap: float = 5.0) -> str:
+        """
+        What was being said at time t: the segment in progress, or the nearest one
+        within max_gap seconds, cut to about max_chars around t. Segments carry
+        no word times, so the position within one is interpolated.
+        """
+        nearest = None
+        distance = max_gap
+        for segment in self.segments:
+            gap = max(segment.start - t, t - segment.end, 0.0)
+            if gap <= distance:
+                nearest, distance = segment, gap
+        if nearest is None:
+            return ""
+
+        text = nearest.text
+        if len(text) > max_chars:
+            length = nearest.end - nearest.start
+            position = (t - nearest.start) / length if length > 0 else 0.0
+            center = int(len(text) * min(max(position, 0.0), 1.0))
+            start = min(max(0, center - max_chars // 2), len(text) - max_chars)
+            end = start + max_chars
+            # Cut between words
+            if start > 0:
+                space = text.find(" ", start, end)
+                start = space + 1 if space >= 0 else start
+            if end < len(text):
+                space = text.rfind(" ", start, end)
+                end = space if space > start else end
+            excerpt = text[start:end].strip()
+            text = ("..." if start > 0 else "") + excerpt
+            text += "..." if end < len(nearest.text) else ""
+        return f"Speaker {nearest.speaker}: {text}"
+
+
+class LiveTranscriber(ABC):
+    """
+    Receives a session's PCM as it arrives and fills in its LiveTranscript
+    """
+
+    def __init__(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.transcript = LiveTranscript()
+        self.started = False
+
+    async def start(self):
+        self.started = True
+
+    @abstractmethod
+    async def send(self, pcm: bytes): ...
+
+    @abstractmethod
+    async def finish(self) -> LiveTranscript:
+        """
+        Flush any buffered audio, release the engine and return the transcript
+        """
+
+
+class DeepgramLiveTranscriber(LiveTranscriber):
+    """
+    Streams audio to Deepgram's live API and keeps each finalized result
+    """
+
+    def __init__(self, api_key: str, sample_rate: int, channels: int):
+        super().__init__(sample_rate, channels)
+        self.connection = DeepgramClient(api_key).listen.asyncwebsocket.v("1")
+        self.connection.on(LiveTranscriptionEvents.Transcript, self._on_transcript)
+        self.connection.on(LiveTranscriptionEvents.Error, self._on_error)
+        self.connection.on(LiveTranscriptionEvents.Close, self._on_close)
+        # Set when the flushed results have arrived or the connection has closed
+        self.flushed = asyncio.Event()
+        self.finishing = False
+        self.error: Optional[str] = None
+
+    async def start(self):
+        # The SDK reports failures by returning False rather than raising
+        started = await self.connection.start(
+            LiveOptions(
+                model="nova-3",
+                encoding="linear16",
+                sample_rate=self.sample_rate,
+                channels=self.channels,
+                smart_format=True,
+                diarize=True,
+            )
+        )
+        if not started:
+            raise RuntimeError("Could not open a Deepgram live connection")
+        self.started = True
+
+    async def send(self, pcm: bytes):
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        if not await self.connection.send(bytes(pcm)):
+            raise RuntimeError("Could not send audio to Deepgram")
+
+    async def finish(self) -> LiveTranscript:
+        """
+        Flush the audio Deepgram still holds and wait for its final results
+        before closing. The SDK's finish() alone cancels the listener shortly
+        after CloseStream, which drops the end of the transcript.
+        """
+        if self.started:
+            self.finishing = True
+            try:
+                if await self.connection.finalize():
+                    await asyncio.wait_for(self.flushed.wait(), FINALIZE_TIMEOUT)
+                else:
+                    self.error = self.error or "Could not flush the Deepgram stream"
+            except asyncio.TimeoutError:
+                self.error = "Timed out waiting for Deepgram's final results"
+            finally:
+                await self.connection.finish()
+        if self.error is not None:
+            # The caller falls back to transcribing the whole recording
+            raise RuntimeError(self.error)
+        return self.transcript
+
+    async def _on_error(self, _connection, error, **kwargs):
+        self.error = f"Deepgram live error: {getattr(error, 'description', error)}"
+        self.flushed.set()
+
+    async def _on_close(self, _connection, **kwargs):
+        if not self.finishing:
+            self.error = self.error or "Deepgram closed the live connection"
+        self.flushed.set()
+
+    async def _on_transcript(self, _connection, result, **kwargs):
+        if result.from_finalize:
+            # Results for the audio flushed by finish() come last
+            self.flushed.set()
+        if not result.is_final:
+            return
+        alternative = result.channel.alternatives[0]
+        if not alternative.transcript:
+            return
+
+        # Split the result wherever the diarized speaker changes
+        run: List = []
+        for word in alternative.words:
+            if run and word.speaker != run[-1].speaker:
+                self._add_run(run)
+                run = []
+            run.append(word)
+        if run:
+            self._add_run(run)
+
+    def _add_run(self, words: List):
+        self.transcript.add(
+            TranscriptSegment(
+                speaker=words[0].speaker or 0,
+                start=words[0].start,
+                end=words[-1].end,
+                text=" ".join(word.punctuated_word or word.word for word in words),
+            )
+        )
+
+
+class LocalTranscriber(LiveTranscriber):
+    """
+    Offline stand-in for tests and local runs. It marks each stretch of audio
+    above an energy threshold as one placeholder segment instead of recognizing
+    words.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, threshold: float = 500.0):
+        super().__init__(sample_rate, channels)
+        self.threshold = threshold
+        self.position = 0.0
+        self.speech_start: Optional[float] = None
+
+    async def send(self, pcm: bytes):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        duration = len(samples) / (self.sample_rate * self.channels)
+        rms = float(np.sqrt(np.mean(samples**2))) if len(samples) else 0.0
+
+        if rms >= self.threshold and self.speech_start is None:
+            self.speech_start = self.position
+        elif rms < self.threshold and self.speech_start is not None:
+            self._close_segment()
+        self.position += duration
+
+    async def finish(self) -> LiveTranscript:
+        if self.speech_start is not None:
+            self._close_segment()
+        return self.transcript
+
+    def _close_segment(self):
+        start, end = self.speech_start, self.position
+        self.transcript.add(
+            TranscriptSegment(0, start, end, f"[speech {start:.1f}s-{end:.1f}s]")
+        )
+        self.speech_start = None
+
+
+def transcript_from_words(
+    words: List[Dict], to_original: Optional[Callable[[float], float]] = None
+) -> LiveTranscript:
+    """
+    Build a transcript from the word list of a prerecorded Deepgram response,
+    starting a segment wherever the diarized speaker changes. to_original maps
+    word times back onto the original recording when the audio was trimmed.
+    """
+    to_original = to_original or (lambda t: t)
+    transcript = LiveTranscript()
+    run: List[Dict] = []
+    for word in words + [None]:
+        if run and (word is None or word.get("speaker") != run[-1].get("speaker")):
+            transcript.add(
+                TranscriptSegment(
+                    speaker=run[0].get("speaker") or 0,
+                    start=to_original(run[0]["start"]),
+                    end=to_original(run[-1]["end"]),
+                    text=" ".join(w.get("punctuated_word") or w["word"] for w in run),
+                )
+            )
+            run = []
+        if word is not None:
+            run.append(word)
+    return transcript
+
+
+def transcriber_factory_from_env(sample_rate: int, channels: int):
+    """
+    Pick the live transcription engine from TRANSCRIPTION_ENGINE
+    (deepgram, local or none). Defaults to Deepgram when a key is configured.
+    """
+    deepgram_key = os.environ.get("DEEPGRAM_KEY")
+    engine = os.environ.get(
+        "TRANSCRIPTION_ENGINE", "deepgram" if deepgram_key else "none"
+    )
+
+    if engine == "deepgram":
+        return lambda: DeepgramLiveTranscriber(deepgram_key, sample_rate, channels)
+    if engine == "local":
+        return lambda: LocalTranscriber(sample_rate, channels)
+    return None
@@ -0,0 +1,316 @@
+# Standard library imports
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+# Third party imports
+import boto3
+from botocore.config import Config
+
+# Parts are read from disk one at a time, so memory use is about
+# part_size * concurrency however large the recording is
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+# What the backend returns for an uploaded part and needs back to complete the
+# upload, e.g. {"ETag": ..., "ChecksumSHA256": ...}
+Part = Dict[str, str]
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadBackend(ABC):
+    """
+    Object storage that accepts an upload in numbered parts
+    """
+
+    @abstractmethod
+    def create(self, bucket: str, key: str, content_type: str) -> str: ...
+
+    @abstractmethod
+    def upload_part(
+        self, bucket: str, key: str, upload_id: str, number: int, data: bytes
+    ) -> Part: ...
+
+    @abstractmethod
+    def list_parts(self, bucket: str, key: str, upload_id: str) -> Dict[int, Part]: ...
+
+    @abstractmethod
+    def complete(
+        self, bucket: str, key: str, upload_id: str, parts: Dict[int, Part]
+    ): ...
+
+
+class FilesystemBackend(UploadBackend):
+    """
+    Stand-in for object storage that keeps buckets as directories under root.
+    Each part is stored as its own file until the upload is completed.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _parts_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, ".uploads", upload_id)
+
+    def create(self, bucket: str, key: str, content_type: str) -> str:
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._parts_dir(upload_id))
+        return upload_id
+
+    def upload_part(
+        self, bucket: str, key: str, upload_id: str, number: int, data: bytes
+    ) -> Part:
+        path = os.path.join(self._parts_dir(upload_id), str(number))
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return {"ETag": hashlib.sha256(data).hexdigest()}
+
+    def list_parts(self, bucket: str, key: str, upload_id: str) -> Dict[int, Part]:
+        parts_dir = self._parts_dir(upload_id)
+        if not os.path.isdir(parts_dir):
+            raise UploadError(f"Unknown upload {upload_id}")
+        parts = {}
+        for name in os.listdir(parts_dir):
+            if name.isdigit():
+                with open(os.path.join(parts_dir, name), "rb") as f:
+                    parts[int(name)] = {"ETag": hashlib.sha256(f.read()).hexdigest()}
+        return parts
+
+    def complete(self, bucket: str, key: str, upload_id: str, parts: Dict[int, Part]):
+        parts_dir = self._parts_dir(upload_id)
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as dst:
+            for number in sorted(parts):
+                with open(os.path.join(parts_dir, str(number)), "rb") as src:
+                    shutil.copyfileobj(src, dst)
+        os.replace(path + ".tmp", path)
+        shutil.rmtree(parts_dir)
+
+
+class S3Backend(UploadBackend):
+    """
+    S3 multipart uploads through boto3. Works with any S3-compatible endpoint,
+    including Supabase Storage's.
+    """
+
+    def __init__(self, **client_args):
+        # Supabase, like most S3-compatible stores, only serves path-style URLs
+        self.client = boto3.client(
+            "s3", config=Config(s3={"addressing_style": "path"}), **client_args
+        )
+
+    def create(self, bucket: str, key: str, content_type: str) -> str:
+        response = self.client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type, ChecksumAlgorithm="SHA256"
+        )
+        return response["UploadId"]
+
+    def upload_part(
+        self, bucket: str, key: str, upload_id: str, number: int, data: bytes
+    ) -> Part:
+        # S3 rejects the part if its content does not match the checksum
+        checksum = base64.b64encode(hashlib.sha256(data).digest()).decode()
+        response = self.client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+            ChecksumSHA256=checksum,
+        )
+        # Completing an upload created with a checksum algorithm needs every
+        # part's checksum as well as its ETag
+        return {"ETag": response["ETag"], "ChecksumSHA256": checksum}
+
+    def list_parts(self, bucket: str, key: str, upload_id: str) -> Dict[int, Part]:
+        parts = {}
+        paginator = self.client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = {
+                    "ETag": part["ETag"],
+                    "ChecksumSHA256": part["ChecksumSHA256"],
+                }
+        return parts
+
+    def complete(self, bucket: str, key: str, upload_id: str, parts: Dict[int, Part]):
+        self.client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, **parts[number]} for number in sorted(parts)
+                ]
+            },
+        )
+
+
+class ResumableUploader:
+    """
+    Uploads a local file in parts, several at a time, retrying failed parts with
+    backoff.
+
+    Progress is recorded in a manifest next to the file. If the process stops
+    mid-upload, uploading the same file again resumes the same multipart upload
+    and only sends the parts the backend does not already have.
+    """
+
+    def __init__(
+        self,
+        backend: UploadBackend,
+        part_size: int = DEFAULT_PART_SIZE,
+        concurrency: int = 4,
+        retries: int = 4,
+        backoff: float = 0.5,
+    ):
+        self.backend = backend
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+    @staticmethod
+    def manifest_path(path: str) -> str:
+        return path + ".upload.json"
+
+    def _load_manifest(self, path: str, bucket: str, key: str) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path(path)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            manifest.get("bucket") != bucket
+            or manifest.get("key") != key
+            or manifest.get("size") != os.path.getsize(path)
+            or manifest.get("part_size") != self.part_size
+        ):
+            return None
+        return manifest
+
+    async def _retry(self, fn, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.to_thread(fn, *args)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise UploadError(f"{fn.__name__} failed: {e}") from e
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def _read_part(self, path: str, number: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek((number - 1) * self.part_size)
+            return f.read(self.part_size)
+
+    async def upload_file(
+        self, path: str, bucket: str, key: str, content_type: str
+    ) -> str:
+        size = os.path.getsize(path)
+        count = max(1, -(-size // self.part_size))
+
+        manifest = self._load_manifest(path, bucket, key)
+        parts: Dict[int, Part] = {}
+        if manifest is not None:
+            upload_id = manifest["upload_id"]
+            try:
+                parts = await self._retry(
+                    self.backend.list_parts, bucket, key, upload_id
+                )
+                print(f"Resuming upload of {key}: {len(parts)}/{count} parts done")
+            except UploadError:
+                manifest = None
+        if manifest is None:
+            upload_id = await self._retry(
+                self.backend.create, bucket, key, content_type
+            )
+            with open(self.manifest_path(path), "w") as f:
+                json.dump(
+                    {
+                        "bucket": bucket,
+                        "key": key,
+                        "upload_id": upload_id,
+                        "size": size,
+                        "part_size": self.part_size,
+                    },
+                    f,
+                )
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_part(number: int):
+            async with semaphore:
+                data = await asyncio.to_thread(self._read_part, path, number)
+                parts[number] = await self._retry(
+                    self.backend.upload_part, bucket, key, upload_id, number, data
+                )
+
+        missing: List[int] = [n for n in range(1, count + 1) if n not in parts]
+        await asyncio.gather(*(send_part(number) for number in missing))
+        await self._retry(self.backend.complete, bucket, key, upload_id, parts)
+        os.remove(self.manifest_path(path))
+        return key
+
+
+def supabase_s3_credentials() -> Dict[str, Optional[str]]:
+    """
+    Credentials for Supabase Storage's S3 endpoint. Without dedicated S3 access
+    keys, the project's API key is used through session token auth: the access
+    key id is the project ref and the key itself is both secret and token.
+    """
+    access_key = os.environ.get("UPLOAD_S3_ACCESS_KEY")
+    if access_key:
+        return {
+            "aws_access_key_id": access_key,
+            "aws_secret_access_key": os.environ.get("UPLOAD_S3_SECRET_KEY"),
+        }
+    # SUPABASE_URL is https://<project ref>.supabase.co
+    host = urlparse(os.environ.get("SUPABASE_URL", "")).hostname or ""
+    api_key = os.environ.get("SUPABASE_KEY")
+    return {
+        "aws_access_key_id": host.split(".")[0],
+        "aws_secret_access_key": api_key,
+        "aws_session_token": api_key,
+    }
+
+
+def uploader_from_env() -> ResumableUploader:
+    """
+    Build the multipart uploader from UPLOAD_BACKEND. The default, s3, uploads
+    to Supabase Storage's S3 endpoint (or UPLOAD_S3_ENDPOINT); filesystem keeps
+    uploads under UPLOAD_DIR for local runs and tests.
+    """
+    name = os.environ.get("UPLOAD_BACKEND", "s3")
+    if name == "s3":
+        backend = S3Backend(
+            endpoint_url=os.environ.get(
+                "UPLOAD_S3_ENDPOINT",
+                f"{os.environ.get('SUPABASE_URL')}/storage/v1/s3",
+            ),
+            region_name=os.environ.get("UPLOAD_S3_REGION"),
+            **supabase_s3_credentials(),
+        )
+    elif name == "filesystem":
+        backend = FilesystemBackend(os.environ.get("UPLOAD_DIR", "storage"))
+    else:
+        raise UploadError(f"Unknown UPLOAD_BACKEND {name!r}")
+
+    return ResumableUploader(
+        backend,
+        part_size=int(os.environ.get("UPLOAD_PART_SIZE", DEFAULT_PART_SIZE)),
+        concurrency=int(os.environ.get("UPLOAD_CONCURRENCY", 4)),
+        retries=int(os.environ.get("UPLOAD_RETRIES", 4)),
+    )
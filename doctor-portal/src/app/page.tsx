@@ -16,12 +16,15 @@ interface Visit {
 
 export default function Home() {
   const [visits, setVisit] = useState<Visit[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-  async function fetchVisits() {
-    const response = await fetch(API_URL + "/visits");
+  async function fetchVisits(cursor?: string) {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+    const response = await fetch(API_URL + "/visits" + query);
     const data = await response.json();
     console.log("Data: ", data);
-    setVisit(data);
+    setVisit((previous) => (cursor ? [...previous, ...data] : data));
+    setNextCursor(response.headers.get("X-Next-Cursor"));
   }
 
   useEffect(() => {
@@ -89,6 +92,18 @@ export default function Home() {
             </li>
           ))}
         </ul>
+
+        {nextCursor && (
+          <div className="p-6 border-t border-purple-100 flex justify-center">
+            <Button
+              variant="outline"
+              className="text-purple-600 border-purple-200 hover:bg-purple-50"
+              onClick={() => fetchVisits(nextCursor)}
+            >
+              Load more
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -2,6 +2,7 @@
 
 import { useEffect, useState } from "react";
 import Link from "next/link";
+import { Button } from "@/components/ui/button";
 import { Card } from "@/components/ui/card";
 import {
   Select,
@@ -24,17 +25,22 @@ interface Appointment {
 export default function AppointmentList() {
   const [type, setType] = useState("all");
   const [appointments, setAppointments] = useState<Appointment[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
   const filteredAppointments = appointments.filter((appointment) => {
     if (type !== "all" && appointment.type !== type) return false;
     return true;
   });
 
-  async function getPatientVisits() {
-    const response = await fetch(API_URL + `/patient-visits/${PATIENT_MRN}`);
+  async function getPatientVisits(cursor?: string) {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+    const response = await fetch(
+      API_URL + `/patient-visits/${PATIENT_MRN}` + query
+    );
     const data = await response.json();
     console.log("Data: ", data);
-    setAppointments(data);
+    setAppointments((previous) => (cursor ? [...previous, ...data] : data));
+    setNextCursor(response.headers.get("X-Next-Cursor"));
   }
 
   useEffect(() => {
@@ -98,6 +104,18 @@ export default function AppointmentList() {
           </Link>
         ))}
       </div>
+
+      {nextCursor && (
+        <div className="flex justify-center">
+          <Button
+            variant="outline"
+            className="text-purple-600 border-purple-200 hover:bg-purple-50"
+            onClick={() => getPatientVisits(nextCursor)}
+          >
+            Load more
+          </Button>
+        </div>
+      )}
     </div>
   );
 }
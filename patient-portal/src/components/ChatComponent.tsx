@@ -23,6 +23,7 @@ export function ChatComponent({ context, visitId }: ChatComponentProps) {
   const [input, setInput] = useState("");
   const [suggestedQuestions, setSuggestedQuestions] = useState<string[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const [error, setError] = useState<string | null>(null);
   //const { t, i18n } = useTranslation()
 
   // Fetch suggested questions when component mounts
@@ -149,9 +150,10 @@ export function ChatComponent({ context, visitId }: ChatComponentProps) {
     setMessages(updatedMessages);
     setInput("");
     setIsLoading(true);
+    setError(null);
 
     try {
-      const response = await fetch(API_URL + "/chat", {
+      const response = await fetch(API_URL + "/chat/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -160,18 +162,51 @@ export function ChatComponent({ context, visitId }: ChatComponentProps) {
         body: JSON.stringify(updatedMessages),
       });
 
-      const data = await response.json();
-      const aiResponse = data.choices[0].message.content;
-      setMessages([
-        ...updatedMessages,
-        {
-          role: "assistant",
-          content: aiResponse,
-        },
-      ]);
+      if (!response.ok) {
+        throw new Error(`Chat request failed with status ${response.status}`);
+      }
+
+      // Read the Server-Sent Events stream and append each token as it arrives
+      const reader = response.body!.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let aiResponse = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop() ?? "";
+        for (const event of events) {
+          // Unnamed events carry tokens; "done" and "error" are named
+          if (event.startsWith("event: error")) {
+            const data = event
+              .split("\n")
+              .find((line) => line.startsWith("data: "));
+            throw new Error(
+              data
+                ? JSON.parse(data.slice("data: ".length)).detail
+                : "Chat stream failed"
+            );
+          }
+          if (!event.startsWith("data: ")) continue;
+          aiResponse += JSON.parse(event.slice("data: ".length)).delta;
+          setMessages([
+            ...updatedMessages,
+            {
+              role: "assistant",
+              content: aiResponse,
+            },
+          ]);
+          setIsLoading(false);
+        }
+      }
       setIsLoading(false);
     } catch (error) {
       console.error("Error getting AI response:", error);
+      setError(
+        "Sorry, something went wrong getting a reply. Please try again."
+      );
       setIsLoading(false);
     }
   };
@@ -264,6 +299,13 @@ export function ChatComponent({ context, visitId }: ChatComponentProps) {
               </div>
             </div>
           )}
+          {error && (
+            <div className="flex justify-start">
+              <div className="bg-red-50 text-red-700 rounded-lg p-3 text-sm">
+                {error}
+              </div>
+            </div>
+          )}
         </div>
 
         {/* Input Form */}
@@ -47,18 +47,29 @@ export default function VisitDetails({ id }: { id: string }) {
       .then((data) => setVisit(data));
   }, [id]);*/
 
-  const getVisitSummary = async () => {
-    const response = await fetch(API_URL + `/visit-summary/${id}`);
-    const data = await response.json();
-    console.log(data);
-    setIsLoading(false);
-    setVisitSummary(data);
-  };
-
   useEffect(() => {
-    if (id) {
-      getVisitSummary();
+    if (!id) {
+      return;
     }
+    // Render the summary token by token as the server streams it
+    const source = new EventSource(API_URL + `/visit-summary/${id}/stream`);
+    let summary = "";
+    source.onmessage = (event) => {
+      summary += JSON.parse(event.data).delta;
+      setIsLoading(false);
+      setVisitSummary(summary);
+    };
+    source.addEventListener("done", () => source.close());
+    source.addEventListener("error", () => {
+      source.close();
+      setIsLoading(false);
+      if (!summary) {
+        setVisitSummary(
+          "We couldn't load your visit summary right now. Please try again later."
+        );
+      }
+    });
+    return () => source.close();
   }, [id]);
   // react-hooks/exhaustive-deps
 